@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import time
+import queue
+import pickle
+import threading
+import multiprocessing.connection
+from importlib import import_module
+from multiprocessing import Pipe
+from multiprocessing import Process
+
+BACKENDS = ('process', 'thread')
+
+
+# how often blocked end of thread pipe checks whether the other end was closed
+_CLOSED_CHECK_SECONDS = 0.1
+# how often wait checks thread pipes for chunks
+_READY_CHECK_SECONDS = 0.01
+
+
+class ThreadConnection:
+    '''
+    One end of in-process pipe with the same methods as multiprocessing connection uses in pipeline.
+    Bytes are passed by reference, queue is bounded like pipe buffer is.
+    Pipe closed by either end is closed for both: sending raises BrokenPipeError,
+    receiving raises EOFError once chunks sent before are received.
+    '''
+
+    def __init__(self, chunks: queue.Queue, closed: threading.Event):
+        self._chunks = chunks
+        self._closed = closed
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def send_bytes(self, data):
+        while True:
+            if self._closed.is_set():
+                raise BrokenPipeError('thread pipe is closed')
+            try:
+                self._chunks.put(data, timeout=_CLOSED_CHECK_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def send(self, obj):
+        self.send_bytes(pickle.dumps(obj))
+
+    def recv_bytes(self):
+        while True:
+            try:
+                return self._chunks.get(timeout=_CLOSED_CHECK_SECONDS)
+            except queue.Empty:
+                if self._closed.is_set():
+                    raise EOFError('thread pipe is closed') from None
+
+    def poll(self):
+        return not self._chunks.empty() or self._closed.is_set()
+
+    def close(self):
+        self._closed.set()
+
+
+class ThreadStage(threading.Thread):
+    '''
+    Stage of pipeline in thread, exit code tells whether target failed like exit code of process does.
+    Failed stage closes every thread pipe it was given, so stages on the other ends do not wait for it forever.
+    '''
+
+    def __init__(self, target=None, kwargs=None):
+        super().__init__(target=target, kwargs=kwargs)
+        self.exitcode = None
+        self._connections = [
+            connection
+            for value in (kwargs or {}).values()
+            for connection in (value if isinstance(value, list) else [value])
+            if isinstance(connection, ThreadConnection)
+        ]
+
+    def run(self):
+        try:
+            super().run()
+        except BaseException:
+            self.exitcode = 1
+            for connection in self._connections:
+                connection.close()
+            raise
+        self.exitcode = 0
+
+
+def thread_pipe(depth: int = 16):
+    '''
+    Same as Pipe(duplex=False): receiving and sending end
+    '''
+    chunks, closed = queue.Queue(maxsize=depth), threading.Event()
+    return ThreadConnection(chunks, closed), ThreadConnection(chunks, closed)
+
+
+def wait_connections(connections: list):
+    '''
+    Connections that have something to receive, or that are closed, out of given ones.
+    Blocks until there is at least one, like multiprocessing.connection.wait that is used for pipes.
+    '''
+    if not any(isinstance(connection, ThreadConnection) for connection in connections):
+        return multiprocessing.connection.wait(connections)
+    while not (ready := [connection for connection in connections if connection.poll()]):
+        time.sleep(_READY_CHECK_SECONDS)
+    return ready
+
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled() if is_gil_enabled is not None else True
+
+
+def pipeline_runtime(backend: str):
+    '''
+    Functions that make pipe and start stage of pipeline for given backend.
+    Stages of thread backend share market data and chunks in one process,
+    they run in parallel where kernels release GIL, or everywhere on free-threaded Python.
+    '''
+    if backend == 'thread':
+        # pyplot is used from plotter threads, interactive backends want main thread
+        import_module('matplotlib').use('Agg')
+        return thread_pipe, ThreadStage
+    return lambda: Pipe(duplex=False), Process
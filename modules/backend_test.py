@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pickle
+import pytest
+from modules import backend
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.simulator import simulator_process_func
+
+ASSETS = ['A', 'B', 'C', 'D']
+MARKET = {
+    2000: [1.03, 1.04, 1.05, 0.97],
+    2001: [1.01, 0.91, 1.09, 1.10],
+    2002: [0.99, 1.09, 0.91, 1.02],
+    2003: [1.02, 1.12, 1.08, 0.95],
+}
+
+
+def _pipeline_stream(backend_name: str):
+    '''
+    Chunks of simulator that went through multiplexer, weights of every selector
+    '''
+    pipe, stage = backend.pipeline_runtime(backend_name)
+    simulated_source, simulated_sink = pipe()
+    source, sink = pipe()
+    stages = [
+        stage(target=simulator_process_func, kwargs={
+            'assets': ASSETS,
+            'percentage_step': 10,
+            'year_range_selector_funcs': [data_filter.years_first_to_last, data_filter.years_all_to_all],
+            'asset_gain_per_year': MARKET,
+            'sink': simulated_sink,
+            'chunk_size': 7,
+            'backend': backend_name,
+        }),
+        stage(target=data_filter.queue_multiplexer, kwargs={'source': simulated_source, 'sinks': [sink]}),
+    ]
+    for pipeline_stage in stages:
+        pipeline_stage.start()
+    selectors_portfolios = [[], []]
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    while (bytes_from_pipe := source.recv_bytes()) != data_stream_end_pickle:
+        selector_idx, data = data_source.untagged_chunk(bytes_from_pipe)
+        selectors_portfolios[selector_idx].extend(
+            (tuple(portfolio.weights), portfolio.stat[Portfolio.STAT_SHARPE])
+            for portfolio in Portfolio.deserialize_iter(bytes(data), ASSETS))
+    for pipeline_stage in stages:
+        pipeline_stage.join()
+    assert [pipeline_stage.exitcode for pipeline_stage in stages] == [0, 0]
+    return [sorted(selector_portfolios) for selector_portfolios in selectors_portfolios]
+
+
+def test_thread_backend_matches_process_backend():
+    process_stream = _pipeline_stream('process')
+    assert len(process_stream[0]) == data_source.count_possible_allocations(len(ASSETS), 10)
+    assert _pipeline_stream('thread') == process_stream
+
+
+def test_thread_pipe():
+    source, sink = backend.thread_pipe(depth=2)
+    data = b'chunk'
+    sink.send_bytes(data)
+    sink.send(data_source.DataStreamFinished())
+    assert source.recv_bytes() is data
+    assert source.recv_bytes() == pickle.dumps(data_source.DataStreamFinished())
+    sink.send_bytes(data)
+    sink.close()
+    with pytest.raises(BrokenPipeError):
+        sink.send_bytes(data)
+    assert source.recv_bytes() is data
+    with pytest.raises(EOFError):
+        source.recv_bytes()
+
+
+def _failing_consumer(source):
+    source.recv_bytes()
+    raise RuntimeError('consumer failed')
+
+
+def _consumer(source, received: list):
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    while (bytes_from_pipe := source.recv_bytes()) != data_stream_end_pickle:
+        received.append(bytes_from_pipe)
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_failed_thread_stage_closes_its_pipes():
+    pipe, stage = backend.pipeline_runtime('thread')
+    simulated_source, simulated_sink = pipe()
+    failing_source, failing_sink = pipe()
+    source, sink = pipe()
+    received = []
+    stages = [
+        stage(target=data_filter.queue_multiplexer, kwargs={
+            'source': simulated_source, 'sinks': [failing_sink, sink], 'depth': 2}),
+        stage(target=_failing_consumer, kwargs={'source': failing_source}),
+        stage(target=_consumer, kwargs={'source': source, 'received': received}),
+    ]
+    for pipeline_stage in stages:
+        pipeline_stage.start()
+    chunks = [bytes([chunk_idx]) * 8 for chunk_idx in range(100)]
+    for chunk in chunks:
+        simulated_sink.send_bytes(chunk)
+    simulated_sink.send(data_source.DataStreamFinished())
+    for pipeline_stage in stages:
+        pipeline_stage.join(timeout=30)
+    assert [pipeline_stage.exitcode for pipeline_stage in stages] == [0, 1, 0]
+    assert received == chunks
+    assert failing_sink.closed and not sink.closed
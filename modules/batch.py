@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import csv
+import json
+import math
+import logging
+from itertools import batched
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from modules import data_source
+from modules import profiling
+from modules import data_filter
+from modules import data_output
+from modules.portfolio import Portfolio
+from modules.rebalancing import RebalancingPolicy
+
+# Y, X
+FRONTIER_COORD_PAIR = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+
+
+# pylint: disable=too-many-return-statements
+def scenario_config_error(scenario: dict):
+    '''
+    Description of what is wrong with scenario from manifest, empty string if it is valid.
+    Assets are checked against its returns file by scenario_assets_error
+    '''
+    if not isinstance(scenario, dict):
+        return f'scenario {scenario} is not an object'
+    if not isinstance(scenario.get('name'), str) or scenario['name'] == '':
+        return f'scenario {scenario} has no name'
+    if not os.path.isfile(scenario.get('returns', '')):
+        return f'returns file "{scenario.get("returns")}" of scenario "{scenario["name"]}" does not exist'
+    if 'precision' in scenario and (
+            not isinstance(scenario['precision'], int) or scenario['precision'] <= 0 or
+            100 % scenario['precision'] != 0):
+        return f'precision of scenario "{scenario["name"]}" must be a divisor of 100'
+    if 'years' in scenario and scenario['years'] not in data_filter.year_selectors():
+        return f'unknown years "{scenario["years"]}" of scenario "{scenario["name"]}"'
+    if 'assets' in scenario and len(scenario['assets']) == 0:
+        return f'scenario "{scenario["name"]}" has no assets'
+    return ''
+
+
+def scenario_assets_error(scenario: dict, market_assets: list[str]):
+    '''
+    Description of assets of scenario that are not in its returns, empty string if there are none
+    '''
+    unknown_assets = set(scenario.get('assets', [])) - set(market_assets)
+    if unknown_assets:
+        return f'assets {unknown_assets} of scenario "{scenario["name"]}" are not in {scenario["returns"]}'
+    return ''
+
+
+def load_scenario(scenario: dict, market: tuple, default_precision: int, default_year_selector: str):
+    '''
+    Scenario from manifest with market data (assets, returns) of its returns file restricted to its assets
+    '''
+    market_assets, market_yearly_gain = market
+    assets = scenario.get('assets', market_assets)
+    return {
+        'name': scenario['name'],
+        'returns': scenario['returns'],
+        'assets': assets,
+        'precision': scenario.get('precision', default_precision),
+        'years': scenario.get('years', default_year_selector),
+        'asset_gain_per_year': market_yearly_gain.subset([market_assets.index(asset) for asset in assets]),
+    }
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+def slice_frontiers(
+        slice_idx: int, slice_size: int,
+        assets_n: int, percentage_step: int,
+        markets: list[tuple[list[str], dict[int, list[float]], list[str]]],
+        chunk_size: int = 2**12,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Simulate slice of allocations in every market (assets, returns, year selector names)
+    and keep only frontier portfolios.
+    Batch of allocations is simulated at once, yearly gains are computed once per market for all its selectors.
+    Returns frontier for every selector of every market.
+    '''
+    selector_funcs = data_filter.year_selectors()
+    frontiers = [[[] for _ in year_selectors] for _, _, year_selectors in markets]
+    allocations = islice(
+        data_source.all_possible_allocations(assets_n, percentage_step, start=slice_idx * slice_size), slice_size)
+    for allocations_batch in batched(allocations, chunk_size):
+        for market_idx, (assets, asset_gain_per_year, year_selectors) in enumerate(markets):
+            selectors_portfolios = Portfolio.simulated_batch(
+                allocations_batch, assets,
+                [selector_funcs[year_selector] for year_selector in year_selectors], asset_gain_per_year,
+                rebalancing=rebalancing)
+            for selector_idx, selector_portfolios in enumerate(selectors_portfolios):
+                frontiers[market_idx][selector_idx] = data_filter.pareto_frontier(
+                    frontiers[market_idx][selector_idx] + selector_portfolios, FRONTIER_COORD_PAIR)
+    return frontiers
+
+
+def _batch_jobs(scenarios: list[dict], slices_per_job: int):
+    '''
+    Scenarios that have the same number of assets and precision share single enumeration of allocations,
+    scenarios that also have the same returns and assets share yearly gains of portfolios
+    '''
+    jobs = {}
+    for scenario_idx, scenario in enumerate(scenarios):
+        job = jobs.setdefault((len(scenario['assets']), scenario['precision']), {'markets': {}})
+        market = job['markets'].setdefault(
+            (scenario['returns'], tuple(scenario['assets'])),
+            {'scenario_indexes': [], 'asset_gain_per_year': scenario['asset_gain_per_year']})
+        market['scenario_indexes'].append(scenario_idx)
+    for (assets_n, precision), job in jobs.items():
+        job['allocations'] = data_source.count_possible_allocations(assets_n, precision)
+        job['slice_size'] = math.ceil(job['allocations'] / slices_per_job)
+        job['slices'] = math.ceil(job['allocations'] / job['slice_size'])
+    return jobs
+
+
+# pylint: disable=too-many-locals
+def run_batch(
+        scenarios: list[dict], directory: str, slices_per_job: int = 0, rebalancing: RebalancingPolicy = None):
+    '''
+    Find frontier of every scenario in single process pool, enumerations of all jobs run concurrently.
+    Returns frontier portfolios of every scenario.
+    '''
+    slices_per_job = slices_per_job or os.cpu_count() * 4
+    jobs = _batch_jobs(scenarios, slices_per_job)
+    frontiers = [[] for _ in scenarios]
+    with ProcessPoolExecutor(initializer=profiling.profile_process, initargs=('batch-pool',)) as process_pool:
+        futures = {}
+        for (assets_n, precision), job in jobs.items():
+            markets = list(job['markets'].items())
+            market_args = [
+                (list(assets), market['asset_gain_per_year'],
+                 [scenarios[scenario_idx]['years'] for scenario_idx in market['scenario_indexes']])
+                for (_, assets), market in markets
+            ]
+            logging.info('%d scenarios share %d allocations of %d assets with precision %d',
+                         sum(len(market['scenario_indexes']) for _, market in markets),
+                         job['allocations'], assets_n, precision)
+            for slice_idx in range(job['slices']):
+                future = process_pool.submit(
+                    slice_frontiers, slice_idx, job['slice_size'], assets_n, precision, market_args,
+                    rebalancing=rebalancing)
+                futures[future] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            for (_, market), market_frontiers in zip(job['markets'].items(), future.result()):
+                for scenario_idx, selector_frontier in zip(market['scenario_indexes'], market_frontiers):
+                    frontiers[scenario_idx] = data_filter.pareto_frontier(
+                        frontiers[scenario_idx] + selector_frontier, FRONTIER_COORD_PAIR)
+            job['slices'] -= 1
+            if job['slices'] == 0:
+                for _, market in job['markets'].items():
+                    for scenario_idx in market['scenario_indexes']:
+                        logging.info('scenario "%s": %d frontier portfolios',
+                                     scenarios[scenario_idx]['name'], len(frontiers[scenario_idx]))
+    write_summary(scenarios, frontiers, jobs, directory)
+    return frontiers
+
+
+def write_summary(scenarios: list[dict], frontiers: list[list[Portfolio]], jobs: dict, directory: str):
+    '''
+    summary.json and summary.csv with frontier of every scenario, frontiers.png with all frontiers
+    '''
+    os.makedirs(directory, exist_ok=True)
+    summary = []
+    for scenario, frontier in zip(scenarios, frontiers):
+        summary.append({
+            'name': scenario['name'],
+            'returns': scenario['returns'],
+            'assets': scenario['assets'],
+            'precision': scenario['precision'],
+            'years': scenario['years'],
+            'portfolios': jobs[(len(scenario['assets']), scenario['precision'])]['allocations'],
+            'frontier': [
+                {
+                    'allocation': {
+                        asset: weight for asset, weight in zip(portfolio.assets, portfolio.weights) if weight > 0
+                    },
+                    'stats': {stat: portfolio.stat[stat] for stat in Portfolio.SERIALIZED_STATS},
+                }
+                for portfolio in frontier
+            ],
+        })
+    with open(os.path.join(directory, 'summary.json'), 'w', encoding='utf-8') as json_file:
+        json.dump(summary, json_file, ensure_ascii=False, indent=2)
+    with open(os.path.join(directory, 'summary.csv'), 'w', encoding='utf-8', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['scenario', *Portfolio.SERIALIZED_STATS, 'allocation'])
+        for scenario_summary in summary:
+            for point in scenario_summary['frontier']:
+                csv_writer.writerow([
+                    scenario_summary['name'],
+                    *(point['stats'][stat] for stat in Portfolio.SERIALIZED_STATS),
+                    ' '.join(f'{asset}={weight}%' for asset, weight in point['allocation'].items()),
+                ])
+    data_output.draw_frontiers(
+        frontiers={
+            scenario['name']: [
+                (portfolio.stat[FRONTIER_COORD_PAIR[1]], portfolio.stat[FRONTIER_COORD_PAIR[0]])
+                for portfolio in frontier
+            ]
+            for scenario, frontier in zip(scenarios, frontiers)
+        },
+        xlabel=FRONTIER_COORD_PAIR[1],
+        ylabel=FRONTIER_COORD_PAIR[0],
+        title=f'{FRONTIER_COORD_PAIR[0]} vs {FRONTIER_COORD_PAIR[1]} frontiers',
+        directory=directory,
+        filename='frontiers')
+    logging.info('batch summary: %s', directory)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import random
+from modules import batch
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+
+
+def _write_returns(path, assets, seed):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as csv_file:
+        csv_file.write(','.join(['Year'] + assets) + '\n')
+        for year in range(2000, 2012):
+            csv_file.write(','.join([str(year)] + [f'{rng.uniform(-30, 40):.2f}%' for _ in assets]) + '\n')
+
+
+def _expected_frontier(scenario):
+    selector = data_filter.year_selectors()[scenario['years']]
+    portfolios = [
+        Portfolio(allocation, scenario['assets']).simulated(selector, scenario['asset_gain_per_year'])
+        for allocation in data_source.all_possible_allocations(len(scenario['assets']), scenario['precision'])
+    ]
+    return data_filter.pareto_frontier(portfolios, batch.FRONTIER_COORD_PAIR)
+
+
+def test_run_batch(tmp_path):
+    _write_returns(tmp_path / 'base.csv', ['A', 'B', 'C', 'D'], seed=0)
+    _write_returns(tmp_path / 'stress.csv', ['A', 'B', 'C', 'D'], seed=1)
+    manifest = [
+        {'name': 'base', 'returns': str(tmp_path / 'base.csv')},
+        {'name': 'base-window', 'returns': str(tmp_path / 'base.csv'), 'years': 'window-3'},
+        {'name': 'stress', 'returns': str(tmp_path / 'stress.csv'), 'assets': ['D', 'B', 'A']},
+        {'name': 'base-subset', 'returns': str(tmp_path / 'base.csv'), 'assets': ['A', 'C', 'D']},
+        {'name': 'coarse', 'returns': str(tmp_path / 'base.csv'), 'assets': ['A', 'B'], 'precision': 20},
+    ]
+    assert all(batch.scenario_config_error(scenario) == '' for scenario in manifest)
+    markets = {
+        returns: data_source.read_capitalgain_csv_data(returns)
+        for returns in {scenario['returns'] for scenario in manifest}
+    }
+    assert all(batch.scenario_assets_error(scenario, markets[scenario['returns']][0]) == '' for scenario in manifest)
+    scenarios = [batch.load_scenario(scenario, markets[scenario['returns']], 10, 'all-to-all') for scenario in manifest]
+    frontiers = batch.run_batch(scenarios, directory=str(tmp_path / 'batch'), slices_per_job=3)
+
+    for scenario, frontier in zip(scenarios, frontiers):
+        expected = _expected_frontier(scenario)
+        assert [portfolio.weights for portfolio in frontier] == [portfolio.weights for portfolio in expected]
+        assert [portfolio.stat for portfolio in frontier] == [portfolio.stat for portfolio in expected]
+        assert frontier[0].assets == scenario['assets']
+
+    with open(tmp_path / 'batch' / 'summary.json', encoding='utf-8') as json_file:
+        summary = json.load(json_file)
+    assert [scenario_summary['name'] for scenario_summary in summary] == [scenario['name'] for scenario in manifest]
+    assert [len(scenario_summary['frontier']) for scenario_summary in summary] == list(map(len, frontiers))
+    assert summary[4]['portfolios'] == 6
+    assert (tmp_path / 'batch' / 'summary.csv').exists()
+    assert (tmp_path / 'batch' / 'frontiers.png').exists()
+
+
+def test_scenario_config_error(tmp_path):
+    _write_returns(tmp_path / 'base.csv', ['A', 'B'], seed=0)
+    returns = str(tmp_path / 'base.csv')
+    assert batch.scenario_config_error({'name': 'ok', 'returns': returns, 'precision': 25}) == ''
+    assert batch.scenario_config_error({'returns': returns}) != ''
+    assert batch.scenario_config_error({'name': 'x', 'returns': str(tmp_path / 'missing.csv')}) != ''
+    assert batch.scenario_config_error({'name': 'x', 'returns': returns, 'precision': 7}) != ''
+    assert batch.scenario_config_error({'name': 'x', 'returns': returns, 'years': 'never'}) != ''
+    assert batch.scenario_config_error({'name': 'x', 'returns': returns, 'assets': []}) != ''
+    assert batch.scenario_assets_error({'name': 'x', 'returns': returns, 'assets': ['A', 'Z']}, ['A', 'B']) != ''
+    assert batch.scenario_assets_error({'name': 'x', 'returns': returns, 'assets': ['B']}, ['A', 'B']) == ''
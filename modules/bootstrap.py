@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import csv
+import logging
+from itertools import batched
+from contextlib import ExitStack
+from importlib import import_module
+from collections.abc import Callable
+from modules import stats
+from modules import data_source
+from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+from modules.rebalancing import RebalancedGains
+
+# percentiles of stat over synthetic histories reported next to its mean
+BANDS = (5, 50, 95)
+# gains of allocations in all histories that are evaluated at once
+_GAINS_PER_BATCH = 2**22
+
+
+def synthetic_histories(
+        asset_gain_per_year: dict[int, list[float]], histories: int, block_size: int,
+        length: int = None, seed: int = 0):
+    '''
+    Circular block bootstrap of yearly asset gains: every history is made of blocks of consecutive years
+    that start at random year and wrap around the last one, so crises and recoveries stay together.
+    Returns array of shape (histories, length, assets), length is number of years by default.
+    '''
+    np = import_module('numpy')
+    years = sorted(asset_gain_per_year.keys())
+    asset_gains = np.array([asset_gain_per_year[year] for year in years], dtype=np.float64)
+    length = length or len(years)
+    block_size = max(1, min(block_size, len(years)))
+    blocks = -(-length // block_size)
+    starts = np.random.default_rng(seed).integers(0, len(years), size=(histories, blocks))
+    year_indexes = (starts[:, :, None] + np.arange(block_size)) % len(years)
+    return asset_gains[year_indexes.reshape(histories, -1)[:, :length]]
+
+
+def _histories_gains(weights, histories, rebalancing: RebalancingPolicy = None):
+    '''
+    Gains of every portfolio in every history, shared by all selectors: array of (portfolios * histories, years)
+    for yearly rebalancing, RebalancedGains of every history otherwise
+    '''
+    np = import_module('numpy')
+    if rebalancing is not None and not rebalancing.is_yearly():
+        # holdings of all portfolios are tracked at once, history by history
+        return [RebalancedGains(weights, history, rebalancing) for history in histories]
+    # assets are summed one by one like in stats.annual_gains
+    gains = np.zeros((len(weights), histories.shape[0], histories.shape[1]), dtype=np.float64)
+    for asset_idx in range(histories.shape[2]):
+        gains += weights[:, asset_idx, None, None] * histories[None, :, :, asset_idx]
+    return (gains / 100).reshape(len(weights) * histories.shape[0], histories.shape[1])
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+def resampled_stats(
+        weights, histories, year_range_selector_funcs: list[Callable],
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS, bands: tuple[int, ...] = BANDS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Stats of every portfolio in every synthetic history at once, gains are tensor of (portfolios, histories, years).
+    Returns for every selector dict of stat name to its mean, shape (portfolios,),
+    and percentiles, shape (portfolios, bands), over histories.
+    '''
+    np = import_module('numpy')
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, histories.shape[2])
+    portfolios, histories_n, length = len(weights), histories.shape[0], histories.shape[1]
+    gains = _histories_gains(weights, histories, rebalancing)
+    years = list(range(length))
+    selectors_stats = []
+    for year_range_selector_func in year_range_selector_funcs:
+        if isinstance(gains, list):
+            histories_values = [
+                stats.simulated_stats(years, history_gains, year_range_selector_func, stat_names)
+                for history_gains in gains
+            ]
+            values = {
+                stat_name: np.column_stack([history_values[stat_name] for history_values in histories_values])
+                for stat_name in stat_names
+            }
+        else:
+            values = stats.simulated_stats(years, gains, year_range_selector_func, stat_names)
+        selector_stats = {}
+        for stat_name in stat_names:
+            stat_values = values[stat_name].reshape(portfolios, histories_n)
+            with np.errstate(invalid='ignore'):
+                selector_stats[stat_name] = {
+                    'mean': stat_values.mean(axis=1),
+                    'percentiles': np.percentile(stat_values, bands, axis=1).T,
+                }
+        selectors_stats.append(selector_stats)
+    return selectors_stats
+
+
+def band_columns(stat_names: tuple[str, ...], bands: tuple[int, ...] = BANDS):
+    return [
+        column for stat_name in stat_names
+        for column in (f'{stat_name} mean', *(f'{stat_name} p{band}' for band in bands))
+    ]
+
+
+def _band_rows(assets: list[str], weights, selector_stats: dict, stat_names: tuple[str, ...]):
+    np = import_module('numpy')
+    columns = [
+        column
+        for stat_name in stat_names
+        for column in (selector_stats[stat_name]['mean'][:, None], selector_stats[stat_name]['percentiles'])
+    ]
+    values = np.hstack(columns).tolist()
+    for allocation, row in zip(weights, values):
+        yield [' '.join(f'{asset}={weight}%' for asset, weight in zip(assets, allocation) if weight > 0), *row]
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def run_bootstrap(
+        assets: list[str],
+        percentage_step: int,
+        year_selectors: list[str],
+        year_range_selector_funcs: list[Callable],
+        asset_gain_per_year: dict[int, list[float]],
+        static_portfolios: list[Portfolio],
+        directory: str,
+        histories: int,
+        block_size: int,
+        seed: int = 0,
+        constraints: AllocationConstraints = None,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Mean and percentile bands of every stat over synthetic histories for every allocation,
+    written to csv per year range selector. Bands of static portfolios are logged.
+    '''
+    synthetic = synthetic_histories(asset_gain_per_year, histories, block_size, seed=seed)
+    logging.info('%d synthetic histories of %d years in blocks of %d years, seed %d',
+                 histories, synthetic.shape[1], block_size, seed)
+    if static_portfolios:
+        static_weights = [portfolio.weights for portfolio in static_portfolios]
+        for year_selector, selector_stats in zip(
+                year_selectors,
+                resampled_stats(static_weights, synthetic, year_range_selector_funcs, stat_names,
+                                rebalancing=rebalancing)):
+            for row in _band_rows(assets, static_weights, selector_stats, stat_names):
+                logging.info('%s %s: %s', year_selector, row[0], ', '.join(
+                    f'{column} {value:.3f}' for column, value in zip(band_columns(stat_names), row[1:])))
+
+    os.makedirs(directory, exist_ok=True)
+    with ExitStack() as csv_files:
+        csv_writers = [
+            csv.writer(csv_files.enter_context(
+                open(os.path.join(directory, f'{year_selector}.csv'), 'w', encoding='utf-8', newline='')))
+            for year_selector in year_selectors
+        ]
+        for csv_writer in csv_writers:
+            csv_writer.writerow(['allocation', *band_columns(stat_names)])
+        chunk_size = max(1, _GAINS_PER_BATCH // (synthetic.shape[0] * synthetic.shape[1]))
+        allocations_done = 0
+        for weights in batched(
+                data_source.all_possible_allocations(len(assets), percentage_step, constraints), chunk_size):
+            selectors_stats = resampled_stats(
+                weights, synthetic, year_range_selector_funcs, stat_names, rebalancing=rebalancing)
+            for csv_writer, selector_stats in zip(csv_writers, selectors_stats):
+                csv_writer.writerows(_band_rows(assets, weights, selector_stats, stat_names))
+            allocations_done += len(weights)
+    logging.info('bands of %d portfolios over %d histories: %s', allocations_done, histories, directory)
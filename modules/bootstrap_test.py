@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import random
+import pytest
+from modules import bootstrap
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.rebalancing import RebalancingPolicy
+
+ASSETS = ['stocks', 'bonds', 'gold']
+MARKET = {
+    year: [random.Random(year * len(ASSETS) + asset_idx).uniform(0.7, 1.4) for asset_idx, _ in enumerate(ASSETS)]
+    for year in range(2000, 2010)
+}
+SELECTORS = [data_filter.years_first_to_last, data_filter.years_all_to_all]
+
+
+def test_synthetic_histories():
+    histories = bootstrap.synthetic_histories(MARKET, histories=20, block_size=3, seed=7)
+    assert histories.shape == (20, len(MARKET), len(ASSETS))
+    assert (histories == bootstrap.synthetic_histories(MARKET, histories=20, block_size=3, seed=7)).all()
+    assert (histories != bootstrap.synthetic_histories(MARKET, histories=20, block_size=3, seed=8)).any()
+    years = sorted(MARKET)
+    for history in histories.tolist():
+        year_indexes = [years.index(next(year for year in years if MARKET[year] == gains)) for gains in history]
+        # blocks of consecutive years that wrap around the last year
+        for block_start in range(0, len(year_indexes), 3):
+            block = year_indexes[block_start:block_start + 3]
+            assert block == [(block[0] + offset) % len(years) for offset in range(len(block))]
+
+
+@pytest.mark.parametrize('rebalancing', ['yearly', 'band-5'])
+def test_resampled_stats_match_simulated_portfolios(rebalancing):
+    rebalancing = RebalancingPolicy.parse(rebalancing)
+    histories = bootstrap.synthetic_histories(MARKET, histories=4, block_size=2, seed=1)
+    allocations = list(data_source.all_possible_allocations(len(ASSETS), 25))
+    selectors_stats = bootstrap.resampled_stats(allocations, histories, SELECTORS, rebalancing=rebalancing)
+    for selector_idx, selector_stats in enumerate(selectors_stats):
+        for allocation_idx, allocation in enumerate(allocations):
+            history_stats = [
+                Portfolio(allocation, ASSETS).simulated(
+                    SELECTORS[selector_idx], dict(enumerate(history)), rebalancing=rebalancing).stat
+                for history in histories.tolist()
+            ]
+            for stat_name in Portfolio.SERIALIZED_STATS:
+                values = sorted(stat[stat_name] for stat in history_stats)
+                assert selector_stats[stat_name]['mean'][allocation_idx] == pytest.approx(sum(values) / len(values))
+                percentiles = selector_stats[stat_name]['percentiles'][allocation_idx]
+                assert percentiles[0] >= values[0] - 1e-9
+                assert percentiles[-1] <= values[-1] + 1e-9
+
+
+def test_run_bootstrap(tmp_path):
+    bootstrap.run_bootstrap(
+        assets=ASSETS,
+        percentage_step=10,
+        year_selectors=['first-to-last', 'all-to-all'],
+        year_range_selector_funcs=SELECTORS,
+        asset_gain_per_year=MARKET,
+        static_portfolios=[Portfolio([50, 50, 0], ASSETS)],
+        directory=str(tmp_path),
+        histories=8,
+        block_size=3)
+    for year_selector in ['first-to-last', 'all-to-all']:
+        with open(tmp_path / f'{year_selector}.csv', 'r', encoding='utf-8') as csv_file:
+            header, *rows = list(csv.reader(csv_file))
+        assert header == ['allocation', *bootstrap.band_columns(Portfolio.SERIALIZED_STATS)]
+        assert len(rows) == data_source.count_possible_allocations(len(ASSETS), 10)
+        assert rows[0][0] == 'gold=100%'
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import pickle
+import shutil
+from glob import glob
+from glob import escape as glob_escape
+
+
+class RunCheckpoints:
+    '''
+    States of data stream consumers saved to run directory after every completed range of allocations.
+    Consumer state named after number of allocations simulated when it was saved.
+    Consumers lag behind each other, so each one keeps its states down to
+    the latest checkpoint that every consumer has saved.
+    '''
+
+    def __init__(self, directory: str, consumers: list[str]):
+        self.directory = directory
+        self.consumers = list(consumers)
+        self._states_directory = os.path.join(directory, 'checkpoints')
+        # portfolios that consumers keep on disk, their checkpoints refer to these files
+        self.spill_directory = os.path.join(directory, 'spill')
+        os.makedirs(self._states_directory, exist_ok=True)
+
+    def _state_path(self, consumer: str, allocations_done: int):
+        return os.path.join(self._states_directory, f'{consumer}.{allocations_done}.pickle')
+
+    def saved(self, consumer: str):
+        '''
+        Numbers of allocations of checkpoints saved by consumer, ascending
+        '''
+        pattern = os.path.join(glob_escape(self._states_directory), glob_escape(consumer) + '.*.pickle')
+        return sorted(int(path.rsplit('.', 2)[1]) for path in glob(pattern))
+
+    def resume_point(self):
+        '''
+        Latest checkpoint saved by every consumer, None if there is no such checkpoint
+        '''
+        common = None
+        for consumer in self.consumers:
+            saved = set(self.saved(consumer))
+            common = saved if common is None else common & saved
+        return max(common) if common else None
+
+    def save(self, consumer: str, allocations_done: int, state):
+        state_path = self._state_path(consumer, allocations_done)
+        with open(state_path + '.tmp', 'wb') as state_file:
+            pickle.dump(state, state_file)
+        os.replace(state_path + '.tmp', state_path)
+        # states older than checkpoint saved by everyone are never resumed from
+        everyone_saved = min(max(self.saved(other), default=-1) for other in self.consumers)
+        for older in self.saved(consumer):
+            if older < everyone_saved:
+                os.remove(self._state_path(consumer, older))
+
+    def load(self, consumer: str, allocations_done: int):
+        with open(self._state_path(consumer, allocations_done), 'rb') as state_file:
+            return pickle.load(state_file)
+
+    def reset(self, run_metadata: dict):
+        '''
+        Start run from scratch: drop saved states and remember what is being run
+        '''
+        for path in glob(os.path.join(glob_escape(self._states_directory), '*')):
+            os.remove(path)
+        with open(os.path.join(self.directory, 'run.json'), 'w', encoding='utf-8') as json_file:
+            json.dump(run_metadata, json_file, ensure_ascii=False)
+
+    def finish(self):
+        '''
+        Run is complete: drop saved states and spilled portfolios, there is nothing to resume
+        '''
+        for path in glob(os.path.join(glob_escape(self._states_directory), '*')):
+            os.remove(path)
+        shutil.rmtree(self.spill_directory, ignore_errors=True)
+
+    def run_metadata(self):
+        run_path = os.path.join(self.directory, 'run.json')
+        if not os.path.exists(run_path):
+            return None
+        with open(run_path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
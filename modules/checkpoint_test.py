@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pickle
+from multiprocessing import Pipe
+from multiprocessing import Process
+import pytest
+from modules import data_source
+from modules import data_filter
+from modules.checkpoint import RunCheckpoints
+from modules.simulator import simulator_process_func
+
+ASSETS = ['A', 'B', 'C', 'D']
+MARKET = {
+    2000: [1.03, 1.04, 1.05, 0.97],
+    2001: [1.01, 0.91, 1.09, 1.10],
+    2002: [0.99, 1.09, 0.91, 1.02],
+    2003: [1.02, 1.12, 1.08, 0.95],
+}
+
+
+def test_resume_point(tmp_path):
+    checkpoints = RunCheckpoints(tmp_path, ['plotter CAGR(%) - Stddev', 'store'])
+    assert checkpoints.resume_point() is None
+    checkpoints.reset({'run': 1})
+    assert checkpoints.run_metadata() == {'run': 1}
+    checkpoints.save('plotter CAGR(%) - Stddev', 0, 'p0')
+    checkpoints.save('plotter CAGR(%) - Stddev', 10, 'p10')
+    checkpoints.save('plotter CAGR(%) - Stddev', 20, 'p20')
+    assert checkpoints.resume_point() is None
+    # nothing is dropped until every consumer has saved a checkpoint
+    assert checkpoints.saved('plotter CAGR(%) - Stddev') == [0, 10, 20]
+    checkpoints.save('store', 0, 's0')
+    checkpoints.save('store', 10, 's10')
+    assert checkpoints.resume_point() == 10
+    assert checkpoints.saved('store') == [10]
+    checkpoints.save('plotter CAGR(%) - Stddev', 30, 'p30')
+    assert checkpoints.saved('plotter CAGR(%) - Stddev') == [10, 20, 30]
+    assert checkpoints.load('plotter CAGR(%) - Stddev', 10) == 'p10'
+    checkpoints.reset({'run': 2})
+    assert checkpoints.resume_point() is None
+
+
+def test_finish(tmp_path):
+    checkpoints = RunCheckpoints(tmp_path, ['plotter CAGR(%) - Stddev'])
+    checkpoints.reset({'run': 1})
+    checkpoints.save('plotter CAGR(%) - Stddev', 10, 'p10')
+    os.makedirs(os.path.join(checkpoints.spill_directory, 'plotter CAGR(%) - Stddev', '0'))
+    checkpoints.finish()
+    assert checkpoints.resume_point() is None
+    assert not os.path.exists(checkpoints.spill_directory)
+    assert checkpoints.run_metadata() == {'run': 1}
+
+
+def _simulated_stream(**kwargs):
+    '''
+    Serialized portfolios of every selector and checkpoint markers in order they were sent
+    '''
+    source, sink = Pipe(duplex=False)
+    simulator = Process(target=simulator_process_func, kwargs={
+        'assets': ASSETS,
+        'percentage_step': 10,
+        'year_range_selector_funcs': [data_filter.years_first_to_last, data_filter.years_all_to_all],
+        'asset_gain_per_year': MARKET,
+        'sink': sink,
+        'chunk_size': 7,
+        **kwargs,
+    })
+    simulator.start()
+    stream = []
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    while (bytes_from_pipe := source.recv_bytes()) != data_stream_end_pickle:
+        selector_idx, data = data_source.untagged_chunk(bytes_from_pipe)
+        stream.append((selector_idx, bytes(data)))
+    simulator.join()
+    return stream
+
+
+def _records(stream, selector_idx):
+    record_size = len(ASSETS) * 4 + 20
+    return sorted(
+        data[start:start + record_size]
+        for idx, data in stream if idx == selector_idx
+        for start in range(0, len(data), record_size))
+
+
+@pytest.mark.parametrize('checkpoint_every, resume_from', [(100, 100), (100, 200), (37, 259), (100, 286)])
+def test_resumed_stream(checkpoint_every, resume_from):
+    full = _simulated_stream(checkpoint_every=checkpoint_every)
+    markers = [
+        data_source.checkpoint_allocations_done(data) for idx, data in full if idx == data_source.CHECKPOINT_TAG
+    ]
+    assert markers == sorted(set([0, *range(checkpoint_every, 286, checkpoint_every), 286]))
+    marker_position = full.index((data_source.CHECKPOINT_TAG, data_source.checkpoint_chunk(resume_from)[1:]))
+    resumed = _simulated_stream(checkpoint_every=checkpoint_every, resume_from=resume_from)
+    for selector_idx in (0, 1):
+        assert _records(full[:marker_position] + resumed, selector_idx) == _records(full, selector_idx)
+        assert len(_records(full, selector_idx)) == 286
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+
+
+# pylint: disable=too-many-instance-attributes
+class AllocationConstraints:
+    '''
+    Limits on asset allocations that are enforced while allocations are generated:
+    per-asset bounds and steps, maximum number of assets and bounds on sums of asset groups.
+    Asset with step 0 is stepped by precision of the run.
+    '''
+
+    def __init__(
+            self,
+            assets_n: int,
+            bounds: list[tuple[int, int]] = None,
+            max_assets: int = 0,
+            groups: list[tuple[tuple[int, ...], int, int]] = None,
+            steps: list[int] = None):
+        self.assets_n = assets_n
+        self.bounds = list(bounds) if bounds else [(0, 100)] * assets_n
+        self.max_assets = max_assets if max_assets > 0 else assets_n
+        self.groups = list(groups) if groups else []
+        self.steps = list(steps) if steps else [0] * assets_n
+        # sums over assets from index to the end, used to prune infeasible subtrees
+        self._min_rest = [0] * (assets_n + 1)
+        self._max_rest = [0] * (assets_n + 1)
+        self._forced_rest = [0] * (assets_n + 1)
+        # rest is reachable only if it is multiple of gcd of steps of assets after index
+        self._steps_gcd_rest = [0] * (assets_n + 1)
+        self._default_step_rest = [False] * (assets_n + 1)
+        self._group_min_rest = [[0] * (assets_n + 1) for _ in self.groups]
+        self._group_max_rest = [[0] * (assets_n + 1) for _ in self.groups]
+        for asset_idx in reversed(range(assets_n)):
+            asset_min, asset_max = self.bounds[asset_idx]
+            self._min_rest[asset_idx] = self._min_rest[asset_idx + 1] + asset_min
+            self._max_rest[asset_idx] = self._max_rest[asset_idx + 1] + asset_max
+            self._forced_rest[asset_idx] = self._forced_rest[asset_idx + 1] + (asset_min > 0)
+            self._steps_gcd_rest[asset_idx] = math.gcd(self._steps_gcd_rest[asset_idx + 1], self.steps[asset_idx])
+            self._default_step_rest[asset_idx] = self._default_step_rest[asset_idx + 1] or self.steps[asset_idx] == 0
+            for group_idx, (group_assets, _, _) in enumerate(self.groups):
+                in_group = asset_idx in group_assets
+                self._group_min_rest[group_idx][asset_idx] = \
+                    self._group_min_rest[group_idx][asset_idx + 1] + (asset_min if in_group else 0)
+                self._group_max_rest[group_idx][asset_idx] = \
+                    self._group_max_rest[group_idx][asset_idx + 1] + (asset_max if in_group else 0)
+
+    # pylint: disable=too-many-return-statements
+    @staticmethod
+    def config_error(config: dict, market_assets: list[str]):
+        max_assets = config.get('max_assets', 0)
+        if not isinstance(max_assets, int) or isinstance(max_assets, bool) or max_assets < 0:
+            return f'max_assets must be a non-negative integer: {max_assets}'
+        tickers = list(config.get('assets', {}).keys())
+        for group in config.get('groups', []):
+            if 'assets' not in group:
+                return f'group has no assets: {group}'
+            if not 0 <= group.get('min', 0) <= group.get('max', 100) <= 100:
+                return f'invalid bounds for group {group["assets"]}: {group}'
+            tickers.extend(group['assets'])
+        if not all(ticker in market_assets for ticker in tickers):
+            return f'some tickers in constraints are not in market data: {set(tickers) - set(market_assets)}'
+        for ticker, bounds in config.get('assets', {}).items():
+            if not 0 <= bounds.get('min', 0) <= bounds.get('max', 100) <= 100:
+                return f'invalid bounds for {ticker}: {bounds}'
+            step = bounds.get('step', 0)
+            if not isinstance(step, int) or step < 0 or step > 0 and 100 % step != 0:
+                return f'step of {ticker} must be a divisor of 100: {step}'
+        return ''
+
+    @staticmethod
+    def from_config(config: dict, market_assets: list[str]):
+        bounds = [(0, 100)] * len(market_assets)
+        steps = [0] * len(market_assets)
+        for ticker, ticker_bounds in config.get('assets', {}).items():
+            bounds[market_assets.index(ticker)] = (ticker_bounds.get('min', 0), ticker_bounds.get('max', 100))
+            steps[market_assets.index(ticker)] = ticker_bounds.get('step', 0)
+        groups = [
+            (
+                tuple(market_assets.index(ticker) for ticker in group['assets']),
+                group.get('min', 0),
+                group.get('max', 100),
+            ) for group in config.get('groups', [])
+        ]
+        return AllocationConstraints(
+            assets_n=len(market_assets),
+            bounds=bounds,
+            max_assets=config.get('max_assets', 0),
+            groups=groups,
+            steps=steps)
+
+    def is_unconstrained(self):
+        return all(bounds == (0, 100) for bounds in self.bounds) and \
+            self.max_assets >= self.assets_n and not self.groups and not any(self.steps)
+
+    def with_group(self, group_assets: tuple[int, ...], group_min: int = 0, group_max: int = 100):
+        return AllocationConstraints(
+            assets_n=self.assets_n,
+            bounds=self.bounds,
+            max_assets=self.max_assets,
+            groups=self.groups + [(tuple(group_assets), group_min, group_max)],
+            steps=self.steps)
+
+    def with_max_assets(self, max_assets: int):
+        return AllocationConstraints(
+            assets_n=self.assets_n,
+            bounds=self.bounds,
+            max_assets=min(self.max_assets, max_assets),
+            groups=self.groups,
+            steps=self.steps)
+
+    def allows(self, allocation: list[int]):
+        if not all(low <= weight <= high for weight, (low, high) in zip(allocation, self.bounds)):
+            return False
+        if any(step > 0 and weight % step != 0 for weight, step in zip(allocation, self.steps)):
+            return False
+        if sum(1 for weight in allocation if weight != 0) > self.max_assets:
+            return False
+        return all(
+            group_min <= sum(allocation[asset_idx] for asset_idx in group_assets) <= group_max
+            for group_assets, group_min, group_max in self.groups)
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    # pylint: disable=too-many-locals
+    def asset_choices(self, asset_idx: int, step: int, allocation_sum: int, assets_used: int, group_sums: tuple):
+        '''
+        Yield (weight, assets_used, group_sums) for every weight of given asset
+        that still leaves a feasible allocation for the assets after it
+        '''
+        remainder = 100 - allocation_sum
+        asset_min, asset_max = self.bounds[asset_idx]
+        asset_step = self.steps[asset_idx] or step
+        if asset_idx == self.assets_n - 1:
+            weights = (remainder,) if asset_min <= remainder <= asset_max and remainder % asset_step == 0 else ()
+        else:
+            weights = range(-(-asset_min // asset_step) * asset_step, min(asset_max, remainder) + 1, asset_step)
+        next_idx = asset_idx + 1
+        rest_step = math.gcd(self._steps_gcd_rest[next_idx], step if self._default_step_rest[next_idx] else 0)
+        for weight in weights:
+            rest = remainder - weight
+            if not self._min_rest[next_idx] <= rest <= self._max_rest[next_idx]:
+                continue
+            if rest and rest % rest_step != 0:
+                continue
+            next_used = assets_used + (weight != 0)
+            if next_used + max(self._forced_rest[next_idx], rest > 0) > self.max_assets:
+                continue
+            next_group_sums = group_sums
+            if self.groups:
+                next_group_sums = tuple(
+                    group_sum + weight if asset_idx in group_assets else group_sum
+                    for group_sum, (group_assets, _, _) in zip(group_sums, self.groups))
+                if not all(
+                    group_sum + min(rest, self._group_max_rest[group_idx][next_idx]) >= group_min and
+                    group_sum + self._group_min_rest[group_idx][next_idx] <= group_max
+                    for group_idx, (group_sum, (_, group_min, group_max)) in
+                        enumerate(zip(next_group_sums, self.groups))):
+                    continue
+            yield weight, next_used, next_group_sums
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+import pytest
+from modules import data_source
+from modules.constraints import AllocationConstraints
+
+ASSETS = ['stocks', 'bonds', 'realty', 'gold', 'silver', 'deposits']
+
+
+@pytest.mark.parametrize('config', [
+    {},
+    {'assets': {'gold': {'min': 5, 'max': 20}}},
+    {'max_assets': 4},
+    {'max_assets': 1},
+    {'groups': [{'assets': ['bonds', 'deposits'], 'min': 30}]},
+    {
+        'assets': {'gold': {'min': 5, 'max': 20}},
+        'max_assets': 4,
+        'groups': [{'assets': ['bonds', 'deposits'], 'min': 30}],
+    },
+    {
+        'assets': {'stocks': {'max': 50}, 'silver': {'min': 10}, 'realty': {'max': 0}},
+        'groups': [
+            {'assets': ['gold', 'silver'], 'max': 40},
+            {'assets': ['stocks', 'bonds'], 'min': 20, 'max': 70},
+        ],
+    },
+    {'assets': {'stocks': {'min': 60}, 'bonds': {'min': 60}}},
+])
+@pytest.mark.parametrize('step', [20, 25])
+def test_constrained_allocations(config, step):
+    assert AllocationConstraints.config_error(config, ASSETS) == ''
+    constraints = AllocationConstraints.from_config(config, ASSETS)
+    expected_allocations = sorted(
+        allocation for allocation in itertools.product(range(0, 101, step), repeat=len(ASSETS))
+        if sum(allocation) == 100 and constraints.allows(allocation))
+    test_allocations = list(tuple(a) for a in data_source.all_possible_allocations(len(ASSETS), step, constraints))
+    assert sorted(test_allocations) == expected_allocations
+    assert data_source.count_possible_allocations(len(ASSETS), step, constraints) == len(expected_allocations)
+    # skipping allocations must produce the same sequence as enumerating them
+    for start in range(0, len(test_allocations) + 1, 7):
+        skipped_allocations = data_source.all_possible_allocations(len(ASSETS), step, constraints, start=start)
+        assert list(tuple(a) for a in skipped_allocations) == test_allocations[start:]
+
+
+@pytest.mark.parametrize('config', [
+    {'assets': {'gold': {'step': 5}}},
+    {'assets': {'stocks': {'step': 4}, 'gold': {'step': 5, 'max': 30}}},
+    {'assets': {'stocks': {'step': 50}, 'deposits': {'step': 1, 'min': 3}}},
+    {'assets': {'stocks': {'step': 2}, 'silver': {'step': 5}}, 'max_assets': 3},
+    {'assets': {'stocks': {'step': 1}}, 'groups': [{'assets': ['stocks', 'gold'], 'min': 13, 'max': 47}]},
+])
+def test_per_asset_steps(config):
+    assert AllocationConstraints.config_error(config, ASSETS) == ''
+    constraints = AllocationConstraints.from_config(config, ASSETS)
+    step = 20
+    expected_allocations = sorted(
+        allocation for allocation in itertools.product(
+            *(range(0, 101, asset_step or step) for asset_step in constraints.steps))
+        if sum(allocation) == 100 and constraints.allows(allocation))
+    test_allocations = list(tuple(a) for a in data_source.all_possible_allocations(len(ASSETS), step, constraints))
+    assert sorted(test_allocations) == expected_allocations
+    assert data_source.count_possible_allocations(len(ASSETS), step, constraints) == len(expected_allocations)
+    for start in range(0, len(test_allocations) + 1, 97):
+        skipped_allocations = data_source.all_possible_allocations(len(ASSETS), step, constraints, start=start)
+        assert list(tuple(a) for a in skipped_allocations) == test_allocations[start:]
+
+
+@pytest.mark.parametrize('config', [
+    {'assets': {'gold': {'step': 3}}},
+    {'assets': {'gold': {'step': -5}}},
+    {'assets': {'platinum': {'max': 10}}},
+    {'groups': [{'assets': ['gold', 'platinum'], 'min': 10}]},
+    {'assets': {'gold': {'min': 30, 'max': 20}}},
+    {'groups': [{'assets': ['gold', 'stocks'], 'min': 60, 'max': 40}]},
+    {'groups': [{'assets': ['gold'], 'max': 120}]},
+    {'groups': [{'assets': ['gold'], 'min': -10}]},
+    {'groups': [{'min': 10}]},
+    {'max_assets': -1},
+    {'max_assets': 2.5},
+    {'max_assets': '3'},
+])
+def test_constraints_config_error(config):
+    assert AllocationConstraints.config_error(config, ASSETS) != ''
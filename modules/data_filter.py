@@ -16,72 +16,323 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import math
+import time
+import queue
+import logging
+import threading
 from pickle import dumps
+from collections.abc import Iterable
 from importlib import import_module
 from multiprocessing.connection import Connection
-from concurrent.futures import wait as futures_wait
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from functools import update_wrapper
 from modules.portfolio import Portfolio
 from modules.data_source import DataStreamFinished
 
 
-class PortfolioXYTuplePoint(tuple):
-    def __new__(cls, portfolio: Portfolio, coord_pair: tuple[str, str]):
-        return super().__new__(cls, (portfolio.stat[coord_pair[0]], portfolio.stat[coord_pair[1]]))
+def convex_hull_layers_indexes(points, hull_layers: int = 1):
+    '''
+    Indexes of points on every convex hull layer, from outer one inward, points is array of shape (N, 2).
+    Every point is one layer without hull layers.
+    '''
+    np = import_module('numpy')
+    remaining = np.arange(len(points))
+    if hull_layers <= 0:
+        return [remaining]
+    pyhull_convex_hull = import_module('pyhull.convex_hull').ConvexHull
+    layers = []
+    for _ in range(hull_layers):
+        if len(remaining) <= 3:
+            layers.append(remaining)
+            break
+        hull = pyhull_convex_hull(points[remaining].tolist())
+        hull_vertexes = np.unique(np.array(hull.vertices, dtype=np.intp).ravel())
+        if len(hull_vertexes) == 0:
+            layers.append(remaining)
+            break
+        layers.append(remaining[hull_vertexes])
+        remaining = np.delete(remaining, hull_vertexes)
+    return layers
 
-    def __init__(self, portfolio: Portfolio, coord_pair: tuple[str, str]):
-        self._portfolio = portfolio
-        self._coord_pair = coord_pair
 
-    def portfolio(self):
-        return self._portfolio
+def multilayer_convex_hull_indexes(points, hull_layers: int = 1):
+    '''
+    Indexes of points on given number of convex hull layers, points is array of shape (N, 2).
+    Every point is kept without hull layers.
+    '''
+    np = import_module('numpy')
+    return np.concatenate(convex_hull_layers_indexes(points, hull_layers))
 
 
-def multilayer_convex_hull(point_batch: list[PortfolioXYTuplePoint] = None, hull_layers: int = 1, edge_layers: int = 0):
-    pyhull_convex_hull = import_module('pyhull.convex_hull').ConvexHull
-    hull_layers_points = []
-    self_hull_points = list(point_batch)
-    if hull_layers > 0:
-        for _ in range(hull_layers):
-            if len(self_hull_points) <= 3:
-                hull_layers_points.extend(self_hull_points)
-                break
-            hull = pyhull_convex_hull(self_hull_points)
-            hull_vertexes = set(vertex for hull_vertex in hull.vertices for vertex in hull_vertex)
-            hull_points = list(self_hull_points[vertex] for vertex in hull_vertexes)
-            if len(hull_points) > 0:
-                for hull_point in hull_points:
-                    self_hull_points.remove(hull_point)
-                    hull_layers_points.append(hull_point)
-            else:
-                hull_layers_points.extend(self_hull_points)
-    else:
-        hull_layers_points = self_hull_points
-    if edge_layers > 0:
-        points_on_edge = [point for point in self_hull_points if point.portfolio().number_of_assets() <= edge_layers]
+def _extreme_positions(points):
+    '''
+    Positions of points with the least and the greatest value of every coordinate
+    '''
+    np = import_module('numpy')
+    return np.unique(np.concatenate((points.argmin(axis=0), points.argmax(axis=0))))
+
+
+def _farthest_on_ring(ring_points, start: int, end: int):
+    '''
+    Distance to chord from start to end and ring position of point between them that is farthest from it,
+    positions past the end of ring wrap around
+    '''
+    np = import_module('numpy')
+    inner = np.arange(start + 1, end)
+    if len(inner) == 0:
+        return 0.0, None
+    chord_start, chord_end = ring_points[start % len(ring_points)], ring_points[end % len(ring_points)]
+    chord = chord_end - chord_start
+    offsets = ring_points[inner % len(ring_points)] - chord_start
+    length = float(np.hypot(*chord))
+    if length == 0:
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
     else:
-        points_on_edge = []
-    return hull_layers_points + points_on_edge
+        along = np.clip((offsets @ chord) / length ** 2, 0, 1)
+        distances = np.hypot(*(offsets - along[:, None] * chord).T)
+    farthest_idx = int(distances.argmax())
+    return float(distances[farthest_idx]), int(inner[farthest_idx])
 
 
-def queue_multiplexer(
-        source: Connection,
-        sinks: list[Connection]):
+# pylint: disable=too-many-locals
+def rdp_reduced_positions(points, max_points: int):
+    '''
+    Positions of at most max_points points of convex hull layer that outline it best: Ramer–Douglas–Peucker
+    that starts from extreme points and splits the part of outline that is farthest from its chord
+    until there are max_points points. Points are in normalized plot coordinates.
+    '''
+    np = import_module('numpy')
+    heapq = import_module('heapq')
+    centered = points - points.mean(axis=0)
+    ring = np.argsort(np.arctan2(centered[:, 0], centered[:, 1]), kind='stable')
+    ring_positions = np.empty(len(ring), dtype=np.intp)
+    ring_positions[ring] = np.arange(len(ring))
+    anchors = sorted(ring_positions[_extreme_positions(points)].tolist())
+    if len(anchors) == 1:
+        anchors.append(anchors[0] + len(ring) // 2)
+    ring_points = points[ring]
+    segments = []
+    for start, end in zip(anchors, anchors[1:] + [anchors[0] + len(ring)]):
+        distance, split = _farthest_on_ring(ring_points, start, end)
+        if split is not None and distance > 0:
+            heapq.heappush(segments, (-distance, start, end, split))
+    kept = set(anchor % len(ring) for anchor in anchors)
+    while segments and len(kept) < max_points:
+        _, start, end, split = heapq.heappop(segments)
+        kept.add(split % len(ring))
+        for part_start, part_end in ((start, split), (split, end)):
+            distance, part_split = _farthest_on_ring(ring_points, part_start, part_end)
+            if part_split is not None and distance > 0:
+                heapq.heappush(segments, (-distance, part_start, part_end, part_split))
+    return np.sort(ring[sorted(kept)])
 
-    def send_task(sink, data, pool):
-        return pool.submit(sink.send_bytes, data)
 
-    data_stream_end_pickle = dumps(DataStreamFinished())
-    with ThreadPoolExecutor() as thread_pool:
+def grid_reduced_positions(points, max_points: int):
+    '''
+    Positions of at most max_points points of convex hull layer: one point per cell of the finest square grid
+    that has few enough occupied cells, extreme points are kept. Points are in normalized plot coordinates.
+    '''
+    np = import_module('numpy')
+    extremes = _extreme_positions(points)
+
+    def thinned(resolution: int):
+        cells = np.clip((points * resolution).astype(np.int64), 0, resolution - 1)
+        _, first_in_cell = np.unique(cells[:, 0] * resolution + cells[:, 1], return_index=True)
+        return np.union1d(first_in_cell, extremes)
+
+    best = extremes
+    low, high = 1, max(1, max_points)
+    while low <= high:
+        resolution = (low + high) // 2
+        positions = thinned(resolution)
+        if len(positions) <= max_points:
+            best, low = positions, resolution + 1
+        else:
+            high = resolution - 1
+    return best
+
+
+LOD_REDUCERS = {
+    'rdp': rdp_reduced_positions,
+    'grid': grid_reduced_positions,
+}
+
+
+def reduced_hull_indexes(points, hull_layers: int = 1, max_layer_points: int = 0, lod: str = 'rdp'):
+    '''
+    Indexes of points on hull layers, every layer of more than max_layer_points points is reduced to them
+    in coordinates normalized by range of all hull points, so that render cost does not grow with precision.
+    Extreme points of every layer are always kept, zero max_layer_points keeps every point.
+    '''
+    np = import_module('numpy')
+    layers = convex_hull_layers_indexes(points, hull_layers)
+    if hull_layers <= 0 or max_layer_points <= 0:
+        return np.concatenate(layers)
+    hull_points = points[np.concatenate(layers)]
+    if len(hull_points) == 0:
+        return np.concatenate(layers)
+    low, span = hull_points.min(axis=0), np.ptp(hull_points, axis=0)
+    span[span == 0] = 1
+    return np.concatenate([
+        layer[LOD_REDUCERS[lod]((points[layer] - low) / span, max_layer_points)]
+        if len(layer) > max_layer_points else layer
+        for layer in layers
+    ])
+
+
+def batch_convex_hull(
+        batch, coord_pair: tuple[str, str], hull_layers: int = 1, max_layer_points: int = 0, lod: str = 'rdp'):
+    '''
+    Portfolios of PortfolioBatch that are on hull layers, with max_layer_points at most so many of every layer
+    '''
+    if max_layer_points > 0:
+        return batch[reduced_hull_indexes(batch.points(coord_pair), hull_layers, max_layer_points, lod)]
+    return batch[multilayer_convex_hull_indexes(batch.points(coord_pair), hull_layers)]
+
+
+# pylint: disable=too-few-public-methods
+# pylint: disable=too-many-instance-attributes
+class _SinkBuffer:
+    '''
+    Bounded queue of chunks for one consumer, drained into its pipe by own thread
+    '''
+
+    def __init__(self, name: str, sink: Connection, depth: int):
+        self.name = name
+        self.sink = sink
+        self.chunks = queue.Queue(maxsize=depth)
+        self.broken = False
+        self.max_lag = 0
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        # time producer waited for room in this buffer
+        self.blocked_seconds = 0.0
+
+
+class FanOut:
+    '''
+    Every chunk goes to every sink through its own buffer of depth chunks, so slow consumer holds back
+    producer and other consumers only when its buffer is full or buffered chunks take memory_limit bytes.
+    Chunk is kept in memory once however many buffers hold it. Zero memory_limit does not limit memory.
+    '''
+
+    def __init__(self, sinks: list[Connection], depth: int = 16, memory_limit: int = 0, sink_names: list[str] = None):
+        self.memory_limit = memory_limit
+        self.buffered_bytes = 0
+        self.memory_blocked_seconds = 0.0
+        self._memory = threading.Condition()
+        self._buffers = [
+            _SinkBuffer(name, sink, max(1, depth))
+            for name, sink in zip(sink_names or [f'sink {sink_idx}' for sink_idx in range(len(sinks))], sinks)
+        ]
+        self._threads = [
+            threading.Thread(target=self._drain, args=(buffer,), daemon=True) for buffer in self._buffers]
+        for thread in self._threads:
+            thread.start()
+
+    def _drain(self, buffer: _SinkBuffer):
         while True:
-            bytes_from_pipe = source.recv_bytes()
-            if bytes_from_pipe == data_stream_end_pickle:
-                break  # make sure all threads are finished before sending the end signal
-            send_tasks = map(partial(send_task, pool=thread_pool, data=bytes_from_pipe), sinks)
-            futures_wait(send_tasks)
-    for sink in sinks:
-        sink.send_bytes(bytes_from_pipe)
+            data, consumers_left = buffer.chunks.get()
+            if consumers_left is None:
+                if data and not buffer.broken:
+                    buffer.sink.send_bytes(data)
+                break
+            if not buffer.broken:
+                try:
+                    buffer.sink.send_bytes(data)
+                    buffer.sent_chunks += 1
+                    buffer.sent_bytes += len(data)
+                except OSError as error:
+                    # consumer is gone, drop its chunks so it does not hold back the others
+                    logging.warning('fan-out to %s failed: %r', buffer.name, error)
+                    buffer.broken = True
+            with self._memory:
+                consumers_left[0] -= 1
+                if consumers_left[0] == 0:
+                    self.buffered_bytes -= len(data)
+                    self._memory.notify_all()
+
+    def put(self, data: bytes):
+        with self._memory:
+            if self.buffered_bytes > 0 and 0 < self.memory_limit < self.buffered_bytes + len(data):
+                time_start = time.perf_counter()
+                while self.buffered_bytes > 0 and self.buffered_bytes + len(data) > self.memory_limit:
+                    self._memory.wait()
+                self.memory_blocked_seconds += time.perf_counter() - time_start
+            self.buffered_bytes += len(data)
+        chunk = (data, [len(self._buffers)])
+        for buffer in self._buffers:
+            try:
+                buffer.chunks.put_nowait(chunk)
+            except queue.Full:
+                time_start = time.perf_counter()
+                buffer.chunks.put(chunk)
+                buffer.blocked_seconds += time.perf_counter() - time_start
+            buffer.max_lag = max(buffer.max_lag, buffer.chunks.qsize())
+
+    def close(self, last_data: bytes = b''):
+        '''
+        Send last_data after every buffered chunk of each sink, wait until every sink got it
+        '''
+        for buffer in self._buffers:
+            buffer.chunks.put((last_data, None))
+        for thread in self._threads:
+            thread.join()
+
+    def metrics(self):
+        '''
+        Lag of every consumer in chunks waiting in its buffer, what was sent and how long producer waited for it
+        '''
+        return [
+            {
+                'name': buffer.name,
+                'lag': buffer.chunks.qsize(),
+                'max_lag': buffer.max_lag,
+                'sent_chunks': buffer.sent_chunks,
+                'sent_bytes': buffer.sent_bytes,
+                'blocked_seconds': buffer.blocked_seconds,
+            }
+            for buffer in self._buffers
+        ]
+
+    def log_metrics(self):
+        for metrics in self.metrics():
+            logging.info('fan-out to %s: lag %d chunks (max %d), sent %d chunks of %dk, producer blocked %.1fs',
+                         metrics['name'], metrics['lag'], metrics['max_lag'],
+                         metrics['sent_chunks'], metrics['sent_bytes'] // 1024, metrics['blocked_seconds'])
+        if self.memory_limit > 0:
+            logging.info('fan-out buffers: %dk of %dk, producer blocked by memory limit %.1fs',
+                         self.buffered_bytes // 1024, self.memory_limit // 1024, self.memory_blocked_seconds)
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def queue_multiplexer(
+        source: Connection,
+        sinks: list[Connection],
+        depth: int = 16,
+        memory_limit: int = 0,
+        sink_names: list[str] = None,
+        metrics_every: float = 60):
+    '''
+    Send every chunk from source to every sink through FanOut, log its metrics every metrics_every seconds
+    and when data stream is finished. Returns final metrics.
+    '''
+    data_stream_end_pickle = dumps(DataStreamFinished())
+    fan_out = FanOut(sinks, depth=depth, memory_limit=memory_limit, sink_names=sink_names)
+    metrics_logged = time.monotonic()
+    while True:
+        bytes_from_pipe = source.recv_bytes()
+        if bytes_from_pipe == data_stream_end_pickle:
+            break
+        fan_out.put(bytes_from_pipe)
+        if metrics_every and time.monotonic() - metrics_logged >= metrics_every:
+            fan_out.log_metrics()
+            metrics_logged = time.monotonic()
+    fan_out.close(bytes_from_pipe)  # end signal goes after every chunk of its sink
+    fan_out.log_metrics()
+    return fan_out.metrics()
 
 
 def years_first_to_last(years: list):
@@ -112,3 +363,37 @@ def years_all_to_all(years: list):
     for idx_from in range(len(years) - 1):
         for idx_to in range(idx_from + 1, len(years)):
             yield years[idx_from], years[idx_to]
+
+
+def year_selectors():
+    '''
+    Year range selectors by their command line names
+    '''
+    selectors = {
+        'first-to-last': years_first_to_last,
+        'first-to-all': years_first_to_all,
+        'window-3': partial(years_sliding_window, window_size=3),
+        'window-5': partial(years_sliding_window, window_size=5),
+        'window-10': partial(years_sliding_window, window_size=10),
+        'window-20': partial(years_sliding_window, window_size=20),
+        'all-to-last': years_all_to_last,
+        'all-to-all': years_all_to_all,
+    }
+    for window_size in (3, 5, 10, 20):
+        update_wrapper(selectors[f'window-{window_size}'], years_sliding_window)
+    return selectors
+
+
+def pareto_frontier(portfolios: Iterable[Portfolio], coord_pair: tuple[str, str]):
+    '''
+    Portfolios not dominated by any other: nothing has the same or higher Y with the same or lower X.
+    Of portfolios with equal coordinates only one is kept.
+    coord_pair is (Y, X) like in plots, sorted by X
+    '''
+    frontier = []
+    best_y = -math.inf
+    for portfolio in sorted(portfolios, key=lambda p: (p.stat[coord_pair[1]], -p.stat[coord_pair[0]])):
+        if portfolio.stat[coord_pair[0]] > best_y:
+            best_y = portfolio.stat[coord_pair[0]]
+            frontier.append(portfolio)
+    return frontier
@@ -16,11 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import pickle
 import random
 import functools
 import itertools
+import threading
+from multiprocessing import Pipe
 import pytest
+import numpy as np
 from modules import data_filter
+from modules import data_source
+from modules.portfolio import Portfolio
 
 
 class PointMock(tuple):
@@ -195,9 +201,9 @@ def mod_sort_reverse(_list: list) -> list:
 def test_multilayer_hull(points, hull_layers, modifier):
     points_shuffled = modifier(points)
     expected_points = [point for layer in hull_layers for point in layer]
-    hull_points = data_filter.multilayer_convex_hull(points_shuffled, hull_layers=len(hull_layers))
+    hull_indexes = data_filter.multilayer_convex_hull_indexes(np.array(points_shuffled), len(hull_layers))
+    hull_points = sorted(points_shuffled[index] for index in hull_indexes.tolist())
     expected_points.sort()
-    hull_points.sort()
     assert hull_points == expected_points
 
 
@@ -278,3 +284,79 @@ def test_years_ranges(years, algorithm, expected_ranges):
     # variance, stddev and sharpe could not be determined from single data point
     for begin, end in ranges:
         assert begin != end
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_pareto_frontier(seed: int):
+    rng = random.Random(seed)
+    coord_pair = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+    portfolios = []
+    for _ in range(300):
+        portfolio = Portfolio(weights=[100], assets=['A'])
+        portfolio.stat[coord_pair[0]] = rng.randint(0, 20)
+        portfolio.stat[coord_pair[1]] = rng.randint(0, 20)
+        portfolios.append(portfolio)
+
+    def dominated(portfolio):
+        return any(
+            other.stat[coord_pair[0]] >= portfolio.stat[coord_pair[0]] and
+            other.stat[coord_pair[1]] <= portfolio.stat[coord_pair[1]] and
+            (other.stat[coord_pair[0]], other.stat[coord_pair[1]]) !=
+            (portfolio.stat[coord_pair[0]], portfolio.stat[coord_pair[1]])
+            for other in portfolios)
+
+    frontier = data_filter.pareto_frontier(portfolios, coord_pair)
+    expected = set((p.stat[coord_pair[1]], p.stat[coord_pair[0]]) for p in portfolios if not dominated(p))
+    assert [(p.stat[coord_pair[1]], p.stat[coord_pair[0]]) for p in frontier] == sorted(expected)
+
+
+@pytest.mark.parametrize('lod', list(data_filter.LOD_REDUCERS))
+@pytest.mark.parametrize('max_layer_points', [4, 10, 50])
+def test_reduced_hull(lod: str, max_layer_points: int):
+    rng = np.random.default_rng(0)
+    # two dense rings that are the first two hull layers, scaled like CAGR against Stddev
+    angles = rng.uniform(0, 2 * np.pi, 4000)
+    points = np.column_stack((np.sin(angles) * 30, np.cos(angles) * 0.1)) * np.repeat([1, 0.5], 2000)[:, None]
+    layers = data_filter.convex_hull_layers_indexes(points, 2)
+    reduced = data_filter.reduced_hull_indexes(points, 2, max_layer_points, lod)
+    assert set(reduced.tolist()) <= set(data_filter.multilayer_convex_hull_indexes(points, 2).tolist())
+    for layer in layers:
+        kept = np.intersect1d(reduced, layer)
+        assert 4 <= len(kept) <= max_layer_points
+        # portfolios with the least and the greatest value of every coordinate stay
+        for coordinate in (0, 1):
+            assert layer[points[layer, coordinate].argmin()] in kept
+            assert layer[points[layer, coordinate].argmax()] in kept
+    assert len(data_filter.reduced_hull_indexes(points, 2, len(points), lod)) == sum(map(len, layers))
+
+
+def test_rdp_keeps_corners():
+    # square outline with many points on every side, its corners are what outlines it
+    side = np.linspace(0, 1, 101)[:-1]
+    points = np.concatenate([
+        np.column_stack((side, np.zeros_like(side))), np.column_stack((np.ones_like(side), side)),
+        np.column_stack((1 - side, np.ones_like(side))), np.column_stack((np.zeros_like(side), 1 - side)),
+    ])
+    kept = points[data_filter.rdp_reduced_positions(points, 4)]
+    assert sorted(map(tuple, kept.tolist())) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+@pytest.mark.parametrize('memory_limit', [0, 2**20])
+def test_queue_multiplexer_slow_consumer(memory_limit):
+    chunks = [bytes([chunk_idx]) * 2**17 for chunk_idx in range(6)]
+    source, source_sink = Pipe(duplex=False)
+    (slow_source, slow_sink), (fast_source, fast_sink) = Pipe(duplex=False), Pipe(duplex=False)
+    metrics = []
+    multiplexer = threading.Thread(target=lambda: metrics.extend(data_filter.queue_multiplexer(
+        source, [slow_sink, fast_sink], depth=8, memory_limit=memory_limit, sink_names=['slow', 'fast'])))
+    multiplexer.start()
+    for chunk in chunks:
+        source_sink.send_bytes(chunk)
+    source_sink.send(data_source.DataStreamFinished())
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    # fast consumer gets every chunk while slow one has not read anything, chunks bigger than pipe buffer
+    assert [fast_source.recv_bytes() for _ in range(len(chunks) + 1)] == chunks + [data_stream_end_pickle]
+    assert [slow_source.recv_bytes() for _ in range(len(chunks) + 1)] == chunks + [data_stream_end_pickle]
+    multiplexer.join()
+    assert [(m['name'], m['lag'], m['sent_chunks']) for m in metrics] == [('slow', 0, 6), ('fast', 0, 6)]
+    assert metrics[0]['max_lag'] > 1
@@ -16,11 +16,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
 import logging
 from os import makedirs
 from os.path import exists
 from os.path import join as os_path_join
 from io import StringIO
+from base64 import b64encode
+from html import escape as html_escape
+from collections.abc import Callable
+from collections.abc import Iterable
 import importlib
 from modules.portfolio import Portfolio
 
@@ -40,56 +45,22 @@ def report_errors_in_portfolios(
     return num_errors
 
 
-# pylint: disable=too-many-arguments
-# pylint: disable=too-many-locals
-# pylint: disable=too-many-statements
-# pylint: disable=too-many-positional-arguments
-def draw_circles_with_tooltips(
-        circles: list[dict[str, dict]],
-        xlabel: str = None,
-        ylabel: str = None,
-        title: str = None,
-        directory: str = '.',
-        filename: str = 'plot',
-        asset_color_map: dict[str, tuple[int, int, int]] = None):
-
-    if not exists(directory):
-        makedirs(directory)
-
-    plt = importlib.import_module('matplotlib.pyplot')
-    pltlines = importlib.import_module('matplotlib.lines')
-
-    plt.rcParams["font.family"] = "monospace"
-    plt.rcParams["font.size"] = 10
-    _, axes = plt.subplots(figsize=(12, 9))
+class PlotTemplate:
+    '''
+    Setup shared by every plot: fonts, figure size, grid styling and legend of asset colors.
+    Prepared once per rendering process, every plot gets new figure styled from it.
+    Figures are made without pyplot, so figures of different threads share no state.
+    '''
 
-    padding_percent_x = 25
-    padding_percent_y = 25
-    xlim_min = min(circle['x'] for circle in circles)
-    xlim_max = max(circle['x'] for circle in circles)
-    xlim_min_padded = xlim_min - padding_percent_x * (xlim_max - xlim_min) / 100
-    xlim_max_padded = xlim_max + padding_percent_x * (xlim_max - xlim_min) / 100
-    ylim_min = min(circle['y'] for circle in circles)
-    ylim_max = max(circle['y'] for circle in circles)
-    ylim_min_padded = ylim_min - padding_percent_y * (ylim_max - ylim_min) / 100
-    ylim_max_padded = ylim_max + padding_percent_y * (ylim_max - ylim_min) / 100
-    axes.set_xlim(xlim_min_padded, xlim_max_padded)
-    axes.set_ylim(ylim_min_padded, ylim_max_padded)
-    axes.tick_params(axis='x', which='both', bottom=True)
-    axes.tick_params(axis='y', which='both', left=True)
-    axes.set_axisbelow(True)
-    axes.minorticks_on()
-    axes.tick_params(axis='both', which='major', width=1)
-    axes.tick_params(axis='both', which='minor', width=0.5)
-    plt.grid(axis='both', which='both', visible=True)
-    plt.grid(axis='both', which='major', linewidth=1)
-    plt.grid(axis='both', which='minor', linewidth=0.5, linestyle=':')
-    plt.title(title, zorder=0)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-
-    if asset_color_map:
-        handles = [
+    def __init__(self, asset_color_map: dict[str, tuple[int, int, int]] = None, dpi: int = 300):
+        matplotlib = importlib.import_module('matplotlib')
+        pltlines = importlib.import_module('matplotlib.lines')
+        matplotlib.rcParams["font.family"] = "monospace"
+        matplotlib.rcParams["font.size"] = 10
+        self.figsize = (12, 9)
+        self.dpi = dpi
+        # legend draws its own copies of handles, the same handles serve every figure
+        self.legend_handles = [
             pltlines.Line2D(
                 [0], [0],
                 marker='o',
@@ -97,15 +68,181 @@ def draw_circles_with_tooltips(
                 linewidth=0,
                 markerfacecolor=color,
                 markeredgecolor='black'
-            ) for label, color in asset_color_map.items()
+            ) for label, color in (asset_color_map or {}).items()
         ]
-        axes.legend(
-            handles=handles,
-            fontsize=8,
-            facecolor='white',
-            framealpha=0.66
-        ).set_zorder(1)
 
+    def axes(self, plot: dict):
+        '''
+        New figure with styled axes of plot: limits, grid, labels, legend and cloud, without circles
+        '''
+        figure_module = importlib.import_module('matplotlib.figure')
+        backend_agg = importlib.import_module('matplotlib.backends.backend_agg')
+        figure = figure_module.Figure(figsize=self.figsize)
+        backend_agg.FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.tick_params(axis='x', which='both', bottom=True)
+        axes.tick_params(axis='y', which='both', left=True)
+        axes.set_axisbelow(True)
+        axes.minorticks_on()
+        axes.tick_params(axis='both', which='major', width=1)
+        axes.tick_params(axis='both', which='minor', width=0.5)
+        axes.grid(axis='both', which='both', visible=True)
+        axes.grid(axis='both', which='major', linewidth=1)
+        axes.grid(axis='both', which='minor', linewidth=0.5, linestyle=':')
+        axes.set_title(plot['title'], zorder=0)
+        axes.set_xlabel(plot['xlabel'])
+        axes.set_ylabel(plot['ylabel'])
+
+        if self.legend_handles:
+            axes.legend(
+                handles=self.legend_handles,
+                loc=plot['legend_loc'],
+                fontsize=8,
+                facecolor='white',
+                framealpha=0.66
+            ).set_zorder(1)
+
+        if plot['cloud_image'] is not None:
+            axes.imshow(
+                plot['cloud_image'],
+                extent=plot['limits'],
+                aspect='auto',
+                interpolation='none',
+                zorder=2)
+        if plot['cloud_density'] is not None:
+            density_image, density_extent = plot['cloud_density']
+            axes.imshow(
+                density_image,
+                extent=density_extent,
+                origin='lower',
+                aspect='auto',
+                interpolation='nearest',
+                zorder=2)
+        axes.set_xlim(*plot['limits'][0:2])
+        axes.set_ylim(*plot['limits'][2:4])
+        return axes
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    # pylint: disable=too-many-positional-arguments
+    def layout(
+            self,
+            circles: list[dict[str, dict]],
+            xlabel: str = None,
+            ylabel: str = None,
+            title: str = None,
+            directory: str = '.',
+            filename: str = 'plot',
+            cloud_blocks: Callable[[], Iterable[dict]] = None,
+            cloud_bounds: tuple[float, float, float, float] = None,
+            cloud_density: tuple = None,
+            tooltip_assets: list[str] = None,
+            tooltip_stats: list[str] = None):
+        '''
+        Plot that any rendering process can draw: circles, labels, padded limits, cloud as image
+        and legend location. Best legend location is found once with every circle in one collection,
+        every file of plot places legend there.
+        '''
+        padding_percent_x = 25
+        padding_percent_y = 25
+        xs = [circle['x'] for circle in circles] + list(cloud_bounds[0:2] if cloud_bounds else [])
+        ys = [circle['y'] for circle in circles] + list(cloud_bounds[2:4] if cloud_bounds else [])
+        xlim_min = min(xs)
+        xlim_max = max(xs)
+        ylim_min = min(ys)
+        ylim_max = max(ys)
+        plot = {
+            'circles': circles,
+            'xlabel': xlabel,
+            'ylabel': ylabel,
+            'title': title,
+            'directory': directory,
+            'filename': filename,
+            'limits': (
+                xlim_min - padding_percent_x * (xlim_max - xlim_min) / 100,
+                xlim_max + padding_percent_x * (xlim_max - xlim_min) / 100,
+                ylim_min - padding_percent_y * (ylim_max - ylim_min) / 100,
+                ylim_max + padding_percent_y * (ylim_max - ylim_min) / 100,
+            ),
+            'cloud_image': None,
+            'cloud_density': cloud_density,
+            'legend_loc': 'best',
+            'tooltip_assets': tooltip_assets,
+            'tooltip_stats': tooltip_stats,
+        }
+        axes = self.axes(plot)
+        if cloud_blocks is not None:
+            plot['cloud_image'] = _cloud_image(axes, cloud_blocks, dpi=self.dpi)
+        if self.legend_handles:
+            _scatter_circles(axes, circles)
+            legend = axes.get_legend()
+            renderer = axes.figure.canvas.get_renderer()
+            best_box = legend.get_window_extent(renderer)
+            # best location is one of fixed locations, name of it keeps padding right at any dpi
+            for legend_loc in ('upper right', 'upper left', 'lower left', 'lower right', 'right', 'center left',
+                               'center right', 'lower center', 'upper center', 'center'):
+                legend.set_loc(legend_loc)
+                legend_box = legend.get_window_extent(renderer)
+                if abs(legend_box.x0 - best_box.x0) < 0.5 and abs(legend_box.y0 - best_box.y0) < 0.5:
+                    plot['legend_loc'] = legend_loc
+                    break
+        return plot
+
+
+def _scatter_circles(axes, circles: list[dict]):
+    '''
+    Circles without tooltips, consecutive circles with the same marker are one collection
+    '''
+    run_start = 0
+    for run_end in range(1, len(circles) + 1):
+        if run_end < len(circles) and circles[run_end]['marker'] == circles[run_start]['marker']:
+            continue
+        run = circles[run_start:run_end]
+        axes.scatter(
+            x=[circle['x'] for circle in run],
+            y=[circle['y'] for circle in run],
+            s=[circle['size'] for circle in run],
+            marker=run[0]['marker'],
+            facecolor=[circle['color'] for circle in run],
+            edgecolor='black',
+            linewidth=[circle['linewidth'] for circle in run],
+            zorder=2
+        )
+        run_start = run_end
+
+
+def _plot_path(plot: dict, extension: str):
+    makedirs(plot['directory'], exist_ok=True)
+    return os_path_join(plot['directory'], plot['filename'] + extension)
+
+
+def render_png(template: PlotTemplate, plot: dict):
+    axes = template.axes(plot)
+    _scatter_circles(axes, plot['circles'])
+    axes.figure.savefig(_plot_path(plot, '.png'), format="png", dpi=template.dpi)
+    logging.info('ready: %s', _plot_path(plot, '.png'))
+    return axes
+
+
+def render_html(template: PlotTemplate, plot: dict):
+    '''
+    PNG and HTML that builds tooltips from embedded circle data
+    '''
+    axes = render_png(template, plot)
+    _write_html_with_tooltips(
+        axes, plot['circles'], dpi=template.dpi,
+        png_path=_plot_path(plot, '.png'),
+        html_path=_plot_path(plot, '.html'),
+        title=plot['title'], tooltip_assets=plot['tooltip_assets'], tooltip_stats=plot['tooltip_stats'])
+    logging.info('ready: %s', _plot_path(plot, '.html'))
+
+
+def render_svg(template: PlotTemplate, plot: dict):
+    '''
+    Interactive SVG with tooltip pre-rendered for every circle
+    '''
+    axes = template.axes(plot)
+    circles = plot['circles']
     for index, circle in enumerate(circles):
         axes.scatter(
             x=circle['x'],
@@ -119,9 +256,6 @@ def draw_circles_with_tooltips(
             zorder=2
         )
 
-    plt.savefig(os_path_join(directory, filename + '.png'), format="png", dpi=300)
-    logging.info('ready: %s', os_path_join(directory, filename + ".png"))
-
     for index, circle in enumerate(circles):
         axes.annotate(
             gid=f'tooltip_{index: 08d}',
@@ -141,7 +275,7 @@ def draw_circles_with_tooltips(
             },
         )
     virtual_file = StringIO()
-    plt.savefig(virtual_file, format="svg")
+    axes.figure.savefig(virtual_file, format="svg")
 
     # XML trickery for interactive tooltips
 
@@ -176,5 +310,206 @@ def draw_circles_with_tooltips(
         """
 
     tree.insert(0, element_tree.XML(script))
-    element_tree.ElementTree(tree).write(os_path_join(directory, filename + '.svg'))
-    logging.info('ready: %s', os_path_join(directory, filename + ".svg"))
+    element_tree.ElementTree(tree).write(_plot_path(plot, '.svg'))
+    logging.info('ready: %s', _plot_path(plot, '.svg'))
+
+
+PLOT_RENDERERS = {'png': render_png, 'svg': render_svg, 'html': render_html}
+
+
+def plot_formats(output: str):
+    '''
+    Renderers of files of plot for given output, each one draws its own figure, so they can run in parallel
+    '''
+    return ['png', 'svg'] if output == 'svg' else ['html']
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def draw_frontiers(
+        frontiers: dict[str, list[tuple[float, float]]],
+        xlabel: str = None,
+        ylabel: str = None,
+        title: str = None,
+        directory: str = '.',
+        filename: str = 'frontiers'):
+    '''
+    Plot frontier line of every scenario into single PNG
+    '''
+
+    if not exists(directory):
+        makedirs(directory)
+
+    plt = importlib.import_module('matplotlib.pyplot')
+
+    plt.rcParams["font.family"] = "monospace"
+    plt.rcParams["font.size"] = 10
+    _, axes = plt.subplots(figsize=(12, 9))
+    axes.set_axisbelow(True)
+    axes.minorticks_on()
+    plt.grid(axis='both', which='major', linewidth=1)
+    plt.grid(axis='both', which='minor', linewidth=0.5, linestyle=':')
+    plt.title(title, zorder=0)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    for name, points in frontiers.items():
+        axes.plot(
+            [x for x, _ in points],
+            [y for _, y in points],
+            marker='o',
+            markersize=3,
+            linewidth=1,
+            label=name)
+    axes.legend(fontsize=8, facecolor='white', framealpha=0.66)
+    plt.savefig(os_path_join(directory, filename + '.png'), format="png", dpi=300)
+    plt.close(axes.figure)
+    logging.info('ready: %s', os_path_join(directory, filename + ".png"))
+
+
+def _cloud_image(axes, cloud_blocks: Callable[[], Iterable[dict]], dpi: int):
+    '''
+    Render circles onto separate canvas of the same pixel size as axes,
+    every block is drawn and dropped, so memory does not depend on number of circles.
+    Result is image to place on axes under regular circles.
+    '''
+    np = importlib.import_module('numpy')
+    figure_module = importlib.import_module('matplotlib.figure')
+    backend_agg = importlib.import_module('matplotlib.backends.backend_agg')
+    figure_width, figure_height = axes.figure.get_size_inches()
+    axes_position = axes.get_position()
+    cloud_figure = figure_module.Figure(
+        figsize=(figure_width * axes_position.width, figure_height * axes_position.height), dpi=dpi)
+    backend_agg.FigureCanvasAgg(cloud_figure)
+    cloud_figure.patch.set_alpha(0)
+    cloud_axes = cloud_figure.add_axes((0, 0, 1, 1))
+    cloud_axes.set_axis_off()
+    cloud_axes.set_xlim(axes.get_xlim())
+    cloud_axes.set_ylim(axes.get_ylim())
+    cloud_figure.canvas.draw()
+    for block in cloud_blocks():
+        collection = cloud_axes.scatter(
+            x=block['x'],
+            y=block['y'],
+            s=block['size'],
+            marker='o',
+            facecolor=block['color'],
+            edgecolor='black',
+            linewidth=block['linewidth'],
+        )
+        cloud_axes.draw_artist(collection)
+        collection.remove()
+    return np.asarray(cloud_figure.canvas.buffer_rgba()).copy()
+
+
+_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+    body {{ margin: 0; }}
+    #plot {{ position: relative; display: inline-block; }}
+    #plot img {{ display: block; width: 100%; max-width: {width}px; }}
+    #tooltip {{
+        position: absolute; display: none; pointer-events: none; white-space: pre;
+        font-family: monospace; font-size: 12px; padding: 6px;
+        background: rgba(255, 255, 255, 0.9); border: 0.5px solid black; border-radius: 6px;
+    }}
+</style>
+</head>
+<body>
+<div id="plot"><img src="data:image/png;base64,{png}"><div id="tooltip"></div></div>
+<script>
+const plot = {data};
+function decode(data, ArrayType) {{
+    return new ArrayType(Uint8Array.from(atob(data), c => c.charCodeAt(0)).buffer);
+}}
+const xs = decode(plot.x, Float32Array);
+const ys = decode(plot.y, Float32Array);
+const weights = decode(plot.weights, Uint8Array);
+const stats = decode(plot.stats, Float32Array);
+const image = document.querySelector('#plot img');
+const tooltip = document.getElementById('tooltip');
+// circle centers in pixels of original image
+const [x0, y0, x1, y1] = plot.axes_pixels;
+const [xmin, xmax, ymin, ymax] = plot.limits;
+const px = Float32Array.from(xs, x => x0 + (x - xmin) / (xmax - xmin) * (x1 - x0));
+const py = Float32Array.from(ys, y => y0 + (ymax - y) / (ymax - ymin) * (y1 - y0));
+function tooltipText(index) {{
+    const assetLines = [];
+    plot.asset_names.forEach((asset, assetIdx) => {{
+        const weight = weights[index * plot.asset_names.length + assetIdx];
+        if (weight !== 0) {{ assetLines.push(`${{asset}}: ${{weight}}%`); }}
+    }});
+    const statLines = plot.stat_names.map((stat, statIdx) =>
+        `${{stat.padEnd(8)}}: ${{stats[index * plot.stat_names.length + statIdx].toFixed(3)}}`);
+    const separator = '\\u2014'.repeat(Math.max(...assetLines.map(line => line.length)));
+    return [...assetLines, separator, ...statLines].join('\\n');
+}}
+image.addEventListener('mousemove', event => {{
+    const rect = image.getBoundingClientRect();
+    // pointer, circle centers and hover radius are compared in pixels of original image at any zoom
+    const scale = image.naturalWidth / rect.width;
+    const mouseX = (event.clientX - rect.left) * scale;
+    const mouseY = (event.clientY - rect.top) * scale;
+    let nearest = -1;
+    let nearestDistance = plot.radius ** 2;
+    for (let index = 0; index < px.length; index++) {{
+        const distance = (px[index] - mouseX) ** 2 + (py[index] - mouseY) ** 2;
+        if (distance < nearestDistance) {{ nearest = index; nearestDistance = distance; }}
+    }}
+    if (nearest < 0) {{ tooltip.style.display = 'none'; return; }}
+    tooltip.textContent = tooltipText(nearest);
+    tooltip.style.display = 'block';
+    tooltip.style.left = `${{px[nearest] / scale - tooltip.offsetWidth / 2}}px`;
+    tooltip.style.top = `${{py[nearest] / scale - tooltip.offsetHeight - 8}}px`;
+}});
+image.addEventListener('mouseleave', () => {{ tooltip.style.display = 'none'; }});
+</script>
+</body>
+</html>
+"""
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+def _write_html_with_tooltips(
+        axes, circles: list[dict], dpi: int,
+        png_path: str, html_path: str, title: str,
+        tooltip_assets: list[str], tooltip_stats: list[str]):
+    '''
+    Write already rendered PNG and circle data as typed arrays into single HTML,
+    tooltips are composed in browser for circle nearest to mouse pointer
+    '''
+    np = importlib.import_module('numpy')
+    figure_width, figure_height = axes.figure.get_size_inches() * dpi
+    axes_position = axes.get_position()
+    data = {
+        'asset_names': tooltip_assets,
+        'stat_names': tooltip_stats,
+        'limits': [*axes.get_xlim(), *axes.get_ylim()],
+        # left, top, right, bottom in image pixels
+        'axes_pixels': [
+            axes_position.x0 * figure_width, (1 - axes_position.y1) * figure_height,
+            axes_position.x1 * figure_width, (1 - axes_position.y0) * figure_height,
+        ],
+        # hover radius of 10 points in image pixels
+        'radius': 10 * dpi / 72,
+    }
+    columns = {
+        'x': np.array([circle['x'] for circle in circles], dtype='<f4'),
+        'y': np.array([circle['y'] for circle in circles], dtype='<f4'),
+        'weights': np.array([circle['weights'] for circle in circles], dtype=np.uint8),
+        'stats': np.array([circle['stats'] for circle in circles], dtype='<f4'),
+    }
+    for column, values in columns.items():
+        data[column] = b64encode(values.tobytes()).decode('ascii')
+    with open(png_path, 'rb') as png_file:
+        png = b64encode(png_file.read()).decode('ascii')
+    with open(html_path, 'w', encoding='utf-8') as html_file:
+        html_file.write(_HTML_TEMPLATE.format(
+            title=html_escape(title or ''),
+            width=int(figure_width / 3),
+            png=png,
+            data=json.dumps(data, ensure_ascii=False)))
@@ -16,95 +16,248 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
+import os
 import csv
+import json
+import hashlib
+import logging
+from importlib import import_module
 from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from collections.abc import Iterable
+from functools import cache
+from itertools import chain
 from itertools import islice
 from itertools import batched
+from modules import stats
+from modules.market import MarketReturns
 from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
 
 
-def all_possible_allocations(assets_n: int, step: int):
+def all_possible_allocations(
+        assets_n: int, step: int,
+        constraints: AllocationConstraints = None,
+        start: int = 0,
+        subtree_size=None):
     """
     equivalent to filter(lambda x: sum(x) == 100, itertools.product(range(0,101,step), repeat=len(assets)))
-    but considerably faster
+    but considerably faster, allocations that violate constraints are never generated.
+    Assets that have their own step in constraints are stepped by it instead of `step`.
+    First `start` allocations are skipped without generating them,
+    subtree_size from allocations_counter of the same constraints and step may be shared between calls.
     """
-    # pylint: disable=too-many-arguments
-    # pylint: disable=too-many-positional-arguments
-    def _allocations_recursive(
-            assets_n: int, step: int,
-            asset_idx: int = 0, asset_idx_max: int = 0,
-            allocation: list[int] = (),
-            allocation_sum: int = 0):
-        if asset_idx == asset_idx_max:
-            allocation[asset_idx] = 100 - allocation_sum
-            yield allocation.copy()  # dict(zip(assets, allocation))
-            allocation[asset_idx] = 0
-        else:
-            for next_asset_percent in range(0, 100 - allocation_sum + 1, step):
-                allocation[asset_idx] = next_asset_percent
+    if 100 % step != 0:
+        raise ValueError(f'cannot use step={step}, must be a divisor of 100')
+    if constraints is None:
+        constraints = AllocationConstraints(assets_n)
+    if subtree_size is None:
+        subtree_size = allocations_counter(constraints, step)
+    allocation = [0] * assets_n
+    allocations_to_skip = start
+
+    def _allocations_recursive(asset_idx: int, allocation_sum: int, assets_used: int, group_sums: tuple):
+        nonlocal allocations_to_skip
+        for weight, next_used, next_group_sums in constraints.asset_choices(
+                asset_idx, step, allocation_sum, assets_used, group_sums):
+            if allocations_to_skip > 0:
+                skipped = subtree_size(asset_idx + 1, allocation_sum + weight, next_used, next_group_sums)
+                if skipped <= allocations_to_skip:
+                    allocations_to_skip -= skipped
+                    continue
+            allocation[asset_idx] = weight
+            if asset_idx == assets_n - 1:
+                yield allocation.copy()
+            else:
                 yield from _allocations_recursive(
-                    assets_n, step,
-                    asset_idx + 1, asset_idx_max,
-                    allocation,
-                    allocation_sum + next_asset_percent)
-                allocation[asset_idx] = 0
+                    asset_idx + 1, allocation_sum + weight, next_used, next_group_sums)
+        allocation[asset_idx] = 0
+
+    yield from _allocations_recursive(0, 0, 0, (0,) * len(constraints.groups))
+
+
+def allocations_counter(constraints: AllocationConstraints, step: int):
+    '''
+    Number of allocations in subtree of generator, memoized
+    '''
+    @cache
+    def _subtree_size(asset_idx: int, allocation_sum: int, assets_used: int, group_sums: tuple):
+        if asset_idx == constraints.assets_n:
+            return 1
+        return sum(
+            _subtree_size(asset_idx + 1, allocation_sum + weight, next_used, next_group_sums)
+            for weight, next_used, next_group_sums in constraints.asset_choices(
+                asset_idx, step, allocation_sum, assets_used, group_sums))
+    return _subtree_size
+
+
+def count_possible_allocations(assets_n: int, step: int, constraints: AllocationConstraints = None):
+    """
+    exact number of allocations all_possible_allocations would generate
+    """
     if 100 % step != 0:
         raise ValueError(f'cannot use step={step}, must be a divisor of 100')
-    yield from _allocations_recursive(
-        assets_n=assets_n, step=step,
-        asset_idx=0, asset_idx_max=assets_n - 1,
-        allocation=[0] * assets_n,
-        allocation_sum=0)
+    if constraints is None:
+        constraints = AllocationConstraints(assets_n)
+    return allocations_counter(constraints, step)(0, 0, 0, (0,) * len(constraints.groups))
+
+
+# read-only state of simulator pool worker, installed once per process by init_range_worker
+_range_worker = {}
 
 
 # pylint: disable=too-many-arguments
-# pylint: disable=too-many-locals
 # pylint: disable=too-many-positional-arguments
-def allocation_slice_simulate_and_feed_to_sink(
-        slice_idx, slice_size,
+def init_range_worker(
         assets, percentage_step,
-        year_range_selector_func, asset_gain_per_year,
-        sink, chunk_size):
+        year_range_selector_funcs, asset_gain_per_year,
+        sink, chunk_size,
+        constraints=None,
+        stat_names=Portfolio.SERIALIZED_STATS,
+        rebalancing=None):
+    '''
+    Initializer of simulator pool: market data, constraints and sink are shipped once per process,
+    so tasks are just ranges of allocation indexes
+    '''
+    if constraints is None:
+        constraints = AllocationConstraints(len(assets))
+    _range_worker.update({
+        'assets': assets,
+        'percentage_step': percentage_step,
+        'year_range_selector_funcs': year_range_selector_funcs,
+        'asset_gain_per_year': asset_gain_per_year,
+        'sink': sink,
+        'chunk_size': chunk_size,
+        'constraints': constraints,
+        'stat_names': stat_names,
+        'rebalancing': rebalancing,
+        'subtree_size': allocations_counter(constraints, percentage_step),
+        'thread_executor': ThreadPoolExecutor(max_workers=1),
+    })
+
+
+def release_range_worker():
+    '''
+    Drop state of worker that is not a separate process
+    '''
+    if _range_worker:
+        _range_worker['thread_executor'].shutdown()
+        _range_worker.clear()
+
+
+def allocation_range_simulate_and_feed_to_sink(range_start: int, range_stop: int):
+    '''
+    Simulate allocations within [range_start, range_stop) and send them to sink of pool worker,
+    every chunk of allocations is simulated at once
+    '''
+    worker = _range_worker
     portfolios_sent = 0
-    with ThreadPoolExecutor() as thread_executor:
-        possible_allocations_gen = all_possible_allocations(len(assets), percentage_step)
-        gen_slice_allocations = islice(possible_allocations_gen, slice_idx * slice_size, (slice_idx + 1) * slice_size)
-        gen_portfolios = map(
-            partial(Portfolio, assets=assets),
-            gen_slice_allocations)
-        gen_simulateds = map(
-            partial(Portfolio.simulated,
-                    year_range_selector_func=year_range_selector_func,
-                    asset_gain_per_year=asset_gain_per_year),
-            gen_portfolios)
-        gen_serializations = map(Portfolio.serialize, gen_simulateds)
-        send_task = None
-        for batch in batched(gen_serializations, chunk_size):
+    possible_allocations_gen = all_possible_allocations(
+        len(worker['assets']), worker['percentage_step'], constraints=worker['constraints'],
+        start=range_start, subtree_size=worker['subtree_size'])
+    send_task = None
+    for batch in batched(islice(possible_allocations_gen, range_stop - range_start), worker['chunk_size']):
+        selectors_records = stats.simulated_records(
+            batch, worker['asset_gain_per_year'], worker['year_range_selector_funcs'], worker['stat_names'],
+            worker['rebalancing'])
+        for selector_idx, records in enumerate(selectors_records):
+            chunk = tagged_chunk(selector_idx, (records.tobytes(),))
             if send_task is not None:
                 send_task.result()
-            send_task = thread_executor.submit(sink.send_bytes, b''.join(batch))
-            portfolios_sent += len(batch)
-        if send_task is not None:
-            send_task.result()
+            send_task = worker['thread_executor'].submit(worker['sink'].send_bytes, chunk)
+        portfolios_sent += len(batch)
+    if send_task is not None:
+        send_task.result()
     return portfolios_sent
 
 
-def read_capitalgain_csv_data(filename):
-    yearly_gain = {}  # year, ticker = cash multiplier
-    # read csv values from tickers.csv
-    rows = []
-    with open(filename, "r", encoding="utf-8") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        rows = list(csv_reader)
-    assets = rows[0][1:]
-    for row in rows[1:]:
-        if row[0] not in yearly_gain:
-            yearly_gain[int(row[0])] = [0] * len(assets)
-        for i in range(1, len(row)):
-            yearly_gain[int(row[0])][i - 1] = \
-                float(row[i].replace('%', '')) / 100 + 1
-    return assets, yearly_gain
+def parse_returns_csv(filename: str):
+    '''
+    Assets and market returns of csv with header row of assets and one row per period:
+    period label, then return of every asset in percents. Values are converted in bulk.
+    '''
+    np = import_module('numpy')
+    with open(filename, 'r', encoding='utf-8') as csv_file:
+        header = next(csv.reader([csv_file.readline()]))
+        rows = [row for row in csv.reader(io.StringIO(csv_file.read().replace('%', ''))) if row]
+    assets = header[1:]
+    if any(len(row) != len(header) for row in rows):
+        raise ValueError(f'every row of {filename} must have period and {len(assets)} returns')
+    try:
+        returns = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(assets))
+        return assets, MarketReturns([row[0] for row in rows], returns / 100 + 1)
+    except ValueError as error:
+        raise ValueError(f'{filename}: {error}') from error
+
+
+def _cached_returns(filename: str, cache_dir: str):
+    '''
+    Parsed returns cached as numpy file that is memory-mapped instead of parsed again,
+    cache is valid while csv has the same modification time and size or the same content
+    '''
+    np = import_module('numpy')
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(
+        cache_dir, hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16])
+    source_stat = os.stat(filename)
+    cached = None
+    if os.path.isfile(cache_path + '.json') and os.path.isfile(cache_path + '.npy'):
+        with open(cache_path + '.json', 'r', encoding='utf-8') as json_file:
+            cached = json.load(json_file)
+    if cached is not None and (cached['mtime_ns'], cached['size']) == (source_stat.st_mtime_ns, source_stat.st_size):
+        return cached['assets'], MarketReturns(cached['periods'], np.load(cache_path + '.npy', mmap_mode='r'))
+    with open(filename, 'rb') as csv_file:
+        digest = hashlib.sha1(csv_file.read()).hexdigest()
+    if cached is None or cached['sha1'] != digest:
+        assets, market = parse_returns_csv(filename)
+        np.save(cache_path + '.tmp.npy', market.gains)
+        os.replace(cache_path + '.tmp.npy', cache_path + '.npy')
+        cached = {'source': os.path.abspath(filename), 'sha1': digest, 'assets': assets, 'periods': market.periods}
+        logging.info('Parsed %d periods of %d assets from %s', len(market.periods), len(assets), filename)
+    cached.update({'mtime_ns': source_stat.st_mtime_ns, 'size': source_stat.st_size})
+    with open(cache_path + '.tmp.json', 'w', encoding='utf-8') as json_file:
+        json.dump(cached, json_file, ensure_ascii=False)
+    os.replace(cache_path + '.tmp.json', cache_path + '.json')
+    return cached['assets'], MarketReturns(cached['periods'], np.load(cache_path + '.npy', mmap_mode='r'))
+
+
+def read_capitalgain_csv_data(filename: str, cache_dir: str = ''):
+    '''
+    Assets and their returns, MarketReturns maps year to cash multiplier of every asset.
+    With cache_dir parsed returns are cached there.
+    '''
+    if cache_dir:
+        return _cached_returns(filename, cache_dir)
+    return parse_returns_csv(filename)
+
+
+def tagged_chunk(selector_idx: int, serialized_portfolios: Iterable[bytes]):
+    '''
+    Chunk of serialized portfolios prefixed with index of year range selector they were simulated with
+    '''
+    return b''.join(chain((bytes((selector_idx,)),), serialized_portfolios))
+
+
+def untagged_chunk(chunk: bytes):
+    '''
+    Index of year range selector and serialized portfolios of chunk, without copying
+    '''
+    return chunk[0], memoryview(chunk)[1:]
+
+
+# tag of checkpoint markers, year range selector indexes are below it
+CHECKPOINT_TAG = 255
+
+
+def checkpoint_chunk(allocations_done: int):
+    '''
+    Marker that every allocation before allocations_done was sent
+    '''
+    return bytes((CHECKPOINT_TAG,)) + allocations_done.to_bytes(8, 'little')
+
+
+def checkpoint_allocations_done(data: bytes):
+    return int.from_bytes(data, 'little')
 
 
 # pylint: disable=too-few-public-methods
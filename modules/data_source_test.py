@@ -17,8 +17,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import itertools
+from multiprocessing import Pipe
+from concurrent.futures import ProcessPoolExecutor
 import pytest
 from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
 
 
 @pytest.mark.parametrize('assets_n, step',
@@ -45,3 +49,37 @@ def test_all_possible_allocations(assets_n: int, step: int):
     test_allocations.sort()
     # must be strictly equivalent to filtered product
     assert test_allocations == expected_allocations
+
+
+@pytest.mark.parametrize('selector_idx', [0, 7])
+def test_tagged_chunk(selector_idx: int):
+    serialized_portfolios = [b'\x01\x02\x03', b'', b'\x04']
+    chunk = data_source.tagged_chunk(selector_idx, serialized_portfolios)
+    untagged_idx, data = data_source.untagged_chunk(chunk)
+    assert untagged_idx == selector_idx
+    assert bytes(data) == b''.join(serialized_portfolios)
+
+
+# pylint: disable=too-many-locals
+def test_allocation_range_tasks():
+    assets = ['stocks', 'bonds', 'gold', 'silver']
+    market = {year: [1 + (year % 5) / 10, 1.03, 0.9 + (year % 3) / 10, 1.1] for year in range(2000, 2010)}
+    selector_funcs = [data_filter.year_selectors()[selector] for selector in ('all-to-all', 'first-to-last')]
+    source, sink = Pipe(duplex=False)
+    allocations = list(data_source.all_possible_allocations(len(assets), 10))
+    # tasks are any ranges of allocation indexes, they may be done in any order
+    task_ranges = [(100, len(allocations)), (0, 1), (1, 50), (50, 100)]
+    with ProcessPoolExecutor(
+            max_workers=2, initializer=data_source.init_range_worker,
+            initargs=(assets, 10, selector_funcs, market, sink, 7)) as process_pool:
+        portfolios_sent = process_pool.map(data_source.allocation_range_simulate_and_feed_to_sink, *zip(*task_ranges))
+        assert list(portfolios_sent) == [range_stop - range_start for range_start, range_stop in task_ranges]
+    received = [[], []]
+    while source.poll():
+        selector_idx, data = data_source.untagged_chunk(source.recv_bytes())
+        received[selector_idx].extend(Portfolio.deserialize_iter(data, assets))
+    for selector_func, selector_portfolios in zip(selector_funcs, received):
+        assert sorted(portfolio.weights for portfolio in selector_portfolios) == sorted(allocations)
+        expected = Portfolio(allocations[42], assets).simulated(selector_func, market)
+        portfolio = next(portfolio for portfolio in selector_portfolios if portfolio.weights == allocations[42])
+        assert portfolio.stat == pytest.approx(expected.stat, rel=1e-6)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+from importlib import import_module
+from modules.portfolio import Portfolio
+
+
+# pylint: disable=too-many-instance-attributes
+class DensityGrid:
+    '''
+    Streaming 2-D histogram of portfolios in coordinate space.
+    Every bin keeps number of portfolios and sum of their weights.
+    Grid range doubles when portfolios fall outside of it, merging pairs of bins,
+    so memory does not depend on number of portfolios.
+    '''
+
+    def __init__(
+            self, assets: list[str], coord_pair: tuple[str, str], bins: tuple[int, int] = (480, 360),
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        np = import_module('numpy')
+        if bins[0] % 2 != 0 or bins[1] % 2 != 0:
+            raise ValueError(f'cannot use bins={bins}, must be even')
+        self.assets = assets
+        self.coord_pair = coord_pair
+        self.stat_names = stat_names
+        self.bins = bins
+        self.size = 0
+        self.bounds = (math.inf, -math.inf, math.inf, -math.inf)  # min x, max x, min y, max y
+        self.origin = None  # x, y of lower left corner of grid
+        self.span = None  # width, height of grid
+        self.counts = np.zeros((bins[1], bins[0]), dtype=np.int64)
+        self.weight_sums = np.zeros((bins[1], bins[0], len(assets)), dtype=np.float64)
+
+    def _expand(self, axis: int, towards_lower: bool):
+        '''
+        Double grid span along axis (0 is x, 1 is y), merging pairs of bins
+        '''
+        np = import_module('numpy')
+        array_axis = 1 - axis
+        half = self.bins[axis] // 2
+        for name in ('counts', 'weight_sums'):
+            values = getattr(self, name)
+            merged = values.take(range(0, self.bins[axis], 2), axis=array_axis) + \
+                values.take(range(1, self.bins[axis], 2), axis=array_axis)
+            expanded = np.zeros_like(values)
+            target = [slice(None)] * values.ndim
+            target[array_axis] = slice(half, None) if towards_lower else slice(0, half)
+            expanded[tuple(target)] = merged
+            setattr(self, name, expanded)
+        origin, span = list(self.origin), list(self.span)
+        if towards_lower:
+            origin[axis] -= span[axis]
+        span[axis] *= 2
+        self.origin, self.span = tuple(origin), tuple(span)
+
+    def append(self, serialized_data: bytes):
+        np = import_module('numpy')
+        records = np.frombuffer(serialized_data, dtype=Portfolio.serialized_dtype(len(self.assets), self.stat_names))
+        if len(records) == 0:
+            return
+        coords = (
+            records[self.coord_pair[1]].astype(np.float64),
+            records[self.coord_pair[0]].astype(np.float64),
+        )
+        lows = tuple(float(values.min()) for values in coords)
+        highs = tuple(float(values.max()) for values in coords)
+        self.bounds = (
+            min(self.bounds[0], lows[0]), max(self.bounds[1], highs[0]),
+            min(self.bounds[2], lows[1]), max(self.bounds[3], highs[1]),
+        )
+        if self.origin is None:
+            self.origin = lows
+            self.span = tuple(
+                (high - low) * (1 + 1 / bins) or max(abs(low), 1) / bins
+                for low, high, bins in zip(lows, highs, self.bins))
+        for axis in (0, 1):
+            while lows[axis] < self.origin[axis]:
+                self._expand(axis, towards_lower=True)
+            while highs[axis] >= self.origin[axis] + self.span[axis]:
+                self._expand(axis, towards_lower=False)
+        bin_x, bin_y = (
+            np.clip(((values - self.origin[axis]) / self.span[axis] * self.bins[axis]).astype(np.int64),
+                    0, self.bins[axis] - 1)
+            for axis, values in enumerate(coords))
+        flat_bins = bin_y * self.bins[0] + bin_x
+        bins_total = self.bins[0] * self.bins[1]
+        self.counts += np.bincount(flat_bins, minlength=bins_total).reshape(self.counts.shape)
+        weights = records['weights']
+        for asset_idx in range(len(self.assets)):
+            self.weight_sums[:, :, asset_idx] += np.bincount(
+                flat_bins, weights=weights[:, asset_idx], minlength=bins_total).reshape(self.counts.shape)
+        self.size += len(records)
+
+    def extent(self):
+        return (
+            self.origin[0], self.origin[0] + self.span[0],
+            self.origin[1], self.origin[1] + self.span[1],
+        )
+
+    def image(self, color_map: dict[str, tuple[int, int, int]]):
+        '''
+        RGBA image, lowest row first: bins are colored by mean asset mix of their portfolios,
+        opacity grows with logarithm of number of portfolios in bin
+        '''
+        np = import_module('numpy')
+        image = np.zeros((*self.counts.shape, 4), dtype=np.float64)
+        filled = self.counts > 0
+        if not filled.any():
+            return image
+        mean_weights = self.weight_sums[filled] / self.counts[filled][:, None]
+        image[filled, 0:3] = Portfolio.plot_circle_colors(mean_weights, self.assets, color_map)
+        log_counts = np.log1p(self.counts[filled])
+        image[filled, 3] = 0.35 + 0.65 * log_counts / max(log_counts.max(), 1e-9)
+        return image
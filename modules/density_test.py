@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+from modules import data_source
+from modules.portfolio import Portfolio
+from modules.density import DensityGrid
+
+ASSETS = ['AAPL', 'MSFT', 'GOOG']
+
+
+def _random_portfolios(seed: int):
+    rng = random.Random(seed)
+    portfolios = []
+    for allocation in data_source.all_possible_allocations(len(ASSETS), 5):
+        portfolio = Portfolio(weights=allocation, assets=ASSETS)
+        for stat in Portfolio.SERIALIZED_STATS:
+            portfolio.stat[stat] = rng.uniform(-100, 100) * (seed + 1)
+        # stats are sent as float32
+        portfolios.append(Portfolio.deserialize(portfolio.serialize(), assets=ASSETS))
+    return portfolios
+
+
+@pytest.mark.parametrize('chunk_size', [1, 17, 1000])
+def test_density_grid(chunk_size):
+    coord_pair = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+    grid = DensityGrid(ASSETS, coord_pair, bins=(16, 8))
+    portfolios = _random_portfolios(0) + _random_portfolios(3)
+    for start in range(0, len(portfolios), chunk_size):
+        grid.append(b''.join(portfolio.serialize() for portfolio in portfolios[start:start + chunk_size]))
+
+    assert grid.size == len(portfolios)
+    assert grid.counts.sum() == len(portfolios)
+    for asset_idx in range(len(ASSETS)):
+        assert grid.weight_sums[:, :, asset_idx].sum() == \
+            pytest.approx(sum(portfolio.weights[asset_idx] for portfolio in portfolios))
+    xs = [portfolio.stat[coord_pair[1]] for portfolio in portfolios]
+    ys = [portfolio.stat[coord_pair[0]] for portfolio in portfolios]
+    x_min, x_max, y_min, y_max = grid.extent()
+    assert x_min <= min(xs) and max(xs) < x_max
+    assert y_min <= min(ys) and max(ys) < y_max
+    assert grid.bounds == pytest.approx((min(xs), max(xs), min(ys), max(ys)))
+
+    image = grid.image({'AAPL': [1, 0, 0], 'MSFT': [0, 1, 0], 'GOOG': [0, 0, 1]})
+    assert image.shape == (8, 16, 4)
+    assert ((image[:, :, 3] > 0) == (grid.counts > 0)).all()
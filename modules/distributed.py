@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import logging
+import threading
+from importlib import import_module
+from itertools import batched
+from itertools import islice
+import multiprocessing.connection
+from multiprocessing.connection import Listener
+from multiprocessing.connection import Client
+from concurrent.futures import ProcessPoolExecutor
+from modules import data_source
+from modules import profiling
+from modules import data_filter
+from modules import stats
+from modules.portfolio import Portfolio
+from modules.portfolio_batch import PortfolioBatch
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+from modules.simulator import send_reused_portfolios
+from modules.simulator import constraints_without_reused
+
+# shared secret of coordinator and workers when it is not given on command line
+AUTH_KEY_ENV = 'PORTFOLIO_OPTIMIZER_AUTH_KEY'
+
+
+def parse_address(text: str):
+    '''
+    "host:port" into address for multiprocessing.connection
+    '''
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+def range_candidates(
+        range_start: int, range_stop: int,
+        assets: list[str], percentage_step: int,
+        year_selectors: list[str], asset_gain_per_year: dict[int, list[float]],
+        constraints: AllocationConstraints,
+        coords_tuples: list[tuple[str, str]], hull_layers: int,
+        chunk_size: int,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        subtree_size=None,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Simulate allocations within [range_start, range_stop) and keep only portfolios
+    that are on hull layers of any coordinate pair, per chunk like plotters do.
+    Returns serialized candidates for every year range selector.
+    '''
+    np = import_module('numpy')
+    selector_funcs = [data_filter.year_selectors()[year_selector] for year_selector in year_selectors]
+    candidates = [[] for _ in year_selectors]
+    allocations = islice(
+        data_source.all_possible_allocations(
+            len(assets), percentage_step, constraints, start=range_start, subtree_size=subtree_size),
+        range_stop - range_start)
+    for batch in batched(allocations, chunk_size):
+        selectors_records = stats.simulated_records(
+            batch, asset_gain_per_year, selector_funcs, stat_names, rebalancing)
+        for selector_idx, records in enumerate(selectors_records):
+            if hull_layers == 0:
+                candidates[selector_idx].append(records.tobytes())
+                continue
+            batch = PortfolioBatch.from_records(records, assets)
+            on_hull = np.unique(np.concatenate([
+                data_filter.multilayer_convex_hull_indexes(batch.points(coord_pair), hull_layers)
+                for coord_pair in coords_tuples]))
+            candidates[selector_idx].append(records[on_hull].tobytes())
+    return [b''.join(selector_candidates) for selector_candidates in candidates]
+
+
+# job of worker pool process, installed once per process by _init_job_worker
+_job_worker = {}
+
+
+def _init_job_worker(job: dict):
+    _job_worker.update(job)
+    _job_worker['subtree_size'] = data_source.allocations_counter(
+        job['constraints'] or AllocationConstraints(len(job['assets'])), job['percentage_step'])
+
+
+def _job_range_candidates(range_start: int, range_stop: int):
+    return range_candidates(range_start, range_stop, **_job_worker)
+
+
+class _RangeQueue:
+    '''
+    Ranges of allocation indexes waiting for workers, ranges of lost workers are put back
+    '''
+
+    def __init__(self, total: int, range_size: int):
+        self._condition = threading.Condition()
+        self._pending = [(start, min(start + range_size, total)) for start in range(0, total, range_size)]
+        self._pending.reverse()
+        self._unfinished = len(self._pending)
+
+    def take(self):
+        '''
+        Next range, None when every range is finished
+        '''
+        with self._condition:
+            while not self._pending and self._unfinished > 0:
+                self._condition.wait()
+            return self._pending.pop() if self._pending else None
+
+    def put_back(self, allocation_range: tuple[int, int]):
+        with self._condition:
+            self._pending.append(allocation_range)
+            self._condition.notify()
+
+    def finish(self):
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def wait_finished(self):
+        with self._condition:
+            while self._unfinished > 0:
+                self._condition.wait()
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-statements
+def coordinator_process_func(
+        address: tuple[str, int] = None,
+        authkey: bytes = None,
+        assets: list[str] = None,
+        percentage_step: int = None,
+        year_selectors: list[str] = None,
+        asset_gain_per_year: dict[int, list[float]] = None,
+        sink: multiprocessing.connection.Connection = None,
+        chunk_size: int = 1,
+        reusable_entries: list[dict] = None,
+        constraints: AllocationConstraints = None,
+        coords_tuples: list[tuple[str, str]] = None,
+        hull_layers: int = 0,
+        range_size: int = 2**20,
+        worker_timeout: float = None,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Drop-in replacement of simulator process: hand out ranges of allocation indexes to workers over TCP
+    and send their hull candidates to sink. Range of worker that disconnected or did not answer
+    within worker_timeout seconds is given to another worker.
+    '''
+    if constraints is None:
+        constraints = AllocationConstraints(len(assets))
+    if reusable_entries is not None:
+        send_reused_portfolios(assets, reusable_entries, sink, chunk_size, constraints)
+    constraints = constraints_without_reused(assets, reusable_entries, constraints)
+    possible_allocations = data_source.count_possible_allocations(len(assets), percentage_step, constraints)
+    job = {
+        'assets': assets,
+        'percentage_step': percentage_step,
+        'year_selectors': year_selectors,
+        'asset_gain_per_year': asset_gain_per_year,
+        'constraints': constraints,
+        'coords_tuples': coords_tuples,
+        'hull_layers': hull_layers,
+        'chunk_size': chunk_size,
+        'stat_names': stat_names,
+        'rebalancing': rebalancing,
+    }
+    ranges = _RangeQueue(possible_allocations, range_size)
+    sink_lock = threading.Lock()
+    time_start = time.time()
+
+    def serve_worker(connection: multiprocessing.connection.Connection, worker: str):
+        allocation_range = None
+        try:
+            connection.send({'job': job})
+            while (allocation_range := ranges.take()) is not None:
+                connection.send({'range': allocation_range})
+                if not connection.poll(worker_timeout):
+                    raise TimeoutError(f'no answer in {worker_timeout}s')
+                reply = connection.recv()
+                with sink_lock:
+                    for selector_idx, candidates in enumerate(reply['candidates']):
+                        if candidates:
+                            sink.send_bytes(data_source.tagged_chunk(selector_idx, (candidates,)))
+                logging.info('worker %s: allocations %d-%d done', worker, *allocation_range)
+                allocation_range = None
+                ranges.finish()
+            connection.send({'done': True})
+        except (EOFError, OSError, TimeoutError) as error:
+            logging.warning('worker %s lost: %r', worker, error)
+            if allocation_range is not None:
+                ranges.put_back(allocation_range)
+        finally:
+            connection.close()
+
+    def accept_workers(listener: Listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError) as error:
+                if listener_closed.is_set():
+                    return
+                logging.warning('worker rejected: %r', error)
+                continue
+            worker = '%s:%d' % listener.last_accepted  # pylint: disable=consider-using-f-string
+            logging.info('worker %s connected', worker)
+            worker_thread = threading.Thread(target=serve_worker, args=(connection, worker), daemon=True)
+            worker_threads.append(worker_thread)
+            worker_thread.start()
+
+    listener_closed = threading.Event()
+    worker_threads = []
+    with Listener(address, authkey=authkey) as listener:
+        logging.info('Will simulate %d portfolios on workers connected to %s:%d',
+                     possible_allocations, *listener.address)
+        threading.Thread(target=accept_workers, args=(listener,), daemon=True).start()
+        ranges.wait_finished()
+        listener_closed.set()
+    # every range is finished, workers are told they are done
+    for worker_thread in list(worker_threads):
+        worker_thread.join()
+    time_end = time.time()
+    logging.info('Simulated %d portfolios, rate: %dk/s',
+                 possible_allocations, possible_allocations // (int(time_end - time_start) + 1) // 1000)
+    sink.send(data_source.DataStreamFinished())
+
+
+def _serve_coordinator(
+        connection: multiprocessing.connection.Connection, address: tuple[str, int],
+        process_pool: ProcessPoolExecutor, tasks_per_core: int = 4):
+    '''
+    Split every range given by coordinator into tasks for pool and send back their candidates
+    '''
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            logging.warning('coordinator %s:%d disconnected', *address)
+            break
+        if 'range' not in message:
+            break
+        range_start, range_stop = message['range']
+        task_size = (range_stop - range_start) // (os.cpu_count() * tasks_per_core) + 1
+        task_starts = range(range_start, range_stop, task_size)
+        tasks_candidates = process_pool.map(
+            _job_range_candidates, task_starts, [min(start + task_size, range_stop) for start in task_starts])
+        connection.send({
+            'candidates': [b''.join(selector_candidates) for selector_candidates in zip(*tasks_candidates)]
+        })
+        logging.info('allocations %d-%d done', range_start, range_stop)
+
+
+def worker_main(address: tuple[str, int], authkey: bytes, connect_attempts: int = 30):
+    '''
+    Simulate ranges given by coordinator on every local core until coordinator is done
+    '''
+    for attempt in range(connect_attempts):
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if attempt == connect_attempts - 1:
+                raise
+            time.sleep(1)
+    with connection:
+        job = connection.recv()['job']
+        logging.info('connected to coordinator %s:%d', *address)
+        # job is shipped to every process once, tasks are ranges of allocation indexes
+        with ProcessPoolExecutor(
+                initializer=profiling.profiled(_init_job_worker, 'worker-pool'), initargs=(job,)) as process_pool:
+            _serve_coordinator(connection, address, process_pool)
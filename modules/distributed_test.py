@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import socket
+import pickle
+from multiprocessing import Pipe
+from multiprocessing import Process
+from multiprocessing.connection import Client
+import numpy as np
+from modules import data_source
+from modules import data_filter
+from modules import distributed
+from modules.portfolio import Portfolio
+
+ASSETS = ['A', 'B', 'C', 'D']
+MARKET = {
+    2000: [1.03, 1.04, 1.05, 0.97],
+    2001: [1.01, 0.91, 1.09, 1.10],
+    2002: [0.99, 1.09, 0.91, 1.02],
+    2003: [1.02, 1.12, 1.08, 0.95],
+    2004: [1.07, 0.98, 1.01, 1.04],
+}
+YEAR_SELECTORS = ['first-to-last', 'all-to-all']
+COORDS_TUPLES = [
+    (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV),
+    (Portfolio.STAT_SHARPE, Portfolio.STAT_VARIANCE),
+]
+AUTHKEY = b'test'
+
+
+def _free_address():
+    with socket.socket() as free_socket:
+        free_socket.bind(('localhost', 0))
+        return free_socket.getsockname()
+
+
+def _lost_worker(address):
+    '''
+    Take a range and disconnect without answering
+    '''
+    for _ in range(50):
+        try:
+            connection = Client(address, authkey=AUTHKEY)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    assert 'job' in connection.recv()
+    assert 'range' in connection.recv()
+    connection.close()
+
+
+def _hull(portfolios, coord_pair):
+    points = [(portfolio.stat[coord_pair[0]], portfolio.stat[coord_pair[1]]) for portfolio in portfolios]
+    return sorted(points[index] for index in data_filter.multilayer_convex_hull_indexes(np.array(points), 1))
+
+
+def test_coordinator_with_lost_worker():
+    address = _free_address()
+    source, sink = Pipe(duplex=False)
+    coordinator = Process(target=distributed.coordinator_process_func, kwargs={
+        'address': address,
+        'authkey': AUTHKEY,
+        'assets': ASSETS,
+        'percentage_step': 5,
+        'year_selectors': YEAR_SELECTORS,
+        'asset_gain_per_year': MARKET,
+        'sink': sink,
+        'chunk_size': 50,
+        'coords_tuples': COORDS_TUPLES,
+        'hull_layers': 1,
+        'range_size': 300,
+    })
+    coordinator.start()
+    _lost_worker(address)
+    workers = [Process(target=distributed.worker_main, args=(address, AUTHKEY)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+
+    candidates = [[] for _ in YEAR_SELECTORS]
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    while (bytes_from_pipe := source.recv_bytes()) != data_stream_end_pickle:
+        selector_idx, data = data_source.untagged_chunk(bytes_from_pipe)
+        candidates[selector_idx].extend(Portfolio.deserialize_iter(bytes(data), assets=ASSETS))
+    coordinator.join()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    selector_funcs = data_filter.year_selectors()
+    for selector_idx, year_selector in enumerate(YEAR_SELECTORS):
+        portfolios = [
+            Portfolio.deserialize(
+                Portfolio(allocation, ASSETS).simulated(selector_funcs[year_selector], MARKET).serialize(),
+                assets=ASSETS)
+            for allocation in data_source.all_possible_allocations(len(ASSETS), 5)
+        ]
+        # candidates are reduced, but nothing on hull is lost, nothing is sent twice
+        assert len(candidates[selector_idx]) < len(portfolios)
+        assert len(set(tuple(p.weights) for p in candidates[selector_idx])) == len(candidates[selector_idx])
+        for coord_pair in COORDS_TUPLES:
+            assert _hull(candidates[selector_idx], coord_pair) == _hull(portfolios, coord_pair)
+
+
+def test_parse_address():
+    assert distributed.parse_address('example.com:8765') == ('example.com', 8765)
+    assert distributed.parse_address(':8765') == ('localhost', 8765)
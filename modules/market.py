@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import hashlib
+from importlib import import_module
+from collections.abc import Mapping
+
+_PERIOD_YEAR = re.compile(r'\s*(\d{4})')
+_PERIOD_MONTH = re.compile(r'\s*\d{4}-(\d{2})')
+
+
+def period_year(period: str):
+    '''
+    Year of period labeled "YYYY", "YYYY-MM", "YYYY-MM-DD" or anything else that starts with year
+    '''
+    match = _PERIOD_YEAR.match(period)
+    if match is None:
+        raise ValueError(f'period "{period}" does not start with year')
+    return int(match.group(1))
+
+
+def _whole_year_error(year: int, periods: list[str]):
+    '''
+    Why periods of year do not make whole calendar year, empty string if they do:
+    single period labeled with year alone, or months or days of every month
+    '''
+    if len(periods) == 1 and _PERIOD_MONTH.match(periods[0]) is None:
+        return ''
+    months = set()
+    for period in periods:
+        match = _PERIOD_MONTH.match(period)
+        if match is None:
+            return f'period "{period}" of {year} is not labeled with month, can not tell whether year is whole'
+        months.add(int(match.group(1)))
+    if months != set(range(1, 13)):
+        return f'periods of {year} cover only months {sorted(months)}, not whole calendar year'
+    return ''
+
+
+class MarketReturns(Mapping):
+    '''
+    Gain of every asset in every period of market history, one period per row of dense matrix.
+    Periods are years, months, days or any mix of them in order of time.
+    As mapping it gives gains of every asset over every calendar year, periods of year compounded,
+    so everything that simulates year by year works on any periods.
+    Every year must be whole: year that has several periods is labeled by months or days and has every month,
+    so partial first or last year of monthly or daily history is not counted as full year.
+    Raises ValueError otherwise. Yearly gains are kept as matrix, memory-mapped gains of yearly periods
+    are not read until their years are.
+    '''
+
+    def __init__(self, periods: list[str], gains):
+        np = import_module('numpy')
+        self.periods = list(periods)
+        self.gains = gains
+        period_years = np.array([period_year(period) for period in self.periods], dtype=np.int64)
+        if len(period_years) > 0 and (np.diff(period_years) < 0).any():
+            raise ValueError('periods are not in order of time')
+        years, year_starts = np.unique(period_years, return_index=True)
+        year_stops = np.append(year_starts[1:], len(self.periods)).astype(np.intp)
+        # period that ends year, gains of year are measured from one year end to the next
+        self.year_ends = np.zeros(len(self.periods), dtype=bool)
+        self.year_ends[year_stops[:len(years)] - 1] = True
+        self._year_rows = {year: row for row, year in enumerate(years.tolist())}
+        self._yearly_gains = gains
+        if self.has_subyear_periods():
+            for year, year_start, year_stop in zip(years.tolist(), year_starts, year_stops):
+                year_error = _whole_year_error(year, self.periods[year_start:year_stop])
+                if year_error:
+                    raise ValueError(year_error)
+            self._yearly_gains = np.multiply.reduceat(gains, year_starts, axis=0)
+
+    def __getitem__(self, year: int):
+        return self._yearly_gains[self._year_rows[year]]
+
+    def __iter__(self):
+        return iter(self._year_rows)
+
+    def __len__(self):
+        return len(self._year_rows)
+
+    def has_subyear_periods(self):
+        return len(self.periods) > len(self._year_rows)
+
+    def subset(self, asset_indexes: list[int]):
+        '''
+        Market of given assets only
+        '''
+        return MarketReturns(self.periods, self.gains[:, asset_indexes])
+
+    def period_digests(self, assets: list[str]):
+        '''
+        Digest of gains of every asset in every period, tells apart markets with the same yearly gains
+        '''
+        np = import_module('numpy')
+        return {
+            asset: hashlib.sha1(np.ascontiguousarray(self.gains[:, asset_idx]).tobytes()).hexdigest()[:16]
+            for asset_idx, asset in enumerate(assets)
+        }
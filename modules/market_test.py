@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import math
+import random
+import pytest
+import numpy as np
+from modules import stats
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.rebalancing import RebalancingPolicy
+
+ASSETS = ['stocks', 'bonds']
+# returns in percents of every month
+MONTHLY_RETURNS = {
+    f'{year}-{month:02d}': [round(random.Random(year * 100 + month * 2 + asset_idx).uniform(-6, 7), 2)
+                            for asset_idx, _ in enumerate(ASSETS)]
+    for year in range(2000, 2006) for month in range(1, 13)
+}
+
+
+def _yearly(market):
+    return {year: year_gains.tolist() for year, year_gains in market.items()}
+
+
+def _write_returns(path, returns: dict[str, list[float]]):
+    with open(path, 'w', encoding='utf-8') as csv_file:
+        csv_file.write(','.join(['Period', *ASSETS]) + '\n')
+        for period, period_returns in returns.items():
+            csv_file.write(','.join([period, *(f'{value}%' for value in period_returns)]) + '\n')
+
+
+def test_yearly_returns(tmp_path):
+    _write_returns(tmp_path / 'returns.csv', {'1999': [142.91, -8.82], '2000': [-21.67, 87.98]})
+    assets, market = data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+    assert assets == ASSETS
+    assert _yearly(market) == {
+        1999: [float('142.91') / 100 + 1, float('-8.82') / 100 + 1],
+        2000: [float('-21.67') / 100 + 1, float('87.98') / 100 + 1],
+    }
+    assert not market.has_subyear_periods()
+
+
+def test_monthly_returns_are_compounded(tmp_path):
+    _write_returns(tmp_path / 'returns.csv', MONTHLY_RETURNS)
+    _, market = data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+    assert market.has_subyear_periods()
+    assert list(market) == list(range(2000, 2006))
+    for year, year_gains in market.items():
+        for asset_idx, gain in enumerate(year_gains):
+            assert gain == pytest.approx(math.prod(
+                returns[asset_idx] / 100 + 1 for period, returns in MONTHLY_RETURNS.items()
+                if period.startswith(str(year))))
+
+
+def test_returns_cache(tmp_path):
+    csv_path = tmp_path / 'returns.csv'
+    _write_returns(csv_path, MONTHLY_RETURNS)
+    assets, parsed = data_source.read_capitalgain_csv_data(csv_path)
+    cached_assets, cached = data_source.read_capitalgain_csv_data(csv_path, tmp_path / 'cache')
+    assert (cached_assets, _yearly(cached), cached.periods) == (assets, _yearly(parsed), parsed.periods)
+    # second read maps cached matrix, csv that was touched but not changed is not parsed again
+    os.utime(csv_path, ns=(1, 1))
+    _, cached = data_source.read_capitalgain_csv_data(csv_path, tmp_path / 'cache')
+    assert cached.gains.filename is not None
+    assert _yearly(cached) == _yearly(parsed)
+    _write_returns(csv_path, dict(list(MONTHLY_RETURNS.items())[:24]))
+    _, changed = data_source.read_capitalgain_csv_data(csv_path, tmp_path / 'cache')
+    assert list(changed) == [2000, 2001]
+    # gains of yearly periods are rows of mapped matrix, not copied out of it
+    _write_returns(csv_path, {'1999': [142.91, -8.82], '2000': [-21.67, 87.98]})
+    _, yearly = data_source.read_capitalgain_csv_data(csv_path, tmp_path / 'cache')
+    assert np.shares_memory(yearly[2000], yearly.gains)
+
+
+def test_invalid_returns(tmp_path):
+    _write_returns(tmp_path / 'returns.csv', {'2001': [1, 2], '2000': [3, 4]})
+    with pytest.raises(ValueError):
+        data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+    _write_returns(tmp_path / 'returns.csv', {'2000': [1, 2], '2001': [3]})
+    with pytest.raises(ValueError):
+        data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+
+
+@pytest.mark.parametrize('periods', [
+    # history starts and ends mid-year
+    list(MONTHLY_RETURNS)[5:-3],
+    # month is missing
+    [period for period in MONTHLY_RETURNS if period != '2003-07'],
+    # single month of year
+    ['1999-12', *MONTHLY_RETURNS],
+    # year is split into periods without months
+    ['1999 H1', '1999 H2', *MONTHLY_RETURNS],
+])
+def test_partial_years_are_rejected(tmp_path, periods):
+    _write_returns(tmp_path / 'returns.csv', {period: MONTHLY_RETURNS.get(period, [1, 2]) for period in periods})
+    with pytest.raises(ValueError, match='1999|2000|2003|2005'):
+        data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+
+
+def test_band_is_checked_every_period(tmp_path):
+    _write_returns(tmp_path / 'returns.csv', MONTHLY_RETURNS)
+    _, market = data_source.read_capitalgain_csv_data(tmp_path / 'returns.csv')
+    yearly_market = dict(market)
+    portfolio = Portfolio([60, 40], ASSETS)
+    # buy-and-hold drifts the same way month by month and year by year
+    assert portfolio.simulated(
+        data_filter.years_all_to_all, market, rebalancing=RebalancingPolicy(every=0)
+    ).stat == pytest.approx(portfolio.simulated(
+        data_filter.years_all_to_all, yearly_market, rebalancing=RebalancingPolicy(every=0)).stat)
+    years, gains = stats.annual_gains([[60, 40]], market, RebalancingPolicy(every=0, band=1))
+    monthly_band = gains.range_gains(0, len(years) - 1)
+    _, gains = stats.annual_gains([[60, 40]], yearly_market, RebalancingPolicy(every=0, band=1))
+    assert monthly_band.shape == (1, len(years))
+    assert monthly_band.tolist() != gains.range_gains(0, len(years) - 1).tolist()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import math
+import time
+import logging
+from importlib import import_module
+from itertools import islice
+from modules import data_source
+from modules import data_filter
+from modules import stats
+from modules.portfolio import Portfolio
+from modules.portfolio_batch import PortfolioBatch
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+from modules.density import DensityGrid
+
+
+# sample is taken in blocks spread over index space
+_SAMPLE_BLOCKS = 20
+
+
+def _sample_allocations(
+        assets: list[str], percentage_step: int, constraints: AllocationConstraints,
+        allocations: int, sample_size: int):
+    '''
+    Blocks of allocations evenly spread over index space, so sample is not biased to first assets
+    '''
+    sample_size = min(sample_size, allocations)
+    blocks = min(_SAMPLE_BLOCKS, sample_size)
+    sample = []
+    for block_idx in range(blocks):
+        block_allocations = data_source.all_possible_allocations(
+            len(assets), percentage_step, constraints, start=block_idx * allocations // blocks)
+        block_size = sample_size * (block_idx + 1) // blocks - sample_size * block_idx // blocks
+        sample.extend(islice(block_allocations, block_size))
+    return sample
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+def plan_run(
+        assets: list[str],
+        percentage_step: int,
+        year_selectors: list[str],
+        asset_gain_per_year: dict[int, list[float]],
+        constraints: AllocationConstraints,
+        coords_tuples: list[tuple[str, str]],
+        hull_layers: int,
+        chunk_size: int,
+        memory_budget: int = 0,
+        render: str = 'circles',
+        store: bool = False,
+        sample_size: int = 2000,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Predict size and duration of run without simulating it:
+    exact counts, bytes through pipes, memory of each plotter and runtime
+    extrapolated from simulating and filtering a sample of allocations on this machine
+    '''
+    allocations = data_source.count_possible_allocations(len(assets), percentage_step, constraints)
+    years = sorted(asset_gain_per_year.keys())
+    selector_funcs = [data_filter.year_selectors()[year_selector] for year_selector in year_selectors]
+    year_ranges = {
+        year_selector: len(list(selector_func(years)))
+        for year_selector, selector_func in zip(year_selectors, selector_funcs)
+    }
+    record_size = Portfolio.serialized_size(len(assets), stat_names)
+    portfolios_sent = allocations * len(year_selectors)
+    chunks = math.ceil(allocations / chunk_size) * len(year_selectors)
+    bytes_per_sink = portfolios_sent * record_size + chunks
+    sinks = len(coords_tuples) + (1 if store else 0)
+
+    sample = _sample_allocations(assets, percentage_step, constraints, allocations, sample_size)
+    sample_batch = PortfolioBatch.from_serialized(b'', assets, stat_names)
+    simulation_seconds = 0
+    if sample:
+        time_start = time.perf_counter()
+        selectors_records = stats.simulated_records(
+            sample, asset_gain_per_year, selector_funcs, stat_names, rebalancing)
+        simulation_seconds = (time.perf_counter() - time_start) / len(sample) * allocations
+        sample_batch = PortfolioBatch.from_records(selectors_records[0], assets)
+
+    # memory of portfolio kept by plotter: its row of stat columns and weights matrix
+    bytes_per_portfolio = sample_batch.nbytes / max(len(sample_batch), 1)
+
+    # hull of sample stands for hull of every chunk, number of hull points of
+    # random cloud grows roughly as cube root of number of points
+    hull_points = len(sample_batch)
+    filter_seconds = 0
+    if hull_layers > 0 and len(sample_batch) > 0:
+        data_filter.batch_convex_hull(sample_batch[:10], coords_tuples[0], hull_layers)  # warm up import
+        time_start = time.perf_counter()
+        hull_points = len(data_filter.batch_convex_hull(sample_batch, coords_tuples[0], hull_layers))
+        filter_seconds = (time.perf_counter() - time_start) / len(sample_batch) * portfolios_sent
+        hull_points = hull_points * (min(chunk_size, allocations) / len(sample_batch)) ** (1 / 3)
+    chunk_in_memory = min(chunk_size, allocations) * (record_size + bytes_per_portfolio)
+    if render == 'density':
+        grid = DensityGrid(assets, coords_tuples[0], stat_names=stat_names)
+        kept_portfolios = chunks * hull_points if hull_layers > 0 else 0
+        plotter_memory = grid.counts.nbytes + grid.weight_sums.nbytes + chunk_in_memory + \
+            kept_portfolios * bytes_per_portfolio
+        spill_bytes = 0
+    elif hull_layers > 0:
+        plotter_memory = chunk_in_memory + chunks * hull_points * bytes_per_portfolio
+        spill_bytes = 0
+    elif memory_budget > 0:
+        plotter_memory = chunk_in_memory + memory_budget
+        spill_bytes = portfolios_sent * (2 * 4 + len(assets))
+    else:
+        plotter_memory = chunk_in_memory + portfolios_sent * bytes_per_portfolio
+        spill_bytes = 0
+
+    cores = os.cpu_count()
+    # simulation runs on every core, plotters filter in parallel with it and with each other
+    cpu_seconds = simulation_seconds + filter_seconds * len(coords_tuples)
+    runtime_seconds = max(simulation_seconds / cores, filter_seconds, cpu_seconds / cores)
+    return {
+        'allocations': allocations,
+        'year_ranges': year_ranges,
+        'portfolios_sent': portfolios_sent,
+        'bytes_per_sink': bytes_per_sink,
+        'bytes_through_pipes': bytes_per_sink * (sinks + 1),
+        'plotter_memory': int(plotter_memory),
+        'plotters_memory': int(plotter_memory) * len(coords_tuples),
+        'spill_bytes_per_plotter': spill_bytes,
+        'store_bytes': portfolios_sent * record_size if store else 0,
+        'sample_size': len(sample),
+        'simulation_seconds': simulation_seconds,
+        'filter_seconds': filter_seconds,
+        'cores': cores,
+        'runtime_seconds': runtime_seconds,
+    }
+
+
+# resident memory of python process with numpy and matplotlib before it holds any portfolio
+PROCESS_BASE_MEMORY = 80 * 2**20
+
+
+def process_memory():
+    '''
+    Resident memory of this process in bytes, peak resident memory where current one is not known
+    '''
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        resource = import_module('resource')
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def memory_budget_settings(
+        max_memory: int,
+        assets_n: int,
+        years_n: int,
+        plotters: int,
+        consumers: int,
+        fanout_depth: int,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        cores: int = None,
+        backend: str = 'process'):
+    '''
+    Pipeline settings that keep whole run under max_memory bytes: chunk size, limit of fan-out buffers,
+    number of kept hull portfolios after which plotter filters them again, memory of every plotter
+    and its budget for spilled portfolios.
+    Half of memory left after base memory of every process goes to chunks in flight, half to kept portfolios.
+    With thread backend every stage is in one process, plotter memory is memory of that process.
+    Raises ValueError if budget does not cover base memory of processes.
+    '''
+    cores = cores or os.cpu_count()
+    # main, simulator, its pool, multiplexer, renderer and every consumer,
+    # render pool starts once simulator pool is done
+    processes = 4 + cores + consumers if backend == 'process' else 1
+    free_memory = max_memory - processes * PROCESS_BASE_MEMORY
+    if free_memory <= 0:
+        raise ValueError(f'memory budget {max_memory // 2**20}MiB is less than '
+                         f'{processes * PROCESS_BASE_MEMORY // 2**20}MiB that {processes} processes take anyway')
+    record_size = Portfolio.serialized_size(assets_n, stat_names)
+    # pool process simulates chunk with gains of every year and float64 stats, every consumer keeps
+    # received chunk and its columns, multiplexer keeps chunks buffered for the slowest consumer
+    simulated_allocation = record_size + 8 * years_n * 3 + 8 * len(stat_names) * 2
+    chunk_size = int(free_memory / 2 / (
+        cores * simulated_allocation + (fanout_depth + 1 + 2 * consumers) * record_size))
+    chunk_size = min(max(chunk_size, 2**8), 2**20)
+    # kept portfolios are concatenated and copied while they are filtered
+    kept_portfolio = 3 * record_size
+    plotter_free_memory = int(free_memory / 2 / max(plotters, 1))
+    return {
+        'chunk_size': chunk_size,
+        'fanout_memory': chunk_size * record_size * (fanout_depth + 1),
+        'hull_collapse_rows': max(plotter_free_memory // kept_portfolio, chunk_size),
+        'plotter_memory': PROCESS_BASE_MEMORY + plotter_free_memory if backend == 'process' else max_memory,
+        # budget of plotted blocks when portfolios are spilled without hull filter
+        'spill_memory': plotter_free_memory,
+    }
+
+
+def report_plan(plan: dict):
+    def size(value):
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if value < 1024:
+                return f'{value:.1f}{unit}'
+            value /= 1024
+        return f'{value:.1f}TiB'
+
+    logging.info('allocations to simulate: %d', plan['allocations'])
+    for year_selector, year_ranges in plan['year_ranges'].items():
+        logging.info('year ranges of %s: %d', year_selector, year_ranges)
+    logging.info('portfolios sent: %d, %s to every plotter, %s through all pipes',
+                 plan['portfolios_sent'], size(plan['bytes_per_sink']), size(plan['bytes_through_pipes']))
+    logging.info('memory of every plotter: %s, of all plotters: %s',
+                 size(plan['plotter_memory']), size(plan['plotters_memory']))
+    if plan['spill_bytes_per_plotter'] > 0:
+        logging.info('temporary files of every plotter: %s', size(plan['spill_bytes_per_plotter']))
+    if plan['store_bytes'] > 0:
+        logging.info('stored results: %s', size(plan['store_bytes']))
+    logging.info('calibrated on %d allocations: simulation %.1f cpu-s, hull filter %.1f cpu-s per plotter',
+                 plan['sample_size'], plan['simulation_seconds'], plan['filter_seconds'])
+    logging.info('projected runtime on %d cores: %.1fs, plotting not included',
+                 plan['cores'], plan['runtime_seconds'])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from modules import planner
+from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
+
+ASSETS = ['A', 'B', 'C', 'D']
+MARKET = {year: [1.01 + 0.01 * (year % 3), 0.97 + 0.02 * (year % 5), 1.05, 0.9 + 0.03 * (year % 7)]
+          for year in range(2000, 2012)}
+COORDS_TUPLES = [
+    (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV),
+    (Portfolio.STAT_SHARPE, Portfolio.STAT_VARIANCE),
+]
+
+
+@pytest.mark.parametrize('hull_layers, memory_budget, render', [
+    (1, 0, 'circles'),
+    (0, 0, 'circles'),
+    (0, 2**20, 'circles'),
+    (2, 0, 'density'),
+])
+def test_plan_run(hull_layers, memory_budget, render):
+    plan = planner.plan_run(
+        assets=ASSETS,
+        percentage_step=5,
+        year_selectors=['first-to-last', 'window-3', 'all-to-all'],
+        asset_gain_per_year=MARKET,
+        constraints=AllocationConstraints(len(ASSETS)),
+        coords_tuples=COORDS_TUPLES,
+        hull_layers=hull_layers,
+        chunk_size=500,
+        memory_budget=memory_budget,
+        render=render,
+        store=True,
+        sample_size=100)
+    assert plan['allocations'] == 1771
+    assert plan['year_ranges'] == {'first-to-last': 1, 'window-3': 9, 'all-to-all': 66}
+    assert plan['portfolios_sent'] == 1771 * 3
+    record_size = Portfolio.serialized_size(len(ASSETS))
+    # every chunk has one byte of selector tag
+    assert plan['bytes_per_sink'] == 1771 * 3 * record_size + 4 * 3
+    assert plan['bytes_through_pipes'] == plan['bytes_per_sink'] * (len(COORDS_TUPLES) + 2)
+    assert plan['store_bytes'] == 1771 * 3 * record_size
+    assert plan['sample_size'] == 100
+    assert plan['plotter_memory'] > 0
+    assert (plan['spill_bytes_per_plotter'] > 0) == (memory_budget > 0)
+    assert plan['simulation_seconds'] > 0
+    assert plan['runtime_seconds'] >= plan['simulation_seconds'] / plan['cores']
+
+
+def test_memory_budget_settings():
+    settings = planner.memory_budget_settings(
+        max_memory=2**32, assets_n=len(ASSETS), years_n=len(MARKET), plotters=8, consumers=9, fanout_depth=16,
+        cores=4)
+    record_size = Portfolio.serialized_size(len(ASSETS))
+    assert 2**8 <= settings['chunk_size'] <= 2**20
+    assert settings['fanout_memory'] == settings['chunk_size'] * record_size * 17
+    assert settings['hull_collapse_rows'] >= settings['chunk_size']
+    assert 8 * settings['plotter_memory'] + 8 * planner.PROCESS_BASE_MEMORY < 2**32
+    smaller = planner.memory_budget_settings(
+        max_memory=2**31, assets_n=len(ASSETS), years_n=len(MARKET), plotters=8, consumers=9, fanout_depth=16,
+        cores=4)
+    assert smaller['chunk_size'] < settings['chunk_size']
+    with pytest.raises(ValueError):
+        planner.memory_budget_settings(
+            max_memory=2**30, assets_n=len(ASSETS), years_n=len(MARKET), plotters=8, consumers=9, fanout_depth=16,
+            cores=4)
+
+
+def test_process_memory():
+    assert planner.process_memory() > 0
+
+
+def test_memory_budget_settings_thread_backend():
+    settings = planner.memory_budget_settings(
+        max_memory=2**30, assets_n=len(ASSETS), years_n=len(MARKET), plotters=8, consumers=9, fanout_depth=16,
+        cores=4, backend='thread')
+    assert settings['plotter_memory'] == 2**30
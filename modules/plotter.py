@@ -16,54 +16,233 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import pickle
+import logging
 import multiprocessing.connection
 import functools
 from modules import data_filter
 from modules import data_source
-from modules.data_filter import multilayer_convex_hull
-from modules.data_output import draw_circles_with_tooltips
+from modules import planner
+from modules import data_output
 from modules.portfolio import Portfolio
+from modules.portfolio_batch import PortfolioBatch
+from modules.spill import PortfolioSpill
+from modules.density import DensityGrid
+from modules.checkpoint import RunCheckpoints
+
+
+# pylint: disable=too-many-instance-attributes
+class _SelectorPlot:
+    '''
+    Portfolios of one year range selector collected by plotter
+    '''
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    def __init__(
+            self, assets, coord_pair, hull_layers, memory_budget, render, spill_directory=None,
+            stat_names=Portfolio.SERIALIZED_STATS):
+        self.assets = assets
+        self.coord_pair = coord_pair
+        self.hull_layers = hull_layers
+        self.stat_names = stat_names
+        # density is plotted instead of portfolios that are not on hull
+        self.density = DensityGrid(assets, coord_pair, stat_names=stat_names) if render == 'density' else None
+        # without hull filter every portfolio is plotted, keep them on disk if memory is limited
+        self.spill = PortfolioSpill(assets, coord_pair, spill_directory, stat_names=stat_names) \
+            if self.density is None and hull_layers == 0 and memory_budget > 0 else None
+        self.batches_hulls = []
+        self.kept_portfolios = 0
+
+    def hulls(self):
+        '''
+        Hull portfolios of every chunk so far as one batch
+        '''
+        return PortfolioBatch.concatenate(self.batches_hulls, self.assets, self.stat_names)
+
+    def append(self, batch: PortfolioBatch, collapse_portfolios: int = 0):
+        '''
+        Keep hull of batch, hull of everything kept is taken again once more than collapse_portfolios are kept
+        '''
+        self.batches_hulls.append(data_filter.batch_convex_hull(batch, self.coord_pair, self.hull_layers))
+        self.kept_portfolios += len(self.batches_hulls[-1])
+        if 0 < collapse_portfolios < self.kept_portfolios:
+            self.collapse()
+
+    def collapse(self):
+        '''
+        Portfolios on hull layers of everything kept stay on hull layers of everything received later
+        '''
+        if self.hull_layers > 0 and len(self.batches_hulls) > 1:
+            self.batches_hulls = [data_filter.batch_convex_hull(self.hulls(), self.coord_pair, self.hull_layers)]
+            self.kept_portfolios = len(self.batches_hulls[0])
+
+    def checkpoint(self):
+        return {
+            'hulls_points': self.hulls().serialize(self.stat_names),
+            'density': self.density,
+            'spill': self.spill.checkpoint() if self.spill is not None else None,
+        }
+
+    def restore(self, checkpoint: dict = None):
+        '''
+        Continue from checkpoint state, or start from scratch without checkpoint
+        '''
+        if self.spill is not None:
+            self.spill.restore(checkpoint['spill'] if checkpoint else None)
+        if checkpoint is None:
+            return
+        self.density = checkpoint['density']
+        self.batches_hulls = [
+            PortfolioBatch.from_serialized(checkpoint['hulls_points'], self.assets, self.stat_names)]
+        self.kept_portfolios = len(self.batches_hulls[0])
+
+
+# resident memory of plotter is checked every this many chunks
+_MEMORY_CHECK_CHUNKS = 16
+_MIN_COLLAPSE_PORTFOLIOS = 2**12
+
+
+def plotter_checkpoint_name(coord_pair: tuple[str, str]):
+    return f'plotter {coord_pair[0]} - {coord_pair[1]}'
 
 
 # pylint: disable=too-many-arguments
 # pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
 def plotter_process_func(
         assets: list[str],
         source: multiprocessing.connection.Connection = None,
         coord_pair: tuple[str, str] = None,
         hull_layers: int = None,
-        edge_layers: int = None,
-        persistent_portfolios: list[Portfolio] = None,
-        color_map: dict[str, tuple[int, int, int]] = None):
-    batches_hulls_points = []
+        persistent_portfolios: list[list[Portfolio]] = None,
+        edge_portfolios: list[PortfolioBatch] = None,
+        color_map: dict[str, tuple[int, int, int]] = None,
+        memory_budget: int = 0,
+        render: str = 'circles',
+        output: str = 'svg',
+        year_selectors: list[str] = None,
+        checkpoints: RunCheckpoints = None,
+        resume_from: int = None,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        max_memory: int = 0,
+        hull_collapse_portfolios: int = 0,
+        hull_points: int = 0,
+        hull_lod: str = 'rdp',
+        render_sink: multiprocessing.connection.Connection = None):
+    '''
+    Chunks from source are tagged with index of year range selector and hold given stats,
+    persistent_portfolios has list of static portfolios for every selector,
+    edge_portfolios has batch of edge portfolios for every selector.
+    With several selectors plots of each one go to its own subdirectory of result.
+    With checkpoints state is saved on every checkpoint marker, run can be resumed from it.
+    Kept hull portfolios are filtered again once there are more than hull_collapse_portfolios of them,
+    and more often while resident memory of plotter is over max_memory.
+    With hull_points every hull layer is reduced to so many portfolios by hull_lod method before drawing,
+    static and edge portfolios are always drawn.
+    Plots are laid out here and sent to render_sink for renderer stage, without it they are rendered here.
+    '''
+    year_selectors = year_selectors or ['']
+    checkpoint_name = plotter_checkpoint_name(coord_pair)
+    selector_plots = [
+        _SelectorPlot(
+            assets, coord_pair, hull_layers, memory_budget, render,
+            spill_directory=os.path.join(checkpoints.spill_directory, checkpoint_name, str(selector_idx))
+            if checkpoints else None,
+            stat_names=stat_names)
+        for selector_idx in range(len(year_selectors))
+    ]
+    if checkpoints is not None:
+        resumed_state = checkpoints.load(checkpoint_name, resume_from) if resume_from is not None else None
+        for selector_idx, selector_plot in enumerate(selector_plots):
+            selector_plot.restore(resumed_state[selector_idx] if resumed_state else None)
     data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    chunks_received = 0
     while True:
         bytes_from_pipe = source.recv_bytes()
         if bytes_from_pipe == data_stream_end_pickle:
             break
-        deserialized_portfolios = Portfolio.deserialize_iter(bytes_from_pipe, assets=assets)
-        batch_xy_points = map(
-            functools.partial(data_filter.PortfolioXYTuplePoint, coord_pair=coord_pair), deserialized_portfolios)
-        batches_hulls_points.extend(
-            data_filter.multilayer_convex_hull(batch_xy_points, hull_layers, edge_layers))
-    convex_hull_points = multilayer_convex_hull(batches_hulls_points, hull_layers, edge_layers)
-
-    portfolios_for_plot = list(map(data_filter.PortfolioXYTuplePoint.portfolio, convex_hull_points))
-    portfolios_for_plot.extend(persistent_portfolios)
-    portfolios_for_plot.sort(key=lambda x: -x.number_of_assets())
-    # plot_data = data_filter.compose_plot_data(portfolios_for_plot, field_x=coord_pair[1], field_y=coord_pair[0])
-    plot_circles = list(map(
-        functools.partial(
-            Portfolio.plot_circle_data,
-            coord_pair=coord_pair, color_map=color_map),
-        portfolios_for_plot))
-    draw_circles_with_tooltips(
-        circles=plot_circles,
-        xlabel=coord_pair[1],
-        ylabel=coord_pair[0],
-        title=f'{coord_pair[0]} vs {coord_pair[1]}',
-        directory='result',
-        filename=f'{coord_pair[0]} - {coord_pair[1]}',
-        asset_color_map=color_map,
-    )
+        selector_idx, data = data_source.untagged_chunk(bytes_from_pipe)
+        if selector_idx == data_source.CHECKPOINT_TAG:
+            if checkpoints is not None:
+                checkpoints.save(
+                    checkpoint_name, data_source.checkpoint_allocations_done(data),
+                    [selector_plot.checkpoint() for selector_plot in selector_plots])
+            continue
+        selector_plot = selector_plots[selector_idx]
+        if selector_plot.density is not None:
+            selector_plot.density.append(data)
+            if hull_layers == 0:
+                continue
+        if selector_plot.spill is not None:
+            selector_plot.spill.append(data)
+            continue
+        # limit is shared by plots of every selector
+        selector_plot.append(
+            PortfolioBatch.from_serialized(data, assets, stat_names), hull_collapse_portfolios // len(selector_plots))
+        chunks_received += 1
+        if chunks_received % _MEMORY_CHECK_CHUNKS == 0 and 0 < max_memory < planner.process_memory():
+            for over_budget_plot in selector_plots:
+                over_budget_plot.collapse()
+            kept_portfolios = sum(over_budget_plot.kept_portfolios for over_budget_plot in selector_plots)
+            collapse_portfolios = max(kept_portfolios * 2, _MIN_COLLAPSE_PORTFOLIOS * len(selector_plots))
+            if hull_collapse_portfolios == 0 or collapse_portfolios < hull_collapse_portfolios:
+                hull_collapse_portfolios = collapse_portfolios
+                logging.info('%s: memory over budget, hull portfolios are filtered again every %d portfolios',
+                             checkpoint_name, hull_collapse_portfolios)
+
+    plot_template = data_output.PlotTemplate(color_map)
+    for year_selector, selector_plot, selector_persistent_portfolios, selector_edge_portfolios in zip(
+            year_selectors, selector_plots, persistent_portfolios,
+            edge_portfolios or [PortfolioBatch.concatenate([], assets, stat_names)] * len(year_selectors)):
+        spill, density = selector_plot.spill, selector_plot.density
+        # edge portfolios on hull are drawn once, as edge portfolios
+        hull_portfolios = data_filter.batch_convex_hull(
+            selector_plot.hulls(), coord_pair, hull_layers, hull_points, hull_lod).without(selector_edge_portfolios)
+
+        # portfolios with more assets are plotted first, so that simpler ones stay on top
+        circles_groups = [
+            (hull_portfolios.plot_circles_data(coord_pair, color_map, stat_names),
+             hull_portfolios.number_of_assets().tolist()),
+            ([portfolio.plot_circle_data(coord_pair, color_map, stat_names)
+              for portfolio in selector_persistent_portfolios],
+             [portfolio.number_of_assets() for portfolio in selector_persistent_portfolios]),
+            (selector_edge_portfolios.plot_circles_data(coord_pair, color_map, stat_names),
+             selector_edge_portfolios.number_of_assets().tolist()),
+        ]
+        circles = [circle for group_circles, _ in circles_groups for circle in group_circles]
+        circles_number_of_assets = [number for _, group_numbers in circles_groups for number in group_numbers]
+        plot_circles = [
+            circles[circle_idx]
+            for circle_idx in sorted(range(len(circles)), key=circles_number_of_assets.__getitem__, reverse=True)
+        ]
+        cloud_bounds = None
+        for cloud in (spill, density):
+            if cloud is not None and cloud.size > 0:
+                cloud_bounds = cloud.bounds
+        plot = plot_template.layout(
+            circles=plot_circles,
+            xlabel=coord_pair[1],
+            ylabel=coord_pair[0],
+            title=f'{coord_pair[0]} vs {coord_pair[1]}' +
+            (f' ({year_selector})' if len(year_selectors) > 1 else ''),
+            directory=os.path.join('result', year_selector) if len(year_selectors) > 1 else 'result',
+            filename=f'{coord_pair[0]} - {coord_pair[1]}',
+            cloud_blocks=functools.partial(spill.plot_blocks, color_map, memory_budget) if spill else None,
+            cloud_bounds=cloud_bounds,
+            cloud_density=(density.image(color_map), density.extent()) if density and density.size > 0 else None,
+            tooltip_assets=assets,
+            tooltip_stats=list(stat_names),
+        )
+        if render_sink is not None:
+            render_sink.send(plot)
+        else:
+            for plot_format in data_output.plot_formats(output):
+                data_output.PLOT_RENDERERS[plot_format](plot_template, plot)
+        if spill is not None:
+            spill.close()
+    if render_sink is not None:
+        render_sink.send(data_source.DataStreamFinished())
@@ -17,18 +17,22 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import struct
-from functools import partial
-from math import prod as math_prod
-from math import sumprod as math_sumprod
+from importlib import import_module
+from modules import stats
+from modules.rebalancing import RebalancingPolicy
 
 
 # pylint: disable=too-many-instance-attributes
 class Portfolio:
-    STAT_GAIN = 'Gain(x)'
-    STAT_CAGR_PERCENT = 'CAGR(%)'
-    STAT_VARIANCE = 'Variance'
-    STAT_STDDEV = 'Stddev'
-    STAT_SHARPE = 'Sharpe'
+    STAT_GAIN = stats.STAT_GAIN
+    STAT_CAGR_PERCENT = stats.STAT_CAGR_PERCENT
+    STAT_VARIANCE = stats.STAT_VARIANCE
+    STAT_STDDEV = stats.STAT_STDDEV
+    STAT_SHARPE = stats.STAT_SHARPE
+    # stats that are simulated and sent when run does not choose its own, see modules.stats
+    SERIALIZED_STATS = (STAT_GAIN, STAT_CAGR_PERCENT, STAT_VARIANCE, STAT_STDDEV, STAT_SHARPE)
+    # bulk of portfolios is kept in PortfolioBatch, single portfolios still should not carry instance dict
+    __slots__ = ('plot_marker', 'plot_always', 'assets', 'weights', 'stat', '_number_of_assets')
 
     @staticmethod
     def static_portfolio(allocation: dict[str, int]):
@@ -54,36 +58,36 @@ class Portfolio:
         return self
 
     @staticmethod
-    def deserialize_iter(serialized_data, assets: list[str]):
-        for portfolio_unpack in struct.iter_unpack(f'5f{len(assets)}i', serialized_data):
-            portfolio = Portfolio(assets=assets, weights=[])
-            portfolio.stat[Portfolio.STAT_GAIN], \
-                portfolio.stat[Portfolio.STAT_CAGR_PERCENT], \
-                portfolio.stat[Portfolio.STAT_VARIANCE], \
-                portfolio.stat[Portfolio.STAT_STDDEV], \
-                portfolio.stat[Portfolio.STAT_SHARPE], \
-                *portfolio.weights = portfolio_unpack
+    def serialized_size(assets_n: int, stat_names: tuple[str, ...] = SERIALIZED_STATS):
+        return struct.calcsize(stats.record_struct_format(stat_names, assets_n))
+
+    @staticmethod
+    def serialized_dtype(assets_n: int, stat_names: tuple[str, ...] = SERIALIZED_STATS):
+        '''
+        Numpy structured type of serialized portfolio, fields are named by stats
+        '''
+        return stats.record_dtype(stat_names, assets_n)
+
+    @staticmethod
+    def deserialize_iter(serialized_data, assets: list[str], stat_names: tuple[str, ...] = SERIALIZED_STATS):
+        stats_n = len(stat_names)
+        for portfolio_unpack in struct.iter_unpack(stats.record_struct_format(stat_names, len(assets)),
+                                                   serialized_data):
+            portfolio = Portfolio(assets=assets, weights=list(portfolio_unpack[stats_n:]))
+            portfolio.stat = dict(zip(stat_names, portfolio_unpack[:stats_n]))
             yield portfolio
 
     @staticmethod
-    def deserialize(serialized_data, assets: list[str]):
-        portfolio = Portfolio(assets=assets, weights=[])
-        portfolio.stat[Portfolio.STAT_GAIN], \
-            portfolio.stat[Portfolio.STAT_CAGR_PERCENT], \
-            portfolio.stat[Portfolio.STAT_VARIANCE], \
-            portfolio.stat[Portfolio.STAT_STDDEV], \
-            portfolio.stat[Portfolio.STAT_SHARPE], \
-            *portfolio.weights = struct.unpack(f'5f{len(assets)}i', serialized_data)
+    def deserialize(serialized_data, assets: list[str], stat_names: tuple[str, ...] = SERIALIZED_STATS):
+        portfolio_unpack = struct.unpack(stats.record_struct_format(stat_names, len(assets)), serialized_data)
+        portfolio = Portfolio(assets=assets, weights=list(portfolio_unpack[len(stat_names):]))
+        portfolio.stat = dict(zip(stat_names, portfolio_unpack[:len(stat_names)]))
         return portfolio
 
-    def serialize(self):
+    def serialize(self, stat_names: tuple[str, ...] = SERIALIZED_STATS):
         return struct.pack(
-            f'5f{len(self.assets)}i',
-            self.stat[Portfolio.STAT_GAIN],
-            self.stat[Portfolio.STAT_CAGR_PERCENT],
-            self.stat[Portfolio.STAT_VARIANCE],
-            self.stat[Portfolio.STAT_STDDEV],
-            self.stat[Portfolio.STAT_SHARPE],
+            stats.record_struct_format(stat_names, len(self.assets)),
+            *(self.stat[stat_name] for stat_name in stat_names),
             *self.weights,
         )
 
@@ -105,44 +109,72 @@ class Portfolio:
                 f'add them to asset_colors.py: {set(self.assets) - set(color_map.keys())}'
         return ''
 
+    def annual_gains(self, asset_gain_per_year, rebalancing: RebalancingPolicy = None):
+        '''
+        Years and portfolio gain for every year, shared by all year range selectors
+        '''
+        return stats.annual_gains([self.weights], asset_gain_per_year, rebalancing)
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    def simulate(
+            self, year_range_selector_func, asset_gain_per_year, annual_gains=None,
+            stat_names: tuple[str, ...] = SERIALIZED_STATS, rebalancing: RebalancingPolicy = None):
+        if annual_gains is None:
+            annual_gains = self.annual_gains(asset_gain_per_year, rebalancing)
+        values = stats.simulated_stats(*annual_gains, year_range_selector_func, stat_names)
+        for stat_name in stat_names:
+            self.stat[stat_name] = float(values[stat_name][0])
+
+    def simulated(
+            self, year_range_selector_func, asset_gain_per_year, stat_names: tuple[str, ...] = SERIALIZED_STATS,
+            rebalancing: RebalancingPolicy = None):
+        self.simulate(
+            year_range_selector_func=year_range_selector_func, asset_gain_per_year=asset_gain_per_year,
+            stat_names=stat_names, rebalancing=rebalancing)
+        return self
+
+    def simulated_for_selectors(
+            self, year_range_selector_funcs, asset_gain_per_year, stat_names: tuple[str, ...] = SERIALIZED_STATS,
+            rebalancing: RebalancingPolicy = None):
+        '''
+        Copy of portfolio simulated with every selector, annual gains are computed once
+        '''
+        annual_gains = self.annual_gains(asset_gain_per_year, rebalancing)
+        portfolios = []
+        for year_range_selector_func in year_range_selector_funcs:
+            portfolio = Portfolio(
+                weights=self.weights, assets=self.assets, plot_always=self.plot_always, plot_marker=self.plot_marker)
+            portfolio.simulate(year_range_selector_func, asset_gain_per_year, annual_gains=annual_gains,
+                               stat_names=stat_names)
+            portfolios.append(portfolio)
+        return portfolios
+
     # pylint: disable=too-many-locals
     @staticmethod
-    def _simulate_y2y(year_range, allocation, asset_gain_per_year):
-        year_start, year_end = year_range
-        annual_gains = [
-            math_sumprod(asset_gain_per_year[year], allocation) / 100 for year in range(year_start, year_end + 1)
-        ]
-        stat_gain = math_prod(annual_gains)
-        stat_cagr = stat_gain ** (1 / len(annual_gains)) - 1
-        stat_var = sum(map(lambda ag: (ag - stat_cagr - 1) ** 2, annual_gains)) / (len(annual_gains) - 1)
-        return stat_gain, stat_cagr, stat_var
-
-    def simulate(self, year_range_selector_func, asset_gain_per_year):
-        stats_per_year_range = list(map(
-            partial(Portfolio._simulate_y2y,
-                allocation=self.weights,
-                asset_gain_per_year=asset_gain_per_year),
-            year_range_selector_func(sorted(asset_gain_per_year.keys()))
-        ))
-        stat_gain, stat_cagr, stat_var = \
-            (sum(stat_values) / len(stats_per_year_range) for stat_values in zip(*stats_per_year_range))
-        self.stat[Portfolio.STAT_GAIN] = stat_gain
-        self.stat[Portfolio.STAT_VARIANCE] = stat_var
-        self.stat[Portfolio.STAT_STDDEV] = stat_var ** 0.5
-        self.stat[Portfolio.STAT_SHARPE] = stat_cagr / self.stat[Portfolio.STAT_STDDEV]
-        self.stat[Portfolio.STAT_CAGR_PERCENT] = stat_cagr * 100
-
-    def simulated(self, year_range_selector_func, asset_gain_per_year):
-        self.simulate(year_range_selector_func=year_range_selector_func, asset_gain_per_year=asset_gain_per_year)
-        return self
+    def simulated_batch(
+            allocations: list[list[int]], assets: list[str],
+            year_range_selector_funcs, asset_gain_per_year, stat_names: tuple[str, ...] = SERIALIZED_STATS,
+            rebalancing: RebalancingPolicy = None):
+        '''
+        Portfolios of allocations simulated at once with every selector, list of portfolios per selector.
+        Same stats as simulated_for_selectors gives, without rounding them to wire format.
+        '''
+        years, gains = stats.annual_gains(allocations, asset_gain_per_year, rebalancing)
+        selectors_portfolios = []
+        for year_range_selector_func in year_range_selector_funcs:
+            values = stats.simulated_stats(years, gains, year_range_selector_func, stat_names)
+            columns = [values[stat_name].tolist() for stat_name in stat_names]
+            portfolios = []
+            for allocation, *stat_values in zip(allocations, *columns):
+                portfolio = Portfolio(weights=list(allocation), assets=assets)
+                portfolio.stat = dict(zip(stat_names, stat_values))
+                portfolios.append(portfolio)
+            selectors_portfolios.append(portfolios)
+        return selectors_portfolios
 
     def __repr__(self):
-        weights_without_zeros = []
-        for ticker, weight in self.weights.items():
-            if weight == 0:
-                continue
-            weights_without_zeros.append(f'{ticker}: {weight}%')
-        str_weights = ' - '.join(weights_without_zeros)
+        str_weights = ' - '.join(self.__weights_without_zeros())
         return f'{self.stat} :: {str_weights}'
 
     def __weights_without_zeros(self):
@@ -170,7 +202,20 @@ class Portfolio:
                 raise RuntimeError(f'color map does not contain asset "{ticker}", add it to asset_colors.py')
         return (color[0] / max(color), color[1] / max(color), color[2] / max(color))
 
-    def plot_circle_data(self, coord_pair: tuple[str, str], color_map: dict[str, tuple[int, int, int]]):
+    @staticmethod
+    def plot_circle_colors(weights, assets: list[str], color_map: dict[str, tuple[int, int, int]]):
+        '''
+        Same as plot_circle_color for matrix of weights, one portfolio per row
+        '''
+        np = import_module('numpy')
+        asset_colors = np.array([color_map[asset] for asset in assets], dtype=np.float64)
+        colors = weights @ asset_colors / 100
+        colors /= np.maximum(colors.max(axis=1, keepdims=True), 1)
+        return colors
+
+    def plot_circle_data(
+            self, coord_pair: tuple[str, str], color_map: dict[str, tuple[int, int, int]],
+            stat_names: tuple[str, ...] = SERIALIZED_STATS):
         return {
             'x': self.stat[coord_pair[1]],
             'y': self.stat[coord_pair[0]],
@@ -179,6 +224,8 @@ class Portfolio:
                 '—' * max(len(x) for x in self.plot_circle_tooltip_assets().split('\n')),
                 self.plot_circle_tooltip_stats(),
             ]),
+            'weights': self.weights,
+            'stats': [self.stat[stat_name] for stat_name in stat_names],
             'marker': self.plot_marker,
             'color': self.plot_circle_color(color_map),
             'size': 100 if self.plot_always else 50 / self.number_of_assets(),
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from importlib import import_module
+from collections.abc import Callable
+from modules import stats
+from modules.portfolio import Portfolio
+from modules.rebalancing import RebalancingPolicy
+
+
+class PortfolioBatch:
+    '''
+    Portfolios as columns: array of every stat and matrix of weights, one portfolio per row.
+    Indexing with slice, mask or array of indexes gives batch of selected portfolios.
+    '''
+
+    def __init__(self, assets: list[str], stat_columns: dict, weights):
+        self.assets = assets
+        self.stat_columns = stat_columns
+        self.weights = weights
+
+    @staticmethod
+    def from_records(records, assets: list[str]):
+        '''
+        Batch of numpy records of Portfolio.serialized_dtype, columns are copied out of records
+        '''
+        np = import_module('numpy')
+        return PortfolioBatch(
+            assets,
+            {stat_name: np.ascontiguousarray(records[stat_name]) for stat_name in records.dtype.names[:-1]},
+            np.ascontiguousarray(records['weights']))
+
+    @staticmethod
+    def from_serialized(serialized_data, assets: list[str], stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        np = import_module('numpy')
+        return PortfolioBatch.from_records(
+            np.frombuffer(serialized_data, dtype=Portfolio.serialized_dtype(len(assets), stat_names)), assets)
+
+    @staticmethod
+    def from_portfolios(
+            portfolios: list[Portfolio], assets: list[str], stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        np = import_module('numpy')
+        return PortfolioBatch(
+            assets,
+            {
+                stat_name: np.array([portfolio.stat[stat_name] for portfolio in portfolios], dtype=np.float64)
+                for stat_name in stat_names
+            },
+            np.array([portfolio.weights for portfolio in portfolios], dtype=np.int32).reshape(-1, len(assets)))
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    @staticmethod
+    def simulated(
+            allocations: list[list[int]], assets: list[str],
+            year_range_selector_funcs: list[Callable], asset_gain_per_year: dict[int, list[float]],
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS, rebalancing: RebalancingPolicy = None):
+        '''
+        Batch of allocations for every selector, stats are not rounded to wire format
+        '''
+        np = import_module('numpy')
+        weights = np.asarray(allocations, dtype=np.int32).reshape(-1, len(assets))
+        years, gains = stats.annual_gains(weights, asset_gain_per_year, rebalancing)
+        selectors_batches = []
+        for year_range_selector_func in year_range_selector_funcs:
+            values = stats.simulated_stats(years, gains, year_range_selector_func, stat_names)
+            selectors_batches.append(
+                PortfolioBatch(assets, {stat_name: values[stat_name] for stat_name in stat_names}, weights))
+        return selectors_batches
+
+    @staticmethod
+    def concatenate(
+            batches: list['PortfolioBatch'], assets: list[str],
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        np = import_module('numpy')
+        if not batches:
+            return PortfolioBatch.from_serialized(b'', assets, stat_names)
+        return PortfolioBatch(
+            assets,
+            {
+                stat_name: np.concatenate([batch.stat_columns[stat_name] for batch in batches])
+                for stat_name in stat_names
+            },
+            np.concatenate([batch.weights for batch in batches]))
+
+    @property
+    def stat_names(self):
+        return tuple(self.stat_columns)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.stat_columns.values()) + self.weights.nbytes
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __getitem__(self, selection):
+        return PortfolioBatch(
+            self.assets,
+            {stat_name: column[selection] for stat_name, column in self.stat_columns.items()},
+            self.weights[selection])
+
+    def without(self, other: 'PortfolioBatch'):
+        '''
+        Portfolios of batch whose weights are not weights of any portfolio of other batch
+        '''
+        np = import_module('numpy')
+        if len(self) == 0 or len(other) == 0:
+            return self
+
+        def rows(weights):
+            weights = np.ascontiguousarray(weights, dtype=np.int32)
+            return weights.view(np.dtype((np.void, weights.dtype.itemsize * weights.shape[1]))).ravel()
+
+        return self[~np.isin(rows(self.weights), rows(other.weights))]
+
+    def points(self, coord_pair: tuple[str, str]):
+        '''
+        Array of (Y, X) of every portfolio, same order of coordinates as coord_pair
+        '''
+        np = import_module('numpy')
+        return np.column_stack((
+            self.stat_columns[coord_pair[0]].astype(np.float64),
+            self.stat_columns[coord_pair[1]].astype(np.float64)))
+
+    def number_of_assets(self):
+        '''
+        Number of asset weights that are not zero for every portfolio
+        '''
+        np = import_module('numpy')
+        return np.count_nonzero(self.weights, axis=1)
+
+    def serialize(self, stat_names: tuple[str, ...] = None):
+        np = import_module('numpy')
+        stat_names = stat_names or self.stat_names
+        records = np.empty(len(self), dtype=Portfolio.serialized_dtype(len(self.assets), stat_names))
+        for stat_name in stat_names:
+            records[stat_name] = self.stat_columns[stat_name]
+        records['weights'] = self.weights
+        return records.tobytes()
+
+    def portfolios(self):
+        columns = [column.tolist() for column in self.stat_columns.values()]
+        portfolios = []
+        for weights, *stat_values in zip(self.weights.tolist(), *columns):
+            portfolio = Portfolio(weights=weights, assets=self.assets)
+            portfolio.stat = dict(zip(self.stat_names, stat_values))
+            portfolios.append(portfolio)
+        return portfolios
+
+    def plot_circles_data(
+            self, coord_pair: tuple[str, str], color_map: dict[str, tuple[int, int, int]],
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        '''
+        Same circles as Portfolio.plot_circle_data gives for every portfolio of batch,
+        color, size and linewidth are computed for whole batch at once
+        '''
+        number_of_assets = self.number_of_assets().tolist()
+        colors = Portfolio.plot_circle_colors(self.weights, self.assets, color_map).tolist()
+        columns = {stat_name: column.tolist() for stat_name, column in self.stat_columns.items()}
+        tooltip_stats = [
+            '\n'.join(f'{stat_name:8s}: {value:.3f}' for stat_name, value in zip(self.stat_names, values))
+            for values in zip(*columns.values())
+        ]
+        circles = []
+        for row, weights in enumerate(self.weights.tolist()):
+            tooltip_assets = [f'{ticker}: {weight}%' for ticker, weight in zip(self.assets, weights) if weight != 0]
+            circles.append({
+                'x': columns[coord_pair[1]][row],
+                'y': columns[coord_pair[0]][row],
+                'text': '\n'.join([
+                    '\n'.join(tooltip_assets),
+                    '—' * max(len(x) for x in tooltip_assets),
+                    tooltip_stats[row],
+                ]),
+                'weights': weights,
+                'stats': [columns[stat_name][row] for stat_name in stat_names],
+                'marker': 'o',
+                'color': tuple(colors[row]),
+                'size': 50 / number_of_assets[row],
+                'linewidth': 1 / number_of_assets[row],
+            })
+        return circles
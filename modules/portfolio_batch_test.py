@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+import numpy as np
+from modules import stats
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.portfolio_batch import PortfolioBatch
+
+ASSETS = ['stocks', 'bonds', 'gold', 'cash']
+MARKET = {year: [random.Random(year).uniform(0.7, 1.4) for _ in ASSETS] for year in range(2000, 2012)}
+COLOR_MAP = {'stocks': (255, 0, 0), 'bonds': (0, 255, 0), 'gold': (255, 215, 0), 'cash': (0, 0, 255)}
+
+
+def _serialized(stat_names=Portfolio.SERIALIZED_STATS):
+    allocations = list(data_source.all_possible_allocations(len(ASSETS), 10))
+    records = stats.simulated_records(allocations, MARKET, [data_filter.years_all_to_all], stat_names)[0]
+    return records.tobytes()
+
+
+@pytest.mark.parametrize('stat_names', [Portfolio.SERIALIZED_STATS, ('CAGR(%)', 'Max drawdown(%)')])
+def test_batch_matches_portfolios(stat_names):
+    serialized = _serialized(stat_names)
+    batch = PortfolioBatch.from_serialized(serialized, ASSETS, stat_names)
+    portfolios = list(Portfolio.deserialize_iter(serialized, ASSETS, stat_names))
+    assert len(batch) == len(portfolios)
+    assert batch.serialize() == serialized
+    assert batch.number_of_assets().tolist() == [portfolio.number_of_assets() for portfolio in portfolios]
+    assert [(p.weights, p.stat) for p in batch.portfolios()] == [(p.weights, p.stat) for p in portfolios]
+    coord_pair = stats.coords_tuples(stat_names)[0]
+    assert batch.plot_circles_data(coord_pair, COLOR_MAP, stat_names) == [
+        portfolio.plot_circle_data(coord_pair, COLOR_MAP, stat_names) for portfolio in portfolios]
+
+
+def test_batch_selection():
+    batch = PortfolioBatch.from_serialized(_serialized(), ASSETS)
+    portfolios = batch.portfolios()
+    two_assets = batch[batch.number_of_assets() == 2]
+    assert [p.weights for p in two_assets.portfolios()] == [p.weights for p in portfolios if p.number_of_assets() == 2]
+    assert two_assets[1:3].serialize() == b''.join(p.serialize() for p in two_assets.portfolios()[1:3])
+    assert batch[[5, 0]].portfolios()[1].weights == portfolios[0].weights
+    assert len(PortfolioBatch.concatenate([batch[:10], batch[10:]], ASSETS)) == len(batch)
+    assert len(PortfolioBatch.concatenate([], ASSETS)) == 0
+    assert PortfolioBatch.from_portfolios(portfolios[:7], ASSETS).serialize() == batch[:7].serialize()
+    # weights of records are compared with weights of simulated batch of other dtype
+    edge = PortfolioBatch.from_portfolios([p for p in portfolios if p.number_of_assets() == 1], ASSETS)
+    assert [p.weights for p in batch.without(edge).portfolios()] == \
+        [p.weights for p in portfolios if p.number_of_assets() > 1]
+    assert len(batch.without(PortfolioBatch.concatenate([], ASSETS))) == len(batch)
+
+
+def test_simulated_batch():
+    allocations = list(data_source.all_possible_allocations(len(ASSETS), 20))
+    batch = PortfolioBatch.simulated(allocations, ASSETS, [data_filter.years_all_to_all], MARKET)[0]
+    portfolios = Portfolio.simulated_batch(allocations, ASSETS, [data_filter.years_all_to_all], MARKET)[0]
+    assert [(p.weights, p.stat) for p in batch.portfolios()] == [(p.weights, p.stat) for p in portfolios]
+
+
+@pytest.mark.parametrize('hull_layers', [0, 1, 3])
+def test_batch_convex_hull(hull_layers):
+    serialized = _serialized()
+    coord_pair = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+    hull = data_filter.batch_convex_hull(PortfolioBatch.from_serialized(serialized, ASSETS), coord_pair, hull_layers)
+    points = [
+        (portfolio.stat[coord_pair[0]], portfolio.stat[coord_pair[1]])
+        for portfolio in Portfolio.deserialize_iter(serialized, ASSETS)
+    ]
+    expected = [points[index] for index in data_filter.multilayer_convex_hull_indexes(np.array(points), hull_layers)]
+    assert sorted(map(tuple, hull.points(coord_pair).tolist())) == sorted(expected)
+
+
+def test_portfolio_has_no_instance_dict():
+    portfolio = Portfolio([50, 50, 0, 0], ASSETS)
+    assert not hasattr(portfolio, '__dict__')
@@ -185,3 +185,25 @@ def test_portfolio_simulate(year_selector_func, expected_stats):
     portfolio.simulate(year_selector_func, asset_gain_per_year)
     for stat, expected_stat in expected_stats.items():
         assert stat and abs(portfolio.stat[stat] - expected_stat) < epsilon
+
+
+def test_portfolio_simulated_for_selectors():
+    asset_gain_per_year = {
+        2000: [1.03, 1.04, 1.05],
+        2001: [1.01, 0.91, 1.09],
+        2002: [0.99, 1.09, 0.91],
+        2003: [1.02, 1.12, 1.08],
+        2004: [0.98, 1.08, 0.92],
+    }
+    year_selector_funcs = [
+        data_filter.years_first_to_last,
+        functools.partial(data_filter.years_sliding_window, window_size=2),
+        data_filter.years_all_to_all,
+    ]
+    portfolio = Portfolio(assets=['AAPL', 'MSFT', 'GOOG'], weights=[20, 30, 50])
+    simulated = portfolio.simulated_for_selectors(year_selector_funcs, asset_gain_per_year)
+    assert len(simulated) == len(year_selector_funcs)
+    for year_selector_func, selector_portfolio in zip(year_selector_funcs, simulated):
+        expected = portfolio.simulated(year_selector_func, asset_gain_per_year)
+        assert selector_portfolio.stat == expected.stat
+        assert selector_portfolio.weights == expected.weights
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import io
+import json
+import glob
+import atexit
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+import tracemalloc
+import multiprocessing.util
+
+# settings of profiled run, inherited by every child process
+PROFILE_ENV = 'PORTFOLIO_OPTIMIZER_PROFILE'
+# profile of this process, forked child finds profile of its parent here
+_PROCESS_PROFILE = {}
+
+
+def _settings():
+    settings = os.environ.get(PROFILE_ENV)
+    return json.loads(settings) if settings else None
+
+
+def _stop_profile(write: bool):
+    profile = _PROCESS_PROFILE.pop('profile', None)
+    if profile is None:
+        return
+    profile['profiler'].disable()
+    if not write:
+        return
+    path = os.path.join(profile['directory'], f'{profile["role"]}.{os.getpid()}')
+    profile['profiler'].dump_stats(path + '.prof')
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path + '.memory.json', 'w', encoding='utf-8') as memory_file:
+            json.dump({'role': profile['role'], 'pid': os.getpid(), 'current': current, 'peak': peak}, memory_file)
+
+
+def profile_process(role: str):
+    '''
+    Profile the rest of life of this process under given role, stats are written to profile directory
+    as <role>.<pid>.prof and <role>.<pid>.memory.json when process exits.
+    Does nothing unless run is profiled, or when called from thread other than main one:
+    profiler of process sees every thread, so stages that run as threads are in profile of their process.
+    Can be used as initializer of process pool.
+    '''
+    settings = _settings()
+    if settings is None or threading.current_thread() is not threading.main_thread():
+        return
+    # forked child inherits running profile of its parent, it is not written twice
+    _stop_profile(write=False)
+    if settings['memory']:
+        tracemalloc.stop()
+        tracemalloc.start()
+    _PROCESS_PROFILE['profile'] = {
+        'role': role,
+        'directory': settings['directory'],
+        'profiler': cProfile.Profile(),
+    }
+    _PROCESS_PROFILE['profile']['profiler'].enable()
+    if role != 'main':
+        # runs when multiprocessing child exits, atexit handlers do not
+        multiprocessing.util.Finalize(None, _stop_profile, args=(True,), exitpriority=100)
+
+
+def _run_profiled(role: str, target, *args, **kwargs):
+    profile_process(role)
+    return target(*args, **kwargs)
+
+
+def profiled(target, role: str):
+    '''
+    Target of process or pool initializer that profiles its process under given role when run is profiled
+    '''
+    return functools.partial(_run_profiled, role, target) if _settings() is not None else target
+
+
+def profile_run(directory: str, memory: bool = False, top: int = 20):
+    '''
+    Profile this process and every child started after it, children tell where they belong by role.
+    Peak of traced allocations of every process is recorded too with memory.
+    Profiles are merged by role into directory/summary.txt when this process exits.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.prof')) + glob.glob(os.path.join(directory, '*.memory.json')):
+        os.remove(path)
+    os.environ[PROFILE_ENV] = json.dumps({'directory': os.path.abspath(directory), 'memory': memory})
+    profile_process('main')
+
+    def finish():
+        _stop_profile(write=True)
+        summary = profile_report(directory, top)
+        with open(os.path.join(directory, 'summary.txt'), 'w', encoding='utf-8') as summary_file:
+            summary_file.write(summary['text'])
+        for role in summary['roles']:
+            logging.info('profile of %s: %s', role['role'], _role_line(role))
+        logging.info('profile summary: %s', os.path.join(directory, 'summary.txt'))
+
+    atexit.register(finish)
+
+
+def _role_line(role: dict):
+    line = f'{role["processes"]} processes, {role["seconds"]:.2f}s in profiled functions'
+    if role['peak_memory'] is not None:
+        line += f', peak traced memory {role["peak_memory"] / 2**20:.1f}MiB'
+    return line
+
+
+def profile_report(directory: str, top: int = 20):
+    '''
+    Profiles of processes of every role merged into one: number of processes, time, peak memory
+    of the biggest process when allocations were traced and functions with the most cumulative time.
+    Roles that took the most time go first.
+    '''
+    profiles_paths = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        profiles_paths.setdefault(os.path.basename(path).split('.')[0], []).append(path)
+    peak_memory = {}
+    for path in glob.glob(os.path.join(directory, '*.memory.json')):
+        with open(path, 'r', encoding='utf-8') as memory_file:
+            process_memory = json.load(memory_file)
+        peak_memory[process_memory['role']] = max(peak_memory.get(process_memory['role'], 0), process_memory['peak'])
+    roles = []
+    for role, paths in profiles_paths.items():
+        text = io.StringIO()
+        role_stats = pstats.Stats(*paths, stream=text)
+        role_stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+        roles.append({
+            'role': role,
+            'processes': len(paths),
+            'seconds': role_stats.total_tt,
+            'peak_memory': peak_memory.get(role),
+            'text': text.getvalue(),
+        })
+    roles.sort(key=lambda role: -role['seconds'])
+    summary = ''.join(f'=== {role["role"]}: {_role_line(role)} ===\n{role["text"]}\n' for role in roles)
+    return {'roles': [{key: value for key, value in role.items() if key != 'text'} for role in roles], 'text': summary}
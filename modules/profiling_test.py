@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import threading
+from multiprocessing import Process
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from modules import profiling
+
+
+def _stage_func(numbers: int):
+    return sum(number * number for number in range(numbers))
+
+
+@pytest.mark.parametrize('memory', [False, True])
+def test_children_are_profiled_by_role(tmp_path, monkeypatch, memory):
+    monkeypatch.setenv(profiling.PROFILE_ENV, json.dumps({'directory': str(tmp_path), 'memory': memory}))
+    stages = [Process(target=profiling.profiled(_stage_func, 'stage'), args=(10**5,)) for _ in range(2)]
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    with ProcessPoolExecutor(max_workers=2, initializer=profiling.profile_process, initargs=('pool',)) as pool:
+        assert list(pool.map(_stage_func, [10**4] * 4)) == [_stage_func(10**4)] * 4
+    summary = profiling.profile_report(str(tmp_path))
+    roles = {role['role']: role for role in summary['roles']}
+    assert set(roles) == {'stage', 'pool'}
+    assert roles['stage']['processes'] == 2
+    assert 1 <= roles['pool']['processes'] <= 2
+    assert '_stage_func' in summary['text']
+    for role in roles.values():
+        assert (role['peak_memory'] is not None) == memory
+
+
+def test_threads_are_not_profiled_on_their_own(tmp_path, monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_ENV, json.dumps({'directory': str(tmp_path), 'memory': False}))
+    stage = threading.Thread(target=profiling.profiled(_stage_func, 'stage'), args=(10,))
+    stage.start()
+    stage.join()
+    assert not list(tmp_path.iterdir())
+
+
+def test_not_profiled(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+    assert profiling.profiled(_stage_func, 'stage') is _stage_func
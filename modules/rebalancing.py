@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from importlib import import_module
+
+
+class RebalancingPolicy:
+    '''
+    When holdings that drifted with market are brought back to portfolio weights:
+    every given number of years, when weight of any asset is off by more than band percentage points,
+    or never for buy-and-hold. Command line names are "yearly", "hold", "every-N" and "band-P".
+    '''
+
+    def __init__(self, every: int = 1, band: float = 0):
+        if every < 0 or band < 0:
+            raise ValueError('rebalancing period and band can not be negative')
+        if every > 0 and band > 0:
+            raise ValueError('rebalancing is either periodic or by band')
+        self.every = every
+        self.band = band
+
+    @staticmethod
+    def parse(text: str):
+        kind, _, value = text.partition('-')
+        try:
+            if kind == 'yearly' and not value:
+                return RebalancingPolicy()
+            if kind == 'hold' and not value:
+                return RebalancingPolicy(every=0)
+            if kind == 'every' and int(value) > 0:
+                return RebalancingPolicy(every=int(value))
+            if kind == 'band' and float(value) > 0:
+                return RebalancingPolicy(every=0, band=float(value))
+        except ValueError:
+            pass
+        raise ValueError(f'unknown rebalancing policy "{text}", use yearly, hold, every-N or band-P')
+
+    def is_yearly(self):
+        '''
+        Full rebalancing every year, gains of year do not depend on years before it
+        '''
+        return self.every == 1
+
+    def __str__(self):
+        if self.every == 1:
+            return 'yearly'
+        if self.every > 1:
+            return f'every-{self.every}'
+        if self.band > 0:
+            return f'band-{self.band:g}'
+        return 'hold'
+
+    def __eq__(self, other):
+        return isinstance(other, RebalancingPolicy) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+# pylint: disable=too-many-locals
+def holdings_gains(weights, asset_gains, policy: RebalancingPolicy, year_ends=None):
+    '''
+    Gain of every portfolio in every year of path that starts with holdings at portfolio weights,
+    weights have one portfolio per row, asset_gains have one period per row.
+    Periods are years unless year_ends marks periods that end a year: band is checked at the end of every period,
+    periodic rebalancing happens at the end of a year.
+    Holdings of all portfolios are tracked at once, returns array of shape (portfolios, years).
+    '''
+    np = import_module('numpy')
+    targets = np.asarray(weights, dtype=np.float64).reshape(-1, asset_gains.shape[1]) / 100
+    holdings = targets.copy()
+    values = np.ones(len(targets), dtype=np.float64)
+    year_start_values = values
+    years_n = len(asset_gains) if year_ends is None else int(np.count_nonzero(year_ends))
+    gains = np.empty((len(targets), years_n), dtype=np.float64)
+    year_idx = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for period_idx, period_gains in enumerate(asset_gains):
+            holdings *= period_gains
+            # assets are summed one by one, so gains of portfolio do not depend on size of batch
+            values = holdings[:, 0].copy()
+            for asset_idx in range(1, holdings.shape[1]):
+                values += holdings[:, asset_idx]
+            year_end = year_ends is None or year_ends[period_idx]
+            if year_end:
+                gains[:, year_idx] = values / year_start_values
+                year_start_values = values
+                year_idx += 1
+            if policy.every > 0 and year_end and year_idx % policy.every == 0:
+                holdings = targets * values[:, None]
+            elif policy.band > 0:
+                drifted = (np.abs(holdings / values[:, None] - targets).max(axis=1) * 100) > policy.band
+                holdings[drifted] = targets[drifted] * values[drifted, None]
+    return gains
+
+
+class RebalancedGains:
+    '''
+    Yearly gains of portfolios that are not rebalanced every year. Holdings depend on the year
+    they were bought in, so every year range gets path simulated from its first year.
+    Selectors give ranges grouped by first year, path of the last first year is kept.
+    Asset gains are yearly unless year_ends marks periods that end a year, see holdings_gains.
+    '''
+
+    def __init__(self, weights, asset_gains, policy: RebalancingPolicy, year_ends=None):
+        np = import_module('numpy')
+        self.weights = weights
+        self.asset_gains = asset_gains
+        self.policy = policy
+        self.year_ends = year_ends
+        # first period of every year
+        self._year_starts = None
+        if year_ends is not None:
+            self._year_starts = np.concatenate(([0], np.flatnonzero(year_ends)[:-1] + 1))
+        self._path_start = None
+        self._path = None
+
+    def __len__(self):
+        return len(self.weights)
+
+    def range_gains(self, start_column: int, end_column: int):
+        '''
+        Gains of years [start_column, end_column] when holdings are bought at the start
+        '''
+        if self._path_start != start_column:
+            if self.year_ends is None:
+                self._path = holdings_gains(self.weights, self.asset_gains[start_column:], self.policy)
+            else:
+                start_period = self._year_starts[start_column]
+                self._path = holdings_gains(
+                    self.weights, self.asset_gains[start_period:], self.policy, self.year_ends[start_period:])
+            self._path_start = start_column
+        return self._path[:, :end_column - start_column + 1]
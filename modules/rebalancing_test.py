@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import random
+import pytest
+from modules import stats
+from modules import data_source
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.rebalancing import RebalancingPolicy
+
+ASSETS = ['stocks', 'bonds', 'gold']
+MARKET = {
+    year: [random.Random(year * len(ASSETS) + asset_idx).uniform(0.7, 1.4) for asset_idx, _ in enumerate(ASSETS)]
+    for year in range(2000, 2010)
+}
+ALLOCATIONS = list(data_source.all_possible_allocations(len(ASSETS), 10))
+
+
+def _stats(allocations, rebalancing, selector=data_filter.years_all_to_all):
+    years, gains = stats.annual_gains(allocations, MARKET, RebalancingPolicy.parse(rebalancing))
+    return stats.simulated_stats(years, gains, selector, Portfolio.SERIALIZED_STATS)
+
+
+@pytest.mark.parametrize('text', ['yearly', 'hold', 'every-3', 'band-5', 'band-2.5'])
+def test_policy_names(text):
+    assert str(RebalancingPolicy.parse(text)) == text
+
+
+@pytest.mark.parametrize('text', ['monthly', 'every-0', 'band-', 'hold-2', 'every-x'])
+def test_unknown_policy(text):
+    with pytest.raises(ValueError):
+        RebalancingPolicy.parse(text)
+
+
+def test_buy_and_hold_gain():
+    values = _stats(ALLOCATIONS, 'hold', data_filter.years_first_to_last)
+    for allocation, gain in zip(ALLOCATIONS, values[Portfolio.STAT_GAIN].tolist()):
+        expected = sum(
+            weight / 100 * math.prod(MARKET[year][asset_idx] for year in MARKET)
+            for asset_idx, weight in enumerate(allocation))
+        assert gain == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('rebalancing, same_as', [
+    ('every-1', 'yearly'), ('band-0.000001', 'yearly'), ('band-100', 'hold'), (f'every-{len(MARKET)}', 'hold'),
+])
+def test_policies_that_match(rebalancing, same_as):
+    values, expected = _stats(ALLOCATIONS, rebalancing), _stats(ALLOCATIONS, same_as)
+    for stat_name in Portfolio.SERIALIZED_STATS:
+        assert values[stat_name] == pytest.approx(expected[stat_name], nan_ok=True)
+
+
+@pytest.mark.parametrize('rebalancing', ['hold', 'every-3', 'band-5'])
+def test_stats_do_not_depend_on_batch(rebalancing):
+    values = _stats(ALLOCATIONS, rebalancing)
+    for allocation_idx in (0, 17, len(ALLOCATIONS) - 1):
+        single = _stats([ALLOCATIONS[allocation_idx]], rebalancing)
+        for stat_name in Portfolio.SERIALIZED_STATS:
+            assert single[stat_name][0] == values[stat_name][allocation_idx] or \
+                math.isnan(single[stat_name][0]) and math.isnan(values[stat_name][allocation_idx])
+
+
+def test_rebalancing_changes_stats():
+    portfolio = Portfolio([40, 30, 30], ASSETS)
+    sharpes = {
+        rebalancing: portfolio.simulated(
+            data_filter.years_all_to_all, MARKET, rebalancing=RebalancingPolicy.parse(rebalancing)
+        ).stat[Portfolio.STAT_SHARPE]
+        for rebalancing in ['yearly', 'hold', 'every-3', 'band-5']
+    }
+    assert len(set(sharpes.values())) == len(sharpes)
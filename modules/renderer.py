@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import multiprocessing.connection
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from modules import data_source
+from modules import data_output
+from modules import profiling
+from modules.backend import wait_connections
+
+# template of render pool worker, prepared once per process by init_render_worker
+_WORKER_STATE = {}
+
+
+def init_render_worker(asset_color_map: dict[str, tuple[int, int, int]]):
+    '''
+    Initializer of render pool: fonts, styling and legend handles are prepared once per process
+    '''
+    _WORKER_STATE['template'] = data_output.PlotTemplate(asset_color_map)
+
+
+def render_task(plot_format: str, plot: dict):
+    data_output.PLOT_RENDERERS[plot_format](_WORKER_STATE['template'], plot)
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def renderer_process_func(
+        sources: list[multiprocessing.connection.Connection],
+        asset_color_map: dict[str, tuple[int, int, int]] = None,
+        output: str = 'svg',
+        workers: int = 0,
+        backend: str = 'process'):
+    '''
+    Render stage of pipeline: every plotter sends its laid out plots through its source, then data stream end.
+    Every file of every plot, such as PNG and SVG of the same plot, is rendered on its own by pool
+    of workers sized to cores, not to number of plotters. Pool starts with the first plot,
+    so its workers take no memory while portfolios are simulated.
+    '''
+    workers = workers or os.cpu_count()
+    if backend == 'thread':
+        pool = ThreadPoolExecutor(max_workers=workers, initializer=init_render_worker, initargs=(asset_color_map,))
+    else:
+        pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=profiling.profiled(init_render_worker, 'render-pool'),
+            initargs=(asset_color_map,))
+    data_stream_end_pickle = pickle.dumps(data_source.DataStreamFinished())
+    futures = []
+    with pool:
+        # plots are rendered in order they are laid out, whichever plotter sends them
+        pending = list(sources)
+        while pending:
+            for source in wait_connections(pending):
+                bytes_from_pipe = source.recv_bytes()
+                if bytes_from_pipe == data_stream_end_pickle:
+                    pending.remove(source)
+                    continue
+                plot = pickle.loads(bytes_from_pipe)
+                futures.extend(
+                    pool.submit(render_task, plot_format, plot) for plot_format in data_output.plot_formats(output))
+        for future in futures:
+            future.result()
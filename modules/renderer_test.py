@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import random
+import threading
+import pytest
+from modules import backend
+from modules import renderer
+from modules import data_source
+from modules import data_output
+
+COLOR_MAP = {'stocks': (1, 0, 0), 'bonds': (0, 0, 1)}
+
+
+def _circles(seed: int, circles_n: int = 20):
+    rng = random.Random(seed)
+    return [
+        {
+            'x': rng.uniform(0, 10),
+            'y': rng.uniform(0, 20),
+            'text': f'stocks: {weight}%\nbonds: {100 - weight}%',
+            'weights': [weight, 100 - weight],
+            'stats': [rng.uniform(0, 20)],
+            'marker': 'X' if circle_idx == 0 else 'o',
+            'color': (weight / 100, 0, 1 - weight / 100),
+            'size': 50,
+            'linewidth': 1,
+        }
+        for circle_idx, weight in enumerate(rng.randrange(0, 101) for _ in range(circles_n))
+    ]
+
+
+def test_legend_stays_at_best_location():
+    template = data_output.PlotTemplate(COLOR_MAP)
+    for seed in range(4):
+        circles = _circles(seed, 200)
+        plot = template.layout(circles, 'Stddev', 'CAGR(%)', 'test')
+        assert plot['legend_loc'] != 'best'
+        best_axes = template.axes(dict(plot, legend_loc='best'))
+        best_axes.scatter([circle['x'] for circle in circles], [circle['y'] for circle in circles])
+        placed_axes = template.axes(plot)
+        assert placed_axes.get_legend().get_window_extent(placed_axes.figure.canvas.get_renderer()).bounds == \
+            pytest.approx(best_axes.get_legend().get_window_extent(best_axes.figure.canvas.get_renderer()).bounds)
+
+
+@pytest.mark.parametrize('render_backend', backend.BACKENDS)
+@pytest.mark.parametrize('output', ['svg', 'html'])
+def test_renderer_stage(tmp_path, render_backend, output):
+    template = data_output.PlotTemplate(COLOR_MAP)
+    pipe, _ = backend.pipeline_runtime(render_backend)
+    render_pipes = [pipe() for _ in range(2)]
+
+    def send_plots(plotter_idx, sink):
+        for plot_idx in range(2):
+            sink.send(template.layout(
+                _circles(plotter_idx * 2 + plot_idx), 'Stddev', 'CAGR(%)',
+                directory=str(tmp_path / str(plotter_idx)), filename=f'plot {plot_idx}',
+                tooltip_assets=list(COLOR_MAP), tooltip_stats=['CAGR(%)']))
+        sink.send(data_source.DataStreamFinished())
+
+    plotters = [
+        threading.Thread(target=send_plots, args=(plotter_idx, sink))
+        for plotter_idx, (_, sink) in enumerate(render_pipes)
+    ]
+    for plotter in plotters:
+        plotter.start()
+    renderer.renderer_process_func(
+        [source for source, _ in render_pipes], COLOR_MAP, output, workers=2, backend=render_backend)
+    for plotter in plotters:
+        plotter.join()
+    for plotter_idx in range(2):
+        for plot_idx in range(2):
+            assert (tmp_path / str(plotter_idx) / f'plot {plot_idx}.png').stat().st_size > 0
+            assert (tmp_path / str(plotter_idx) / f'plot {plot_idx}.{output}').stat().st_size > 0
+    if output == 'svg':
+        svg = (tmp_path / '0' / 'plot 0.svg').read_text(encoding='utf-8')
+        assert svg.count('onmouseover') == 20
+        assert svg.count('visibility="hidden"') == 20
+
+
+@pytest.mark.parametrize('render_backend', backend.BACKENDS)
+def test_renderer_takes_plots_of_any_plotter_first(tmp_path, render_backend):
+    template = data_output.PlotTemplate(COLOR_MAP)
+    pipe, _ = backend.pipeline_runtime(render_backend)
+    render_pipes = [pipe() for _ in range(2)]
+    stage = threading.Thread(target=renderer.renderer_process_func, daemon=True, kwargs={
+        'sources': [source for source, _ in render_pipes], 'asset_color_map': COLOR_MAP, 'output': 'html',
+        'workers': 1, 'backend': 'thread'})
+    stage.start()
+    for plotter_idx in (1, 0):
+        sink = render_pipes[plotter_idx][1]
+        sink.send(template.layout(_circles(plotter_idx), 'Stddev', 'CAGR(%)', directory=str(tmp_path),
+                                  filename=f'plot {plotter_idx}'))
+        sink.send(data_source.DataStreamFinished())
+        # plot of the second plotter is rendered while the first one has not sent anything yet
+        deadline = time.monotonic() + 60
+        while not (tmp_path / f'plot {plotter_idx}.html').exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert (tmp_path / f'plot {plotter_idx}.html').exists()
+    stage.join()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+import multiprocessing.connection
+from glob import glob
+from modules.market import MarketReturns
+from modules.portfolio import Portfolio
+from modules.data_source import DataStreamFinished, untagged_chunk
+from modules.data_source import CHECKPOINT_TAG, checkpoint_allocations_done
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+from modules.checkpoint import RunCheckpoints
+
+STORE_CHECKPOINT_NAME = 'store'
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def entry_metadata(
+        assets: list[str],
+        asset_gain_per_year: dict[int, list[float]],
+        year_selector: str,
+        percentage_step: int,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Describe simulation results, stored entries are reusable
+    only if their metadata is compatible with current run.
+    Stats and rebalancing are recorded only if they differ from default ones, so older entries keep their names.
+    '''
+    years = sorted(asset_gain_per_year.keys())
+    metadata = {
+        'assets': list(assets),
+        'years': years,
+        'year_selector': year_selector,
+        'percentage_step': percentage_step,
+        'returns': {
+            asset: [asset_gain_per_year[year][asset_idx] for year in years]
+            for asset_idx, asset in enumerate(assets)
+        },
+    }
+    if tuple(stat_names) != Portfolio.SERIALIZED_STATS:
+        metadata['stats'] = list(stat_names)
+    if rebalancing is not None and not rebalancing.is_yearly():
+        metadata['rebalancing'] = str(rebalancing)
+    if isinstance(asset_gain_per_year, MarketReturns) and asset_gain_per_year.has_subyear_periods():
+        metadata['period_returns'] = asset_gain_per_year.period_digests(assets)
+    return metadata
+
+
+def entry_stats(metadata: dict):
+    '''
+    Stats of portfolios in stored entry, in record order
+    '''
+    return tuple(metadata.get('stats', Portfolio.SERIALIZED_STATS))
+
+
+def entry_name(metadata: dict):
+    return hashlib.sha1(json.dumps(metadata, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _shared_assets(stored: dict, metadata: dict):
+    '''
+    Assets that present in both runs and have identical returns,
+    or None if stored results are not reusable at all
+    '''
+    if stored['years'] != metadata['years'] or \
+            stored['year_selector'] != metadata['year_selector'] or \
+            stored['percentage_step'] != metadata['percentage_step'] or \
+            entry_stats(stored) != entry_stats(metadata) or \
+            stored.get('rebalancing') != metadata.get('rebalancing'):
+        return None
+    shared = [asset for asset in metadata['assets'] if asset in stored['assets']]
+    if any(stored['returns'][asset] != metadata['returns'][asset] for asset in shared):
+        return None
+    if any(stored.get('period_returns', {}).get(asset) != metadata.get('period_returns', {}).get(asset)
+           for asset in shared):
+        return None
+    return shared
+
+
+def find_reusable_entry(directory: str, metadata: dict):
+    '''
+    Find stored entry that covers largest sub-simplex of current run.
+    Every stored portfolio that has zero weight in removed assets is
+    a valid portfolio of current run with zero weight in added assets.
+    '''
+    best_entry, best_shared = None, []
+    for metadata_path in glob(os.path.join(directory, '*.json')):
+        with open(metadata_path, 'r', encoding='utf-8') as json_file:
+            stored = json.load(json_file)
+        shared = _shared_assets(stored, metadata)
+        if shared is None or len(shared) == 0:
+            continue
+        removed = len(stored['assets']) - len(shared)
+        best_removed = len(best_entry['assets']) - len(best_shared) if best_entry else 0
+        if len(shared) > len(best_shared) or (len(shared) == len(best_shared) and removed < best_removed):
+            best_entry, best_shared = stored, shared
+            best_entry['path'] = metadata_path[:-len('.json')] + '.bin'
+    return best_entry
+
+
+def new_asset_indexes(stored: dict, assets: list[str]):
+    return [asset_idx for asset_idx, asset in enumerate(assets) if asset not in stored['assets']]
+
+
+def reused_portfolios_iter(
+        stored: dict, assets: list[str], chunk_size: int,
+        constraints: AllocationConstraints = None):
+    '''
+    Read stored portfolios, drop those that hold removed assets or violate constraints
+    and realign the rest to current assets, yield chunks in wire format
+    '''
+    removed_indexes = [
+        asset_idx for asset_idx, asset in enumerate(stored['assets']) if asset not in assets
+    ]
+    realign_indexes = [
+        stored['assets'].index(asset) if asset in stored['assets'] else None for asset in assets
+    ]
+    stat_names = entry_stats(stored)
+    record_size = Portfolio.serialized_size(len(stored['assets']), stat_names)
+    with open(stored['path'], 'rb') as bin_file:
+        while bytes_from_file := bin_file.read(record_size * chunk_size):
+            realigned = []
+            for portfolio in Portfolio.deserialize_iter(bytes_from_file, assets=stored['assets'],
+                                                        stat_names=stat_names):
+                if any(portfolio.weights[asset_idx] != 0 for asset_idx in removed_indexes):
+                    continue
+                portfolio.weights = [
+                    0 if asset_idx is None else portfolio.weights[asset_idx] for asset_idx in realign_indexes
+                ]
+                if constraints is not None and not constraints.allows(portfolio.weights):
+                    continue
+                portfolio.assets = assets
+                realigned.append(portfolio.serialize(stat_names))
+            if realigned:
+                yield b''.join(realigned)
+
+
+# pylint: disable=too-many-locals
+def store_writer_process_func(
+        directory: str,
+        metadatas: list[dict],
+        source: multiprocessing.connection.Connection = None,
+        checkpoints: RunCheckpoints = None,
+        resume_from: int = None):
+    '''
+    Save every portfolio from data stream, one entry per year range selector,
+    entries become visible for later runs only when stream is complete.
+    Resumed run drops portfolios written after checkpoint.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    bin_paths = [os.path.join(directory, entry_name(metadata) + '.bin') for metadata in metadatas]
+    data_stream_end_pickle = pickle.dumps(DataStreamFinished())
+    bin_files = [open(bin_path + '.tmp', 'a+b') for bin_path in bin_paths]  # pylint: disable=consider-using-with
+    resumed_lengths = checkpoints.load(STORE_CHECKPOINT_NAME, resume_from) \
+        if checkpoints is not None and resume_from is not None else [0] * len(bin_files)
+    for bin_file, length in zip(bin_files, resumed_lengths):
+        bin_file.truncate(length)
+    try:
+        while True:
+            bytes_from_pipe = source.recv_bytes()
+            if bytes_from_pipe == data_stream_end_pickle:
+                break
+            selector_idx, data = untagged_chunk(bytes_from_pipe)
+            if selector_idx == CHECKPOINT_TAG:
+                if checkpoints is not None:
+                    for bin_file in bin_files:
+                        bin_file.flush()
+                    checkpoints.save(
+                        STORE_CHECKPOINT_NAME, checkpoint_allocations_done(data),
+                        [bin_file.seek(0, os.SEEK_END) for bin_file in bin_files])
+                continue
+            bin_files[selector_idx].write(data)
+    finally:
+        for bin_file in bin_files:
+            bin_file.close()
+    for metadata, bin_path in zip(metadatas, bin_paths):
+        os.replace(bin_path + '.tmp', bin_path)
+        with open(bin_path[:-len('.bin')] + '.json', 'w', encoding='utf-8') as json_file:
+            json.dump(metadata, json_file, ensure_ascii=False)
+        logging.info('stored: %s', bin_path)
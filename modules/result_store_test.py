@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import pytest
+from modules import data_filter
+from modules import data_source
+from modules import result_store
+from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+
+ASSET_GAIN_PER_YEAR = {
+    2000: [1.03, 1.04, 1.05, 1.06],
+    2001: [1.01, 1.01, 1.09, 1.10],
+    2002: [0.99, 1.09, 0.91, 1.01],
+    2003: [1.02, 1.02, 1.08, 1.12],
+    2004: [0.98, 1.08, 0.92, 1.03],
+}
+ASSETS = ['A', 'B', 'C', 'D']
+
+
+def _subset_market(assets: list[str]):
+    asset_indexes = [ASSETS.index(asset) for asset in assets]
+    return {
+        year: [gains[asset_idx] for asset_idx in asset_indexes]
+        for year, gains in ASSET_GAIN_PER_YEAR.items()
+    }
+
+
+def _simulated_serialized(assets: list[str], step: int):
+    market = _subset_market(assets)
+    return {
+        tuple(allocation): Portfolio(weights=allocation, assets=assets).simulated(
+            year_range_selector_func=data_filter.years_all_to_all,
+            asset_gain_per_year=market).serialize()
+        for allocation in data_source.all_possible_allocations(len(assets), step)
+    }
+
+
+def _store_entry(directory, assets: list[str], step: int):
+    metadata = result_store.entry_metadata(
+        assets=assets, asset_gain_per_year=_subset_market(assets),
+        year_selector='all-to-all', percentage_step=step)
+    name = result_store.entry_name(metadata)
+    with open(directory / f'{name}.bin', 'wb') as bin_file:
+        bin_file.write(b''.join(_simulated_serialized(assets, step).values()))
+    with open(directory / f'{name}.json', 'w', encoding='utf-8') as json_file:
+        json.dump(metadata, json_file)
+
+
+@pytest.mark.parametrize('stored_assets, assets', [
+    [['A', 'B'], ['A', 'B', 'C']],
+    [['A', 'B', 'C'], ['C', 'A', 'B', 'D']],
+    [['A', 'B', 'C', 'D'], ['B', 'D']],
+    [['A', 'B', 'C'], ['D', 'B', 'A']],
+])
+def test_reused_portfolios(tmp_path, stored_assets, assets):
+    step = 25
+    _store_entry(tmp_path, stored_assets, step)
+    metadata = result_store.entry_metadata(
+        assets=assets, asset_gain_per_year=_subset_market(assets),
+        year_selector='all-to-all', percentage_step=step)
+    stored = result_store.find_reusable_entry(tmp_path, metadata)
+    assert stored['assets'] == stored_assets
+
+    expected = _simulated_serialized(assets, step)
+    new_indexes = result_store.new_asset_indexes(stored, assets)
+    reused = b''.join(result_store.reused_portfolios_iter(stored, assets, chunk_size=7))
+    reused_allocations = []
+    for portfolio in Portfolio.deserialize_iter(reused, assets=assets):
+        assert all(portfolio.weights[asset_idx] == 0 for asset_idx in new_indexes)
+        assert portfolio.serialize() == expected[tuple(portfolio.weights)]
+        reused_allocations.append(tuple(portfolio.weights))
+    # reused and simulated portfolios must cover whole simplex exactly once
+    new_assets_constraints = AllocationConstraints(len(assets)).with_group(new_indexes, group_min=1)
+    simulated_allocations = [
+        tuple(allocation) for allocation in
+        data_source.all_possible_allocations(len(assets), step, constraints=new_assets_constraints)
+    ]
+    assert sorted(reused_allocations + simulated_allocations) == sorted(expected.keys())
+
+
+def test_incompatible_entries_ignored(tmp_path):
+    _store_entry(tmp_path, ['A', 'B'], 25)
+    metadata = result_store.entry_metadata(
+        assets=['A', 'B'], asset_gain_per_year=_subset_market(['A', 'B']),
+        year_selector='all-to-all', percentage_step=20)
+    assert result_store.find_reusable_entry(tmp_path, metadata) is None
+    market = _subset_market(['A', 'B'])
+    market[2000][0] = 1.5
+    metadata = result_store.entry_metadata(
+        assets=['A', 'B'], asset_gain_per_year=market,
+        year_selector='all-to-all', percentage_step=25)
+    assert result_store.find_reusable_entry(tmp_path, metadata) is None
+    metadata = result_store.entry_metadata(
+        assets=['A', 'B'], asset_gain_per_year=_subset_market(['A', 'B']),
+        year_selector='all-to-all', percentage_step=25, rebalancing=RebalancingPolicy(every=0))
+    assert result_store.find_reusable_entry(tmp_path, metadata) is None
@@ -17,41 +17,134 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import math
 import time
 import logging
-from functools import partial
 import multiprocessing.connection
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from collections.abc import Callable
 from modules import data_source
+from modules import profiling
+from modules import result_store
+from modules.portfolio import Portfolio
+from modules.portfolio_batch import PortfolioBatch
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+
+
+def send_reused_portfolios(
+        assets: list[str],
+        reusable_entries: list[dict],
+        sink: multiprocessing.connection.Connection,
+        chunk_size: int,
+        constraints: AllocationConstraints):
+    # entries of all selectors have the same assets
+    for selector_idx, reusable_entry in enumerate(reusable_entries):
+        portfolios_reused = 0
+        for reused_chunk in result_store.reused_portfolios_iter(reusable_entry, assets, chunk_size, constraints):
+            sink.send_bytes(data_source.tagged_chunk(selector_idx, (reused_chunk,)))
+            portfolios_reused += len(reused_chunk) // Portfolio.serialized_size(
+                len(assets), result_store.entry_stats(reusable_entry))
+        logging.info('Reused %d portfolios from %s', portfolios_reused, reusable_entry['path'])
+
+
+def constraints_without_reused(
+        assets: list[str],
+        reusable_entries: list[dict],
+        constraints: AllocationConstraints):
+    '''
+    Portfolios without new assets are reused, only those that hold any new asset are simulated
+    '''
+    if reusable_entries is None:
+        return constraints
+    return constraints.with_group(result_store.new_asset_indexes(reusable_entries[0], assets), group_min=1)
 
 
 # pylint: disable=too-many-arguments
 # pylint: disable=too-many-positional-arguments
+# pylint: disable=too-many-locals
 def simulator_process_func(
         assets: list = None,
         percentage_step: int = None,
-        year_range_selector_func: Callable = None,
+        year_range_selector_funcs: list[Callable] = None,
         asset_gain_per_year: dict[str, dict[str, float]] = None,
         sink: multiprocessing.connection.Connection = None,
-        chunk_size: int = 1):
-    possible_allocations_gen = data_source.all_possible_allocations(len(assets), percentage_step)
-    possible_allocations = sum(1 for _ in possible_allocations_gen)
-    logging.info('Will simulate %d portfolios', possible_allocations)
+        chunk_size: int = 1,
+        reusable_entries: list[dict] = None,
+        constraints: AllocationConstraints = None,
+        checkpoint_every: int = 0,
+        resume_from: int = None,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        tasks_per_core: int = 16,
+        backend: str = 'process',
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Simulate portfolios with every year range selector at once,
+    chunks are tagged with index of selector and hold only given stats.
+    With checkpoint_every allocations are simulated range by range,
+    checkpoint marker is sent when every allocation of range was sent.
+    Run resumed from checkpoint skips reused portfolios and allocations before it.
+    Pool workers get market data once, range is split into many small tasks that balance load.
+    Thread backend simulates in threads of this process that share market data.
+    '''
+    if constraints is None:
+        constraints = AllocationConstraints(len(assets))
+    if reusable_entries is not None and resume_from is None:
+        send_reused_portfolios(assets, reusable_entries, sink, chunk_size, constraints)
+    constraints = constraints_without_reused(assets, reusable_entries, constraints)
+    possible_allocations = data_source.count_possible_allocations(len(assets), percentage_step, constraints)
+    range_start = resume_from or 0
+    range_size = checkpoint_every if checkpoint_every > 0 else possible_allocations
+    if checkpoint_every > 0 and resume_from is None:
+        sink.send_bytes(data_source.checkpoint_chunk(0))
+    logging.info('Will simulate %d portfolios', possible_allocations - range_start)
     time_start = time.time()
-    with ProcessPoolExecutor() as process_pool:
-        allocations_per_core = possible_allocations // os.cpu_count() + 1
-        slice_sender = partial(
-            data_source.allocation_slice_simulate_and_feed_to_sink,
-            slice_size=allocations_per_core,
-            assets=assets,
-            percentage_step=percentage_step,
-            year_range_selector_func=year_range_selector_func,
-            asset_gain_per_year=asset_gain_per_year,
-            sink=sink,
-            chunk_size=chunk_size)
-        portfolios_sent_per_core = process_pool.map(slice_sender, range(0, os.cpu_count()))
+    portfolios_sent = 0
+    worker_args = (
+        assets, percentage_step, year_range_selector_funcs, asset_gain_per_year,
+        sink, chunk_size, constraints, stat_names, rebalancing)
+    if backend == 'thread':
+        data_source.init_range_worker(*worker_args)
+        pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    else:
+        pool = ProcessPoolExecutor(
+            initializer=profiling.profiled(data_source.init_range_worker, 'simulator-pool'), initargs=worker_args)
+    with pool:
+        while range_start < possible_allocations:
+            range_stop = min(range_start + range_size, possible_allocations)
+            task_size = max(chunk_size, math.ceil((range_stop - range_start) / (os.cpu_count() * tasks_per_core)))
+            task_starts = range(range_start, range_stop, task_size)
+            portfolios_sent += sum(pool.map(
+                data_source.allocation_range_simulate_and_feed_to_sink,
+                task_starts, [min(task_start + task_size, range_stop) for task_start in task_starts]))
+            if checkpoint_every > 0:
+                sink.send_bytes(data_source.checkpoint_chunk(range_stop))
+                logging.info('Checkpoint: %d of %d portfolios simulated', range_stop, possible_allocations)
+            range_start = range_stop
+    if backend == 'thread':
+        data_source.release_range_worker()
     time_end = time.time()
     logging.info('Simulated %d portfolios, rate: %dk/s',
-                 sum(portfolios_sent_per_core), possible_allocations // (int(time_end - time_start) + 1) // 1000)
+                 portfolios_sent, portfolios_sent // (int(time_end - time_start) + 1) // 1000)
     sink.send(data_source.DataStreamFinished())
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-positional-arguments
+def simulated_portfolios(
+        assets: list = None,
+        percentage_step: int = None,
+        year_range_selector_funcs: list[Callable] = None,
+        asset_gain_per_year: dict[str, dict[str, float]] = None,
+        constraints: AllocationConstraints = None,
+        stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS,
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Simulate allocations and return them as portfolios,
+    for small sets that are added to every plot as is.
+    Returns PortfolioBatch for every year range selector.
+    '''
+    allocations = list(data_source.all_possible_allocations(len(assets), percentage_step, constraints))
+    return PortfolioBatch.simulated(
+        allocations, assets, year_range_selector_funcs, asset_gain_per_year, stat_names, rebalancing)
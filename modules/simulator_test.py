@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+from modules import data_filter
+from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
+from modules.simulator import simulated_portfolios
+
+ASSETS = ['stocks', 'bonds', 'gold', 'cash']
+MARKET = {
+    year: [random.Random(year * len(ASSETS) + asset_idx).uniform(0.7, 1.4) for asset_idx, _ in enumerate(ASSETS)]
+    for year in range(2000, 2010)
+}
+
+
+@pytest.mark.parametrize('constraints', [
+    AllocationConstraints(len(ASSETS)),
+    AllocationConstraints(len(ASSETS), bounds=[(0, 60), (10, 100), (0, 100), (0, 100)], max_assets=3),
+])
+@pytest.mark.parametrize('edge', [1, 2, 3])
+def test_edge_portfolios_are_enumeration_with_few_assets(constraints, edge):
+    selectors = [data_filter.years_first_to_last]
+    full = simulated_portfolios(ASSETS, 10, selectors, MARKET, constraints)[0]
+    edge_batch = simulated_portfolios(ASSETS, 10, selectors, MARKET, constraints.with_max_assets(edge))[0]
+    coord_pair = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+    expected = full[full.number_of_assets() <= edge]
+    assert sorted(map(tuple, edge_batch.weights.tolist())) == sorted(map(tuple, expected.weights.tolist()))
+    assert sorted(map(tuple, edge_batch.points(coord_pair).tolist())) == \
+        sorted(map(tuple, expected.points(coord_pair).tolist()))
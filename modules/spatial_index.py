@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from importlib import import_module
+from modules import result_store
+from modules.portfolio import Portfolio
+
+
+# pylint: disable=too-many-instance-attributes
+class PortfolioIndex:
+    '''
+    Uniform grid over simulated portfolios in coordinate space.
+    Coordinates are normalized by their range, so distances along both axes are comparable.
+    Portfolios are sorted by grid cell, every row of cells is a contiguous slice.
+    '''
+
+    POINTS_PER_CELL = 4
+
+    def __init__(self, records, assets: list[str], coord_pair: tuple[str, str]):
+        '''
+        records - numpy array of Portfolio.serialized_dtype, memory-mapped store entry is fine
+        '''
+        np = import_module('numpy')
+        self.records = records
+        self.assets = assets
+        self.coord_pair = coord_pair
+        x = np.asarray(records[coord_pair[1]], dtype=np.float64)
+        y = np.asarray(records[coord_pair[0]], dtype=np.float64)
+        self.origin = (float(x.min()), float(y.min())) if len(records) else (0.0, 0.0)
+        self.scale = tuple(
+            1 / (float(values.max()) - low) if len(values) and values.max() > low else 1.0
+            for values, low in zip((x, y), self.origin))
+        self.cells = max(1, int((len(records) / PortfolioIndex.POINTS_PER_CELL) ** 0.5))
+        cell_x, cell_y = self._cell(x, axis=0), self._cell(y, axis=1)
+        cell_ids = cell_y * self.cells + cell_x
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.sorted_x = self._normalized(x[self.order], axis=0)
+        self.sorted_y = self._normalized(y[self.order], axis=1)
+        self.cell_starts = np.searchsorted(cell_ids[self.order], np.arange(self.cells * self.cells + 1))
+
+    @staticmethod
+    def from_store_entry(stored: dict, coord_pair: tuple[str, str]):
+        np = import_module('numpy')
+        records = np.memmap(
+            stored['path'],
+            dtype=Portfolio.serialized_dtype(len(stored['assets']), result_store.entry_stats(stored)), mode='r')
+        return PortfolioIndex(records, stored['assets'], coord_pair)
+
+    @staticmethod
+    def from_serialized(
+            chunks, assets: list[str], coord_pair: tuple[str, str],
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        np = import_module('numpy')
+        records = np.frombuffer(b''.join(chunks), dtype=Portfolio.serialized_dtype(len(assets), stat_names))
+        return PortfolioIndex(records, assets, coord_pair)
+
+    def _normalized(self, values, axis: int):
+        return (values - self.origin[axis]) * self.scale[axis]
+
+    def _cell(self, values, axis: int):
+        np = import_module('numpy')
+        return np.clip((self._normalized(values, axis) * self.cells).astype(np.int64), 0, self.cells - 1)
+
+    def _cells_slices(self, cell_x_range: tuple[int, int], cell_y_range: tuple[int, int]):
+        '''
+        Sorted positions of portfolios in rectangle of cells, inclusive ranges
+        '''
+        np = import_module('numpy')
+        cell_x_low, cell_x_high = max(cell_x_range[0], 0), min(cell_x_range[1], self.cells - 1)
+        cell_y_low, cell_y_high = max(cell_y_range[0], 0), min(cell_y_range[1], self.cells - 1)
+        if cell_x_low > cell_x_high or cell_y_low > cell_y_high:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            np.arange(
+                self.cell_starts[cell_y * self.cells + cell_x_low],
+                self.cell_starts[cell_y * self.cells + cell_x_high + 1])
+            for cell_y in range(cell_y_low, cell_y_high + 1)
+        ])
+
+    def _portfolios(self, sorted_positions):
+        return [
+            Portfolio.deserialize(
+                self.records[self.order[position]].tobytes(), assets=self.assets,
+                stat_names=self.records.dtype.names[:-1])
+            for position in sorted_positions
+        ]
+
+    def nearest(self, x: float, y: float, count: int = 1):
+        '''
+        Portfolios nearest to given point, closest first
+        '''
+        np = import_module('numpy')
+        count = min(count, len(self.records))
+        if count <= 0:
+            return []
+        query_x, query_y = self._normalized(x, axis=0), self._normalized(y, axis=1)
+        cell_x = int(np.clip(int(query_x * self.cells), 0, self.cells - 1))
+        cell_y = int(np.clip(int(query_y * self.cells), 0, self.cells - 1))
+        radius = 0
+        while True:
+            positions = self._cells_slices((cell_x - radius, cell_x + radius), (cell_y - radius, cell_y + radius))
+            if len(positions) >= count:
+                distances = (self.sorted_x[positions] - query_x) ** 2 + (self.sorted_y[positions] - query_y) ** 2
+                nearest = np.argpartition(distances, count - 1)[:count]
+                nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+                # portfolios outside of searched cells are farther than radius
+                if distances[nearest[-1]] <= (radius / self.cells) ** 2 or radius >= self.cells:
+                    return self._portfolios(positions[nearest])
+            radius = radius * 2 + 1
+
+    def within(self, x_range: tuple[float, float], y_range: tuple[float, float]):
+        '''
+        Portfolios inside of rectangle, inclusive
+        '''
+        np = import_module('numpy')
+        query_x = tuple(self._normalized(value, axis=0) for value in x_range)
+        query_y = tuple(self._normalized(value, axis=1) for value in y_range)
+        positions = self._cells_slices(
+            tuple(int(np.floor(np.clip(value, 0, 1) * self.cells)) for value in query_x),
+            tuple(int(np.floor(np.clip(value, 0, 1) * self.cells)) for value in query_y))
+        inside = (self.sorted_x[positions] >= query_x[0]) & (self.sorted_x[positions] <= query_x[1]) & \
+            (self.sorted_y[positions] >= query_y[0]) & (self.sorted_y[positions] <= query_y[1])
+        return self._portfolios(positions[inside])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+from modules import data_source
+from modules.portfolio import Portfolio
+from modules.spatial_index import PortfolioIndex
+
+ASSETS = ['AAPL', 'MSFT', 'GOOG', 'AMZN']
+COORD_PAIR = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+
+
+def _random_portfolios():
+    rng = random.Random(42)
+    portfolios = []
+    for allocation in data_source.all_possible_allocations(len(ASSETS), 5):
+        portfolio = Portfolio(weights=allocation, assets=ASSETS)
+        for stat in Portfolio.SERIALIZED_STATS:
+            portfolio.stat[stat] = rng.uniform(0, 0.3)
+        portfolio.stat[Portfolio.STAT_CAGR_PERCENT] = rng.gauss(8, 3)
+        # stats are sent as float32
+        portfolios.append(Portfolio.deserialize(portfolio.serialize(), assets=ASSETS))
+    return portfolios
+
+
+@pytest.fixture(name='portfolios', scope='module')
+def fixture_portfolios():
+    return _random_portfolios()
+
+
+@pytest.fixture(name='index', scope='module')
+def fixture_index(portfolios):
+    return PortfolioIndex.from_serialized(
+        (portfolio.serialize() for portfolio in portfolios), assets=ASSETS, coord_pair=COORD_PAIR)
+
+
+@pytest.mark.parametrize('x, y, count', [
+    (0.12, 9, 1),
+    (0.12, 9, 10),
+    (0.0, 0.0, 5),
+    (1.5, 30, 3),
+    (-1, 8, 7),
+    (0.15, 8, 2000),
+])
+def test_nearest(portfolios, index, x, y, count):
+    x_scale, y_scale = index.scale
+
+    def distance(portfolio):
+        return ((portfolio.stat[COORD_PAIR[1]] - x) * x_scale) ** 2 + \
+            ((portfolio.stat[COORD_PAIR[0]] - y) * y_scale) ** 2
+
+    expected = sorted(portfolios, key=distance)[:count]
+    nearest = index.nearest(x, y, count)
+    assert len(nearest) == min(count, len(portfolios))
+    assert [distance(portfolio) for portfolio in nearest] == \
+        pytest.approx([distance(portfolio) for portfolio in expected])
+    assert nearest[0].stat == expected[0].stat
+    assert nearest[0].weights == expected[0].weights
+
+
+@pytest.mark.parametrize('x_range, y_range', [
+    ((0.1, 0.2), (5, 10)),
+    ((0.0, 0.01), (0, 100)),
+    ((-1, 1), (-100, 100)),
+    ((0.5, 1), (5, 10)),
+])
+def test_within(portfolios, index, x_range, y_range):
+    def inside(portfolio):
+        return x_range[0] <= portfolio.stat[COORD_PAIR[1]] <= x_range[1] and \
+            y_range[0] <= portfolio.stat[COORD_PAIR[0]] <= y_range[1]
+
+    expected = sorted(tuple(portfolio.weights) for portfolio in portfolios if inside(portfolio))
+    found = sorted(tuple(portfolio.weights) for portfolio in index.within(x_range, y_range))
+    assert found == expected
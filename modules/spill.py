@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import math
+import tempfile
+from importlib import import_module
+from modules.portfolio import Portfolio
+
+
+class PortfolioSpill:
+    '''
+    Columnar temporary storage for portfolios plotted without hull filter:
+    only plot coordinates and weights are kept, one file per column.
+    Files in given directory are kept after close, so spill can be restored from checkpoint.
+    '''
+
+    def __init__(
+            self, assets: list[str], coord_pair: tuple[str, str], directory: str = None,
+            stat_names: tuple[str, ...] = Portfolio.SERIALIZED_STATS):
+        self.assets = assets
+        self.coord_pair = coord_pair
+        self.stat_names = stat_names
+        self.size = 0
+        self.bounds = (math.inf, -math.inf, math.inf, -math.inf)  # min x, max x, min y, max y
+        if directory is None:
+            # pylint: disable-next=consider-using-with
+            self._directory = tempfile.TemporaryDirectory(prefix='portfolio-spill-')
+            directory = self._directory.name
+        else:
+            self._directory = None
+            os.makedirs(directory, exist_ok=True)
+        self._column_files = {
+            column: open(os.path.join(directory, column), 'a+b')  # pylint: disable=consider-using-with
+            for column in ('x', 'y', 'weights')
+        }
+
+    def close(self):
+        for column_file in self._column_files.values():
+            column_file.close()
+        if self._directory is not None:
+            self._directory.cleanup()
+
+    def checkpoint(self):
+        for column_file in self._column_files.values():
+            column_file.flush()
+        return {
+            'size': self.size,
+            'bounds': self.bounds,
+            'lengths': {column: column_file.seek(0, os.SEEK_END) for column, column_file in self._column_files.items()},
+        }
+
+    def restore(self, checkpoint: dict = None):
+        '''
+        Drop portfolios appended after checkpoint, all of them without checkpoint
+        '''
+        for column, column_file in self._column_files.items():
+            column_file.truncate(checkpoint['lengths'][column] if checkpoint else 0)
+        self.size = checkpoint['size'] if checkpoint else 0
+        self.bounds = checkpoint['bounds'] if checkpoint else (math.inf, -math.inf, math.inf, -math.inf)
+
+    def append(self, serialized_data: bytes):
+        np = import_module('numpy')
+        records = np.frombuffer(serialized_data, dtype=Portfolio.serialized_dtype(len(self.assets), self.stat_names))
+        columns = {
+            'x': records[self.coord_pair[1]].astype(np.float32),
+            'y': records[self.coord_pair[0]].astype(np.float32),
+            'weights': records['weights'].astype(np.uint8),
+        }
+        for column, values in columns.items():
+            self._column_files[column].write(values.tobytes())
+        self.size += len(records)
+        self.bounds = (
+            min(self.bounds[0], float(columns['x'].min())),
+            max(self.bounds[1], float(columns['x'].max())),
+            min(self.bounds[2], float(columns['y'].min())),
+            max(self.bounds[3], float(columns['y'].max())),
+        )
+
+    @staticmethod
+    def bytes_per_plotted_portfolio(assets_n: int):
+        '''
+        Rough memory footprint of one portfolio while its block is being plotted:
+        columns, number of assets, color, size and linewidth as float64 and temporaries
+        '''
+        return 8 * (2 + 1 + 4 + 2) * 2 + assets_n * (1 + 8)
+
+    def blocks(self, block_size: int):
+        np = import_module('numpy')
+        for column_file in self._column_files.values():
+            column_file.flush()
+            column_file.seek(0)
+        assets_n = len(self.assets)
+        while True:
+            x = np.fromfile(self._column_files['x'], dtype=np.float32, count=block_size)
+            y = np.fromfile(self._column_files['y'], dtype=np.float32, count=block_size)
+            weights = np.fromfile(self._column_files['weights'], dtype=np.uint8, count=block_size * assets_n)
+            if len(x) == 0:
+                break
+            yield x, y, weights.reshape(-1, assets_n)
+
+    def plot_blocks(self, color_map: dict[str, tuple[int, int, int]], memory_budget: int):
+        '''
+        Yield blocks of circles as arrays, same fields as Portfolio.plot_circle_data.
+        Portfolios with less assets are plotted later to stay on top, like in regular plots.
+        '''
+        np = import_module('numpy')
+        block_size = max(1, memory_budget // PortfolioSpill.bytes_per_plotted_portfolio(len(self.assets)))
+        for number_of_assets in range(len(self.assets), 0, -1):
+            for x, y, weights in self.blocks(block_size):
+                block_number_of_assets = np.count_nonzero(weights, axis=1)
+                mask = block_number_of_assets == number_of_assets
+                if not mask.any():
+                    continue
+                color = Portfolio.plot_circle_colors(weights[mask], self.assets, color_map)
+                yield {
+                    'x': x[mask],
+                    'y': y[mask],
+                    'color': color,
+                    'size': np.full(len(color), 50 / number_of_assets),
+                    'linewidth': np.full(len(color), 1 / number_of_assets),
+                }
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from modules import data_source
+from modules.portfolio import Portfolio
+from modules.spill import PortfolioSpill
+
+ASSETS = ['AAPL', 'MSFT', 'GOOG', 'AMZN']
+COLOR_MAP = {
+    'AAPL': [1.0, 0.0, 0.0],
+    'MSFT': [0.0, 0.5, 0.0],
+    'GOOG': [0.2, 0.2, 0.9],
+    'AMZN': [0.9, 0.9, 0.0],
+}
+
+
+@pytest.mark.parametrize('memory_budget', [1, 1000, 10**6])
+def test_spill_plot_blocks(memory_budget):
+    coord_pair = (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV)
+    portfolios = []
+    for idx, allocation in enumerate(data_source.all_possible_allocations(len(ASSETS), 20)):
+        portfolio = Portfolio(weights=allocation, assets=ASSETS)
+        for stat_idx, stat in enumerate(Portfolio.SERIALIZED_STATS):
+            portfolio.stat[stat] = idx + stat_idx / 10
+        portfolios.append(portfolio)
+    spill = PortfolioSpill(ASSETS, coord_pair)
+    spill.append(b''.join(portfolio.serialize() for portfolio in portfolios[:10]))
+    spill.append(b''.join(portfolio.serialize() for portfolio in portfolios[10:]))
+    assert spill.size == len(portfolios)
+
+    plotted = []
+    for block in spill.plot_blocks(COLOR_MAP, memory_budget):
+        for idx, x in enumerate(block['x']):
+            plotted.append({
+                'x': float(x),
+                'y': float(block['y'][idx]),
+                'color': tuple(float(c) for c in block['color'][idx]),
+                'size': float(block['size'][idx]),
+                'linewidth': float(block['linewidth'][idx]),
+            })
+    spill.close()
+
+    portfolios.sort(key=lambda x: -x.number_of_assets())
+    assert len(plotted) == len(portfolios)
+    # same order of plotting by number of assets
+    for circle, portfolio in zip(plotted, portfolios):
+        expected = portfolio.plot_circle_data(coord_pair, COLOR_MAP)
+        assert circle['size'] == pytest.approx(expected['size'])
+        assert circle['linewidth'] == pytest.approx(expected['linewidth'])
+    plotted.sort(key=lambda circle: circle['x'])
+    for circle, portfolio in zip(plotted, sorted(portfolios, key=lambda p: p.stat[coord_pair[1]])):
+        expected = portfolio.plot_circle_data(coord_pair, COLOR_MAP)
+        assert circle['x'] == pytest.approx(expected['x'])
+        assert circle['y'] == pytest.approx(expected['y'])
+        assert circle['color'] == pytest.approx(expected['color'])
+    assert spill.bounds == pytest.approx((
+        min(circle['x'] for circle in plotted), max(circle['x'] for circle in plotted),
+        min(circle['y'] for circle in plotted), max(circle['y'] for circle in plotted)))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from importlib import import_module
+from collections.abc import Callable
+from modules.market import MarketReturns
+from modules.rebalancing import RebalancingPolicy
+from modules.rebalancing import RebalancedGains
+
+# names of stats that every run knows, Portfolio.STAT_* refer to them
+STAT_GAIN = 'Gain(x)'
+STAT_CAGR_PERCENT = 'CAGR(%)'
+STAT_VARIANCE = 'Variance'
+STAT_STDDEV = 'Stddev'
+STAT_SHARPE = 'Sharpe'
+
+# struct codes of dtypes that stats may have, sizes are standard and records are not padded
+_STRUCT_CODES = {'float32': 'f', 'float64': 'd', 'int32': 'i', 'int64': 'q'}
+
+
+# pylint: disable=too-few-public-methods
+class Stat:
+    '''
+    Statistic of portfolio. Kernel maps gains of portfolios in every year of year range,
+    array of shape (portfolios, years), to value of every portfolio, values are averaged over year ranges.
+    Derived stat is computed by derive from averaged values of stats it requires instead.
+    Axis tells where stat is plotted: 'y' for reward, 'x' for risk, 'xy' for both.
+    '''
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    def __init__(
+            self, name: str,
+            kernel: Callable = None,
+            derive: Callable = None,
+            requires: tuple[str, ...] = (),
+            dtype: str = 'float32',
+            axis: str = ''):
+        if (kernel is None) == (derive is None):
+            raise ValueError(f'stat "{name}" needs either kernel or derive')
+        if dtype not in _STRUCT_CODES:
+            raise ValueError(f'stat "{name}" has unsupported dtype {dtype}, use one of {list(_STRUCT_CODES)}')
+        self.name = name
+        self.kernel = kernel
+        self.derive = derive
+        self.requires = tuple(requires)
+        self.dtype = dtype
+        self.axis = axis
+
+
+# every known stat by name, in order of registration that is also order of stats in records
+STATS: dict[str, Stat] = {}
+
+
+def register(stat: Stat):
+    unknown = [required for required in stat.requires if required not in STATS]
+    if unknown:
+        raise ValueError(f'stat "{stat.name}" requires stats that are not registered: {unknown}')
+    STATS[stat.name] = stat
+    return stat
+
+
+def computed_stats(stat_names: list[str]):
+    '''
+    Given stats and every stat they require, in order of registration
+    '''
+    needed = set()
+    pending = list(stat_names)
+    while pending:
+        stat_name = pending.pop()
+        if stat_name not in needed:
+            needed.add(stat_name)
+            pending.extend(STATS[stat_name].requires)
+    return [stat_name for stat_name in STATS if stat_name in needed]
+
+
+def ordered_stats(stat_names: list[str]):
+    return tuple(stat_name for stat_name in STATS if stat_name in stat_names)
+
+
+def coords_tuples(stat_names: list[str]):
+    '''
+    Pairs of stats (Y, X) to plot, every reward stat against every risk stat
+    '''
+    stat_names = ordered_stats(stat_names)
+    return [
+        (stat_y, stat_x)
+        for stat_y in stat_names if 'y' in STATS[stat_y].axis
+        for stat_x in stat_names if 'x' in STATS[stat_x].axis and stat_x != stat_y
+    ]
+
+
+def record_struct_format(stat_names: list[str], assets_n: int):
+    return '=' + ''.join(_STRUCT_CODES[STATS[stat_name].dtype] for stat_name in stat_names) + f'{assets_n}i'
+
+
+def record_dtype(stat_names: list[str], assets_n: int):
+    '''
+    Numpy structured type of serialized portfolio, fields are named by stats
+    '''
+    np = import_module('numpy')
+    return np.dtype(
+        [(stat_name, STATS[stat_name].dtype) for stat_name in stat_names] + [('weights', np.int32, (assets_n,))])
+
+
+def annual_gains(weights, asset_gain_per_year: dict[int, list[float]], rebalancing: RebalancingPolicy = None):
+    '''
+    Gain of every portfolio in every year, weights have one portfolio per row.
+    Returns sorted years and array of shape (portfolios, years).
+    Assets are summed one by one, so gains of portfolio do not depend on size of batch.
+    Portfolios that are not rebalanced every year get RebalancedGains instead of array,
+    band is checked every period of market that has periods shorter than year.
+    '''
+    np = import_module('numpy')
+    years = sorted(asset_gain_per_year.keys())
+    asset_gains = np.array([asset_gain_per_year[year] for year in years], dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, asset_gains.shape[1])
+    if rebalancing is not None and not rebalancing.is_yearly():
+        if rebalancing.band > 0 and isinstance(asset_gain_per_year, MarketReturns) and \
+                asset_gain_per_year.has_subyear_periods():
+            return years, RebalancedGains(
+                weights, asset_gain_per_year.gains, rebalancing, asset_gain_per_year.year_ends)
+        return years, RebalancedGains(weights, asset_gains, rebalancing)
+    gains = np.zeros((len(weights), len(years)), dtype=np.float64)
+    for asset_idx in range(asset_gains.shape[1]):
+        gains += weights[:, asset_idx, None] * asset_gains[:, asset_idx]
+    return years, gains / 100
+
+
+def simulated_stats(years: list[int], gains, year_range_selector_func: Callable, stat_names: list[str]):
+    '''
+    Values of given stats and stats they require for every portfolio, gains are from annual_gains
+    '''
+    np = import_module('numpy')
+    stat_names = computed_stats(stat_names)
+    year_columns = {year: column for column, year in enumerate(years)}
+    values = {
+        stat_name: np.zeros(len(gains), dtype=np.float64)
+        for stat_name in stat_names if STATS[stat_name].kernel is not None
+    }
+    year_ranges = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for year_start, year_end in year_range_selector_func(years):
+            if isinstance(gains, RebalancedGains):
+                range_gains = gains.range_gains(year_columns[year_start], year_columns[year_end])
+            else:
+                range_gains = gains[:, [year_columns[year] for year in range(year_start, year_end + 1)]]
+            for stat_name, stat_sum in values.items():
+                stat_sum += STATS[stat_name].kernel(range_gains)
+            year_ranges += 1
+        for stat_name in values:
+            values[stat_name] /= year_ranges
+        for stat_name in stat_names:
+            if STATS[stat_name].derive is not None:
+                values[stat_name] = STATS[stat_name].derive(
+                    *(values[required] for required in STATS[stat_name].requires))
+    return values
+
+
+def simulated_records(
+        weights, asset_gain_per_year: dict[int, list[float]],
+        year_range_selector_funcs: list[Callable], stat_names: list[str],
+        rebalancing: RebalancingPolicy = None):
+    '''
+    Serialized portfolios with given weights, one numpy record array for every year range selector.
+    Annual gains are computed once for all selectors.
+    '''
+    np = import_module('numpy')
+    weights = np.asarray(weights, dtype=np.int32)
+    years, gains = annual_gains(weights, asset_gain_per_year, rebalancing)
+    dtype = record_dtype(stat_names, weights.shape[1])
+    selectors_records = []
+    for year_range_selector_func in year_range_selector_funcs:
+        values = simulated_stats(years, gains, year_range_selector_func, stat_names)
+        records = np.empty(len(weights), dtype=dtype)
+        for stat_name in stat_names:
+            records[stat_name] = values[stat_name]
+        records['weights'] = weights
+        selectors_records.append(records)
+    return selectors_records
+
+
+# rows are reduced column by column, numpy reduces rows of single row and of many rows
+# in different order, and stats of portfolio must not depend on batch it was simulated in
+def _rows_sum(values):
+    total = values[:, 0].copy()
+    for column in range(1, values.shape[1]):
+        total += values[:, column]
+    return total
+
+
+def _rows_prod(values):
+    total = values[:, 0].copy()
+    for column in range(1, values.shape[1]):
+        total *= values[:, column]
+    return total
+
+
+def _geometric_mean(gains):
+    return _rows_prod(gains) ** (1 / gains.shape[1])
+
+
+def _variance(gains):
+    return _rows_sum((gains - _geometric_mean(gains)[:, None]) ** 2) / (gains.shape[1] - 1)
+
+
+def _downside_deviation(gains):
+    return (_rows_sum((gains.clip(max=1) - 1) ** 2) / gains.shape[1]) ** 0.5
+
+
+def _max_drawdown_percent(gains):
+    np = import_module('numpy')
+    wealth = gains.cumprod(axis=1)
+    peaks = np.maximum.accumulate(np.maximum(wealth, 1), axis=1)
+    return (1 - wealth / peaks).max(axis=1) * 100
+
+
+register(Stat(STAT_GAIN, kernel=_rows_prod, axis='y'))
+register(Stat(STAT_CAGR_PERCENT, kernel=lambda gains: (_geometric_mean(gains) - 1) * 100, axis='y'))
+register(Stat(STAT_VARIANCE, kernel=_variance, axis='x'))
+register(Stat(STAT_STDDEV, derive=lambda variance: variance ** 0.5, requires=(STAT_VARIANCE,), axis='x'))
+register(Stat(
+    STAT_SHARPE, derive=lambda cagr, stddev: cagr / 100 / stddev, requires=(STAT_CAGR_PERCENT, STAT_STDDEV),
+    axis='xy'))
+register(Stat('Downside', kernel=_downside_deviation, axis='x'))
+register(Stat(
+    'Sortino', derive=lambda cagr, downside: cagr / 100 / downside, requires=(STAT_CAGR_PERCENT, 'Downside'),
+    axis='y'))
+register(Stat('Max drawdown(%)', kernel=_max_drawdown_percent, axis='x'))
+register(Stat('Worst year(%)', kernel=lambda gains: (gains.min(axis=1) - 1) * 100, axis='x'))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Investment Portfolio Optimizer
+# Copyright (C) 2024  Vladimir Looze
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+from modules import stats
+from modules import data_source
+from modules import data_filter
+from modules import result_store
+from modules.portfolio import Portfolio
+
+ASSETS = ['stocks', 'bonds', 'gold']
+MARKET = {year: [random.Random(year).uniform(0.7, 1.4) for _ in ASSETS] for year in range(2000, 2012)}
+
+
+def test_default_coords_tuples():
+    assert sorted(stats.coords_tuples(Portfolio.SERIALIZED_STATS)) == sorted([
+        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_VARIANCE),
+        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV),
+        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_SHARPE),
+        (Portfolio.STAT_GAIN, Portfolio.STAT_VARIANCE),
+        (Portfolio.STAT_GAIN, Portfolio.STAT_STDDEV),
+        (Portfolio.STAT_GAIN, Portfolio.STAT_SHARPE),
+        (Portfolio.STAT_SHARPE, Portfolio.STAT_STDDEV),
+        (Portfolio.STAT_SHARPE, Portfolio.STAT_VARIANCE),
+    ])
+
+
+def test_computed_stats():
+    assert stats.computed_stats(['Sharpe']) == ['CAGR(%)', 'Variance', 'Stddev', 'Sharpe']
+    assert stats.computed_stats(['Sortino', 'Gain(x)']) == ['Gain(x)', 'CAGR(%)', 'Downside', 'Sortino']
+
+
+@pytest.mark.parametrize('stat_names', [
+    Portfolio.SERIALIZED_STATS,
+    ('CAGR(%)', 'Sortino', 'Max drawdown(%)', 'Worst year(%)'),
+    ('Stddev',),
+])
+@pytest.mark.parametrize('year_selector', ['all-to-all', 'window-3', 'first-to-last'])
+def test_batch_matches_single_portfolio(stat_names, year_selector):
+    selector_func = data_filter.year_selectors()[year_selector]
+    allocations = list(data_source.all_possible_allocations(len(ASSETS), 10))
+    records = stats.simulated_records(allocations, MARKET, [selector_func], stat_names)[0]
+    batch_portfolios = Portfolio.simulated_batch(allocations, ASSETS, [selector_func], MARKET, stat_names)[0]
+    assert records.dtype.names == (*stat_names, 'weights')
+    assert len(records.tobytes()) == len(allocations) * Portfolio.serialized_size(len(ASSETS), stat_names)
+    deserialized = list(Portfolio.deserialize_iter(records.tobytes(), ASSETS, stat_names))
+    for allocation, from_records, from_batch in zip(allocations, deserialized, batch_portfolios):
+        portfolio = Portfolio(allocation, ASSETS).simulated(selector_func, MARKET, stat_names)
+        assert list(portfolio.stat) == list(stat_names)
+        assert from_batch.stat == portfolio.stat
+        assert from_records.weights == allocation
+        assert from_records.stat == pytest.approx(portfolio.stat, rel=1e-6)
+        assert Portfolio.deserialize(portfolio.serialize(stat_names), ASSETS, stat_names).stat == from_records.stat
+
+
+def test_new_stats_values():
+    gains = {2000: [1.1], 2001: [0.5], 2002: [1.2], 2003: [2.0]}
+    portfolio = Portfolio([100], ['stocks']).simulated(
+        data_filter.year_selectors()['first-to-last'], gains, ('Max drawdown(%)', 'Worst year(%)', 'Downside'))
+    assert portfolio.stat['Max drawdown(%)'] == pytest.approx(50)
+    assert portfolio.stat['Worst year(%)'] == pytest.approx(-50)
+    assert portfolio.stat['Downside'] == pytest.approx((0.5 ** 2 / 4) ** 0.5)
+
+
+def test_register_stat():
+    stat = stats.register(stats.Stat('Best year(%)', kernel=lambda gains: (gains.max(axis=1) - 1) * 100, axis='y'))
+    try:
+        portfolio = Portfolio([50, 50, 0], ASSETS).simulated(
+            data_filter.year_selectors()['first-to-last'], MARKET, ('Best year(%)', 'Stddev'))
+        assert portfolio.stat['Best year(%)'] == pytest.approx(
+            max((gains[0] + gains[1]) / 2 for gains in MARKET.values()) * 100 - 100)
+        assert stats.coords_tuples(['Stddev', 'Best year(%)']) == [('Best year(%)', 'Stddev')]
+        with pytest.raises(ValueError):
+            stats.register(stats.Stat('Broken', derive=lambda value: value, requires=('Unknown',)))
+    finally:
+        del stats.STATS[stat.name]
+
+
+def test_entry_metadata_stats():
+    default = result_store.entry_metadata(ASSETS, MARKET, 'all-to-all', 10)
+    assert 'stats' not in default
+    assert result_store.entry_stats(default) == Portfolio.SERIALIZED_STATS
+    custom = result_store.entry_metadata(ASSETS, MARKET, 'all-to-all', 10, stat_names=('CAGR(%)', 'Sortino'))
+    assert result_store.entry_stats(custom) == ('CAGR(%)', 'Sortino')
+    assert result_store.entry_name(default) != result_store.entry_name(custom)
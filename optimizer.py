@@ -16,20 +16,36 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import sys
 import time
 import json
 import logging
 import argparse
+from collections.abc import Callable
 from collections import deque
-from functools import partial, update_wrapper
-from multiprocessing import Process
-from multiprocessing import Pipe
+from functools import partial
+from operator import methodcaller
 from modules import data_output
 from modules import data_source
 from modules import data_filter
+from modules import result_store
+from modules import batch
+from modules import distributed
+from modules import planner
+from modules import stats
+from modules import backend
+from modules import bootstrap
+from modules import renderer
+from modules import profiling
 from modules.portfolio import Portfolio
+from modules.constraints import AllocationConstraints
+from modules.rebalancing import RebalancingPolicy
+from modules.spatial_index import PortfolioIndex
+from modules.checkpoint import RunCheckpoints
 from modules.plotter import plotter_process_func
+from modules.plotter import plotter_checkpoint_name
+from modules.simulator import simulated_portfolios
 from modules.simulator import simulator_process_func
 
 
@@ -40,21 +56,37 @@ logging.basicConfig(
 )
 
 
+def _stat_values(text: str, value_type: Callable):
+    '''
+    Parse "Stddev=0.12,CAGR(%)=9" into {"Stddev": value_type("0.12"), "CAGR(%)": value_type("9")}
+    '''
+    stat_values = {}
+    for stat_value in text.split(','):
+        stat, _, value = stat_value.partition('=')
+        if stat not in stats.STATS:
+            raise argparse.ArgumentTypeError(f'unknown stat "{stat}", use one of {list(stats.STATS)}')
+        stat_values[stat] = value_type(value)
+    if len(stat_values) != 2:
+        raise argparse.ArgumentTypeError('exactly two stats are required')
+    return stat_values
+
+
+def _stat_range(text: str):
+    low, _, high = text.partition(':')
+    return float(low), float(high)
+
+
+def _rebalancing_policy(text: str):
+    try:
+        return RebalancingPolicy.parse(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-branches
 def _parse_args(argv=None):
-    year_selectors = {
-        'first-to-last': data_filter.years_first_to_last,
-        'first-to-all': data_filter.years_first_to_all,
-        'window-3': partial(data_filter.years_sliding_window, window_size=3),
-        'window-5': partial(data_filter.years_sliding_window, window_size=5),
-        'window-10': partial(data_filter.years_sliding_window, window_size=10),
-        'window-20': partial(data_filter.years_sliding_window, window_size=20),
-        'all-to-last': data_filter.years_all_to_last,
-        'all-to-all': data_filter.years_all_to_all,
-    }
-    update_wrapper(year_selectors['window-3'], data_filter.years_sliding_window)
-    update_wrapper(year_selectors['window-5'], data_filter.years_sliding_window)
-    update_wrapper(year_selectors['window-10'], data_filter.years_sliding_window)
-    update_wrapper(year_selectors['window-20'], data_filter.years_sliding_window)
+    year_selectors = data_filter.year_selectors()
     parser = argparse.ArgumentParser(
         argv,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -70,6 +102,15 @@ def _parse_args(argv=None):
         '--hull', type=int, default=0,
         help='filter portfolios: use hull algorithm to plot only given ConvexHull layers '
              'of portfolios in coordinate space. Set to 0 to disable filter.')
+    parser.add_argument(
+        '--hull-points', type=int, default=0,
+        help='draw at most given number of portfolios of every hull layer, layers are simplified by --hull-lod '
+             'keeping portfolios with extreme coordinates. Static and edge portfolios are always drawn. '
+             'Set to 0 to draw every hull portfolio.')
+    parser.add_argument(
+        '--hull-lod', choices=list(data_filter.LOD_REDUCERS), default='rdp',
+        help='rdp - simplify outline of every hull layer by Ramer-Douglas-Peucker, '
+             'grid - keep one portfolio per cell of grid in plot coordinates')
     parser.add_argument(
         '--edge', type=int, default=0,
         help='filter portfolios: show edges of portfolio space '
@@ -78,11 +119,44 @@ def _parse_args(argv=None):
              'Set to 1 to see pure portfolios (100%% of one asset). '
              'Set to 2 to see edge lines connecting pure portfolios. ')
     parser.add_argument(
-        '--years', choices=year_selectors.keys(),
-        default=list(year_selectors.keys())[0],
+        '--plotter-memory', type=int, default=None,
+        help='memory budget of each plotter in megabytes when --hull=0. '
+             'Portfolios are kept in temporary files and plotted in blocks that fit the budget, '
+             'portfolio cloud is rendered as image without tooltips. Set to 0 to keep portfolios in memory.')
+    parser.add_argument(
+        '--render', choices=['circles', 'density'], default='circles',
+        help='circles - plot every portfolio as circle with tooltip, '
+             'density - plot portfolio cloud as single image of 2-D histogram colored by mean asset mix, '
+             'only hull, edge and static portfolios are plotted as circles with tooltips on top of it')
+    parser.add_argument(
+        '--output', choices=['svg', 'html'], default='svg',
+        help='svg - interactive SVG with tooltip pre-rendered for every circle, '
+             'html - PNG with embedded circle data, tooltips are built in browser, '
+             'considerably smaller and faster for thousands of circles')
+    parser.add_argument(
+        '--render-workers', type=int, default=0,
+        help='number of workers that render plot files once all portfolios are simulated, '
+             'PNG and SVG of every plot are rendered in parallel, 0 - one worker per core')
+    parser.add_argument(
+        '--years', choices=list(year_selectors.keys()) + ['all'], nargs='+',
+        default=[list(year_selectors.keys())[0]],
         help=', '.join(['Select year ranges to average simulation data from'] +
-            [f'{opt} - {func.__doc__}' for opt, func in year_selectors.items()])
+            [f'{opt} - {func.__doc__}' for opt, func in year_selectors.items()] +
+            ['all - every selector above. '
+             'Several selectors are simulated in single pass, '
+             'plots of each one go to its own subdirectory of result'])
     )
+    parser.add_argument(
+        '--stats', choices=list(stats.STATS), nargs='+', default=None,
+        help='stats to simulate and send to plotters, every reward stat is plotted against every risk stat. '
+             'Stats that are not chosen are not computed unless chosen ones require them, '
+             'results are stored and reused only with the same stats')
+    parser.add_argument(
+        '--rebalancing', type=_rebalancing_policy, default='yearly',
+        help='yearly - sell and buy back every asset at portfolio weights every year, '
+             'hold - buy once and never rebalance, every-N - rebalance every N years, '
+             'band-P - rebalance when weight of any asset drifts more than P percentage points from portfolio weight, '
+             'checked every period of returns. Results are stored and reused only with the same rebalancing')
 
     parser.add_argument(
         '--config-colors', default='config_colors.json',
@@ -90,36 +164,257 @@ def _parse_args(argv=None):
     parser.add_argument(
         '--config-portfolios', default='config_portfolios.json',
         help='path to json with static portfolios')
+    parser.add_argument(
+        '--config-constraints', default=None,
+        help='path to json with allocation constraints, config_constraints.json by default')
     parser.add_argument(
         '--config-returns', default='config_returns.csv',
-        help='path to csv with yearly returns for assets')
+        help='path to csv with returns for assets, one row per year, month, day or any other period')
+    parser.add_argument(
+        '--returns-cache', default='',
+        help='path to directory where parsed returns are cached and memory-mapped by later runs, '
+             'cache is parsed again when csv changes. Set to empty string to parse csv every run.')
+    parser.add_argument(
+        '--run-dir', default='',
+        help='path to directory for checkpoints of this run: state of every plotter and store writer '
+             'is saved there after every --checkpoint-every simulated portfolios. '
+             'Set to empty string to disable checkpoints.')
+    parser.add_argument(
+        '--checkpoint-every', type=int, default=2**22,
+        help='number of simulated portfolios between checkpoints of --run-dir')
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='continue run from the last checkpoint in --run-dir instead of starting over, '
+             'run must have the same options and market data')
+    parser.add_argument(
+        '--coordinator', type=distributed.parse_address, default=None,
+        help='simulate on workers instead of local cores: listen on given "host:port", '
+             'hand out ranges of allocations to workers started with --worker and plot their results. '
+             'Workers send back only portfolios on --hull layers of every plot.')
+    parser.add_argument(
+        '--worker', type=distributed.parse_address, default=None,
+        help='run as worker of coordinator listening on given "host:port", '
+             'simulate ranges of allocations it hands out on every local core')
+    parser.add_argument(
+        '--auth-key', default=None,
+        help='shared secret of coordinator and workers, required by --coordinator and --worker. '
+             f'Read from {distributed.AUTH_KEY_ENV} environment variable when not given, '
+             'so it is not visible in process list. Every message is unpickled, keep it secret.')
     parser.add_argument(
-        '--chunk', type=int, default=2**16,
+        '--range-size', type=int, default=2**20,
+        help='number of allocations coordinator hands out to worker at once')
+    parser.add_argument(
+        '--worker-timeout', type=float, default=None,
+        help='seconds coordinator waits for worker to finish range before giving it to another worker, '
+             'disconnected workers are detected without timeout')
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='do not run, print number of portfolios, bytes sent through pipes, memory of plotters '
+             'and runtime projected from simulating a sample of allocations on this machine')
+    parser.add_argument(
+        '--batch', default='',
+        help='path to json manifest of scenarios to run instead of plotting: every scenario gives '
+             'returns csv and optionally assets, precision and years. Scenarios share one process pool '
+             'and one enumeration of allocations, frontiers of all scenarios are written to result/batch')
+    parser.add_argument(
+        '--chunk', type=int, default=None,
         help='chunk size for data pipeline')
+    parser.add_argument(
+        '--fanout-depth', type=int, default=16,
+        help='number of chunks buffered for every plotter and store writer, '
+             'slow one holds back simulation and other plotters only when its buffer is full')
+    parser.add_argument(
+        '--fanout-memory', type=int, default=None,
+        help='memory limit of all fan-out buffers in megabytes, chunk held by several buffers is counted once. '
+             'Set to 0 to limit buffers by --fanout-depth only.')
+    parser.add_argument(
+        '--max-memory', type=int, default=0,
+        help='memory budget of whole run in megabytes: --chunk, --fanout-memory and --plotter-memory '
+             'are derived from it, plotters filter kept hull portfolios more often while over their share. '
+             'Can not be used with these options. Set to 0 to use them as given.')
+    parser.add_argument(
+        '--backend', choices=list(backend.BACKENDS), default='process',
+        help='process - simulator pool, multiplexer and every plotter are separate processes connected by pipes, '
+             'thread - all of them are threads of one process that share market data and chunks without pipes, '
+             'faster where numpy kernels release GIL and on free-threaded Python')
+    parser.add_argument(
+        '--profile', default='',
+        help='path to directory for profiles of this run: every process, including pool workers, '
+             'writes its own cProfile stats tagged with its role and PID, they are merged by role '
+             'into summary.txt there once run is done. Set to empty string to disable profiling.')
+    parser.add_argument(
+        '--profile-memory', action='store_true',
+        help='with --profile, trace allocations of every process and report peak of every role, '
+             'slows run down considerably')
+    parser.add_argument(
+        '--store', default='',
+        help='path to directory with stored simulation results. '
+             'Results of previous runs with the same returns are reused '
+             'even if assets were added or removed. Set to empty string to disable store.')
+    parser.add_argument(
+        '--nearest', type=partial(_stat_values, value_type=float), default=None,
+        help='query stored results instead of plotting: print portfolios nearest to given point, '
+             'e.g. "Stddev=0.12,CAGR(%%)=9". Distance is measured in coordinates normalized by their range. '
+             'Requires --store with results of the same run.')
+    parser.add_argument(
+        '--nearest-count', type=int, default=5,
+        help='number of portfolios to print for --nearest')
+    parser.add_argument(
+        '--within', type=partial(_stat_values, value_type=_stat_range), default=None,
+        help='query stored results instead of plotting: print portfolios inside of given ranges, '
+             'e.g. "Stddev=0.1:0.15,CAGR(%%)=8:10". Requires --store with results of the same run.')
+    parser.add_argument(
+        '--bootstrap', type=int, default=0,
+        help='resample market into given number of synthetic histories instead of plotting: '
+             'mean and percentile bands of every stat of every portfolio over histories are written '
+             'to result/bootstrap, bands of static portfolios are printed. Set to 0 to disable.')
+    parser.add_argument(
+        '--bootstrap-block', type=int, default=5,
+        help='number of consecutive years resampled together for --bootstrap')
+    parser.add_argument(
+        '--bootstrap-seed', type=int, default=0,
+        help='random seed of --bootstrap, the same seed gives the same histories')
     args = parser.parse_args()
-    args.years = year_selectors[args.years]
+    if args.resume and not args.run_dir:
+        parser.error('--resume requires --run-dir')
+    if args.coordinator or args.worker:
+        args.auth_key = args.auth_key or os.environ.get(distributed.AUTH_KEY_ENV)
+        if not args.auth_key:
+            parser.error(f'--coordinator and --worker require --auth-key or {distributed.AUTH_KEY_ENV} '
+                         'environment variable with shared secret')
+    memory_options = {'chunk': 2**16, 'fanout_memory': 256, 'plotter_memory': 0}
+    given_memory_options = [f'--{name.replace("_", "-")}' for name in memory_options if getattr(args, name) is not None]
+    if args.max_memory > 0 and given_memory_options:
+        parser.error(f'{", ".join(given_memory_options)} can not be used with --max-memory that derives them')
+    for name, default in memory_options.items():
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    batch_options = {'stats': list(Portfolio.SERIALIZED_STATS), 'config_constraints': 'config_constraints.json'}
+    given_batch_options = [f'--{name.replace("_", "-")}' for name in batch_options if getattr(args, name) is not None]
+    if args.batch and given_batch_options:
+        parser.error(f'{", ".join(given_batch_options)} can not be used with --batch, '
+                     'scenarios are simulated with default stats and without constraints')
+    for name, default in batch_options.items():
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    if args.coordinator and (args.run_dir or args.store or args.render == 'density'):
+        parser.error('--coordinator can not be used with --run-dir, --store or --render density, '
+                     'workers send back only hull portfolios')
+    args.stats = stats.ordered_stats(args.stats)
+    for query in (args.nearest, args.within):
+        if query is not None and not set(query) <= set(args.stats):
+            parser.error(f'queried stats {list(query)} must be among --stats {list(args.stats)}')
+    if not stats.coords_tuples(args.stats):
+        parser.error(f'--stats {list(args.stats)} have no reward and risk stat to plot against each other')
+    args.year_selectors = list(year_selectors.keys()) if 'all' in args.years else list(dict.fromkeys(args.years))
+    args.years = [year_selectors[year_selector] for year_selector in args.year_selectors]
+    if args.batch and len(args.year_selectors) > 1:
+        parser.error(f'--batch takes single --years selector as default of scenarios, got {args.year_selectors}')
     return args
 
 
+def _query_index(stored: dict, query: str, stat_values: dict[str, float], nearest_count: int):
+    (stat_x, value_x), (stat_y, value_y) = stat_values.items()
+    time_start = time.time()
+    portfolio_index = PortfolioIndex.from_store_entry(stored, coord_pair=(stat_y, stat_x))
+    time_built = time.time()
+    if query == 'nearest':
+        portfolios = portfolio_index.nearest(value_x, value_y, nearest_count)
+    else:
+        portfolios = portfolio_index.within(value_x, value_y)
+    logging.info('%s: %d portfolios, index built in %.2fs, queried in %.2fms',
+                 query, len(portfolios), time_built - time_start, (time.time() - time_built) * 1000)
+    for portfolio in portfolios:
+        logging.info('%s', portfolio)
+
+
+def _query_store(cmdline_args, market_assets: list[str], market_yearly_gain: dict[int, list[float]]):
+    stored_entries = []
+    for year_selector in cmdline_args.year_selectors:
+        store_metadata = result_store.entry_metadata(
+            assets=market_assets,
+            asset_gain_per_year=market_yearly_gain,
+            year_selector=year_selector,
+            percentage_step=cmdline_args.precision,
+            stat_names=cmdline_args.stats,
+            rebalancing=cmdline_args.rebalancing)
+        stored = result_store.find_reusable_entry(cmdline_args.store, store_metadata) if cmdline_args.store else None
+        if stored is None or set(stored['assets']) != set(market_assets):
+            logging.error('No stored results of %s for this run in "%s", run with --store first',
+                          year_selector, cmdline_args.store)
+            return
+        stored_entries.append(stored)
+    for year_selector, stored in zip(cmdline_args.year_selectors, stored_entries):
+        logging.info('%s portfolios of %s', year_selector, stored['path'])
+        for query, stat_values in (('nearest', cmdline_args.nearest), ('within', cmdline_args.within)):
+            if stat_values is not None:
+                _query_index(stored, query, stat_values, cmdline_args.nearest_count)
+
+
+def _run_batch(cmdline_args):
+    with open(cmdline_args.batch, 'r', encoding='utf-8') as json_file:
+        manifest = json.load(json_file)
+    if not isinstance(manifest, list) or len(manifest) == 0:
+        logging.error('Manifest %s must be a non-empty list of scenarios', cmdline_args.batch)
+        return
+    # every returns file is parsed once, however many scenarios use it
+    markets = {}
+    for scenario in manifest:
+        scenario_error = batch.scenario_config_error(scenario)
+        if scenario_error != '':
+            logging.error('Invalid scenario: %s', scenario_error)
+            return
+        if scenario['returns'] not in markets:
+            try:
+                markets[scenario['returns']] = data_source.read_capitalgain_csv_data(scenario['returns'])
+            except ValueError as error:
+                logging.error('Invalid returns: %s', error)
+                return
+        scenario_error = batch.scenario_assets_error(scenario, markets[scenario['returns']][0])
+        if scenario_error != '':
+            logging.error('Invalid scenario: %s', scenario_error)
+            return
+    scenario_names = [scenario['name'] for scenario in manifest]
+    if len(set(scenario_names)) != len(scenario_names):
+        logging.error('Scenario names in %s are not unique', cmdline_args.batch)
+        return
+    scenarios = [
+        batch.load_scenario(
+            scenario, markets[scenario['returns']], cmdline_args.precision, cmdline_args.year_selectors[0])
+        for scenario in manifest
+    ]
+    batch.run_batch(scenarios, directory='result/batch', rebalancing=cmdline_args.rebalancing)
+
+
 # pylint: disable=too-many-locals
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-return-statements
 def main(argv):
     cmdline_args = _parse_args(argv)
-    coords_tuples = [
-        # Y, X
-        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_VARIANCE),
-        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_STDDEV),
-        (Portfolio.STAT_CAGR_PERCENT, Portfolio.STAT_SHARPE),
-        (Portfolio.STAT_GAIN, Portfolio.STAT_VARIANCE),
-        (Portfolio.STAT_GAIN, Portfolio.STAT_STDDEV),
-        (Portfolio.STAT_GAIN, Portfolio.STAT_SHARPE),
-        (Portfolio.STAT_SHARPE, Portfolio.STAT_STDDEV),
-        (Portfolio.STAT_SHARPE, Portfolio.STAT_VARIANCE),
-    ]
+    if cmdline_args.profile:
+        profiling.profile_run(cmdline_args.profile, cmdline_args.profile_memory)
+    # Y, X
+    coords_tuples = stats.coords_tuples(cmdline_args.stats)
 
     time_start = time.time()
 
-    market_assets, market_yearly_gain = \
-        data_source.read_capitalgain_csv_data(cmdline_args.config_returns)
+    if cmdline_args.worker:
+        distributed.worker_main(cmdline_args.worker, cmdline_args.auth_key.encode('utf-8'))
+        logging.info('+%.2fs :: worker done', time.time() - time_start)
+        return
+
+    if cmdline_args.batch:
+        _run_batch(cmdline_args)
+        logging.info('+%.2fs :: batch ready', time.time() - time_start)
+        return
+
+    try:
+        market_assets, market_yearly_gain = \
+            data_source.read_capitalgain_csv_data(cmdline_args.config_returns, cmdline_args.returns_cache)
+    except ValueError as error:
+        logging.error('Invalid returns: %s', error)
+        return
     with open(cmdline_args.config_colors, 'r', encoding='utf-8') as json_file:
         config_colors = json.load(json_file)
     with open(cmdline_args.config_portfolios, 'r', encoding='utf-8') as json_file:
@@ -138,63 +433,305 @@ def main(argv):
                       cmdline_args.asset_returns_csv, set(market_assets) - set(config_colors.keys()))
         return
 
+    with open(cmdline_args.config_constraints, 'r', encoding='utf-8') as json_file:
+        config_constraints = json.load(json_file)
+    constraints_error = AllocationConstraints.config_error(config_constraints, market_assets)
+    if constraints_error != '':
+        logging.error('Invalid constraints: %s', constraints_error)
+        return
+    constraints = AllocationConstraints.from_config(config_constraints, market_assets)
+
+    if cmdline_args.nearest or cmdline_args.within:
+        _query_store(cmdline_args, market_assets, market_yearly_gain)
+        return
+
+    memory_settings = {
+        'chunk_size': cmdline_args.chunk,
+        'fanout_memory': cmdline_args.fanout_memory * 2**20,
+        'hull_collapse_rows': 0,
+        'plotter_memory': 0,
+        'spill_memory': cmdline_args.plotter_memory * 2**20,
+    }
+    if cmdline_args.max_memory > 0:
+        try:
+            memory_settings = planner.memory_budget_settings(
+                max_memory=cmdline_args.max_memory * 2**20,
+                assets_n=len(market_assets),
+                years_n=len(market_yearly_gain),
+                plotters=len(coords_tuples),
+                consumers=len(coords_tuples) + (1 if cmdline_args.store else 0),
+                fanout_depth=cmdline_args.fanout_depth,
+                stat_names=cmdline_args.stats,
+                backend=cmdline_args.backend)
+        except ValueError as error:
+            logging.error('Invalid --max-memory: %s', error)
+            return
+        # portfolios are spilled only when every one of them is plotted as circle
+        if cmdline_args.hull > 0 or cmdline_args.render != 'circles':
+            memory_settings['spill_memory'] = 0
+        logging.info('memory budget %dMiB: chunk of %d portfolios, fan-out buffers %.1fMiB, '
+                     'plotters filter hull again every %d portfolios',
+                     cmdline_args.max_memory, memory_settings['chunk_size'], memory_settings['fanout_memory'] / 2**20,
+                     memory_settings['hull_collapse_rows'])
+
+    if cmdline_args.plan:
+        planner.report_plan(planner.plan_run(
+            assets=market_assets,
+            percentage_step=cmdline_args.precision,
+            year_selectors=cmdline_args.year_selectors,
+            asset_gain_per_year=market_yearly_gain,
+            constraints=constraints,
+            coords_tuples=coords_tuples,
+            hull_layers=cmdline_args.hull,
+            chunk_size=memory_settings['chunk_size'],
+            memory_budget=memory_settings['spill_memory'],
+            render=cmdline_args.render,
+            store=bool(cmdline_args.store),
+            stat_names=cmdline_args.stats,
+            rebalancing=cmdline_args.rebalancing))
+        return
+
     static_portfolios_aligned_to_market = list(map(
         partial(Portfolio.aligned_to_market, market_assets=market_assets),
         config_portfolios))
-    static_portfolios_simulated = list(map(
-        partial(Portfolio.simulated,
-                year_range_selector_func=cmdline_args.years,
-                asset_gain_per_year=market_yearly_gain),
-        static_portfolios_aligned_to_market))
-    logging.info('%d static portfolios will be plotted on all graphs', len(static_portfolios_simulated))
+    # static portfolios simulated with every year range selector
+    static_portfolios_simulated = [list(selector_portfolios) for selector_portfolios in zip(*map(
+        partial(Portfolio.simulated_for_selectors,
+                year_range_selector_funcs=cmdline_args.years,
+                asset_gain_per_year=market_yearly_gain,
+                stat_names=cmdline_args.stats,
+                rebalancing=cmdline_args.rebalancing),
+        static_portfolios_aligned_to_market))] or [[] for _ in cmdline_args.years]
+
+    if cmdline_args.bootstrap > 0:
+        bootstrap.run_bootstrap(
+            assets=market_assets,
+            percentage_step=cmdline_args.precision,
+            year_selectors=cmdline_args.year_selectors,
+            year_range_selector_funcs=cmdline_args.years,
+            asset_gain_per_year=market_yearly_gain,
+            static_portfolios=static_portfolios_aligned_to_market,
+            directory='result/bootstrap',
+            histories=cmdline_args.bootstrap,
+            block_size=cmdline_args.bootstrap_block,
+            seed=cmdline_args.bootstrap_seed,
+            constraints=constraints,
+            stat_names=cmdline_args.stats,
+            rebalancing=cmdline_args.rebalancing)
+        logging.info('+%.2fs :: bootstrap ready', time.time() - time_start)
+        return
+    logging.info('%d static portfolios will be plotted on all graphs', len(static_portfolios_aligned_to_market))
+
+    # without hull filter every portfolio is plotted anyway, edges included
+    edge_portfolios_simulated = None
+    if cmdline_args.edge > 0 and cmdline_args.hull > 0:
+        edge_portfolios_simulated = simulated_portfolios(
+            assets=market_assets,
+            percentage_step=cmdline_args.precision,
+            year_range_selector_funcs=cmdline_args.years,
+            asset_gain_per_year=market_yearly_gain,
+            constraints=constraints.with_max_assets(cmdline_args.edge),
+            stat_names=cmdline_args.stats,
+            rebalancing=cmdline_args.rebalancing)
+        logging.info('%d edge portfolios will be plotted on all graphs', len(edge_portfolios_simulated[0]))
 
     process_wait_list = []
+    store_sinks = []
+
+    reusable_entries = None
+    store_writer_metadatas = None
+    if cmdline_args.store:
+        store_metadatas = [
+            result_store.entry_metadata(
+                assets=market_assets,
+                asset_gain_per_year=market_yearly_gain,
+                year_selector=year_selector,
+                percentage_step=cmdline_args.precision,
+                stat_names=cmdline_args.stats,
+                rebalancing=cmdline_args.rebalancing)
+            for year_selector in cmdline_args.year_selectors
+        ]
+        stored_entries = [
+            result_store.find_reusable_entry(cmdline_args.store, store_metadata)
+            for store_metadata in store_metadatas
+        ]
+        # reused portfolios are shared by all selectors, so every selector needs entry with the same assets
+        if all(stored is not None for stored in stored_entries) and \
+                len(set(frozenset(stored['assets']) for stored in stored_entries)) == 1:
+            reusable_entries = stored_entries
+        # constrained runs do not simulate whole simplex and can not be reused
+        if constraints.is_unconstrained() and \
+                (reusable_entries is None or set(reusable_entries[0]['assets']) != set(market_assets)):
+            store_writer_metadatas = store_metadatas
+
+    checkpoints, resume_from = None, None
+    if cmdline_args.run_dir:
+        run_metadata = {
+            'market': result_store.entry_metadata(
+                assets=market_assets,
+                asset_gain_per_year=market_yearly_gain,
+                year_selector=cmdline_args.year_selectors,
+                percentage_step=cmdline_args.precision,
+                stat_names=cmdline_args.stats,
+                rebalancing=cmdline_args.rebalancing),
+            'constraints': config_constraints,
+            'hull': cmdline_args.hull,
+            'render': cmdline_args.render,
+            'plotter_memory': memory_settings['spill_memory'],
+            'store': cmdline_args.store,
+            'checkpoint_every': cmdline_args.checkpoint_every,
+        }
+        # normalized like after reading from json
+        run_metadata = json.loads(json.dumps(run_metadata))
+        previous_run = RunCheckpoints(cmdline_args.run_dir, []).run_metadata() if cmdline_args.resume else None
+        if cmdline_args.resume and (previous_run is None or previous_run['run'] != run_metadata):
+            logging.error('Run directory "%s" has no checkpoints of this run, start it without --resume',
+                          cmdline_args.run_dir)
+            return
+        if previous_run is not None:
+            # stored results could change since run was started, keep its decisions
+            reusable_entries = previous_run['reused_entries']
+            store_writer_metadatas = previous_run['store_writer_metadatas']
+        checkpoints = RunCheckpoints(
+            cmdline_args.run_dir,
+            [plotter_checkpoint_name(coord_pair) for coord_pair in coords_tuples] +
+            ([result_store.STORE_CHECKPOINT_NAME] if store_writer_metadatas is not None else []))
+        resume_from = checkpoints.resume_point() if previous_run is not None else None
+        if resume_from is None:
+            checkpoints.reset({
+                'run': run_metadata,
+                'reused_entries': reusable_entries,
+                'store_writer_metadatas': store_writer_metadatas,
+            })
+        else:
+            logging.info('Resuming from checkpoint: %d portfolios simulated', resume_from)
+
+    pipe, stage = backend.pipeline_runtime(cmdline_args.backend)
+    if cmdline_args.backend == 'thread':
+        logging.info('Pipeline runs in threads of one process, GIL is %s',
+                     'enabled' if backend.gil_enabled() else 'disabled')
+    if store_writer_metadatas is not None:
+        store_source, store_sink = pipe()
+        store_sinks.append(store_sink)
+        process_wait_list.append(stage(
+            target=profiling.profiled(result_store.store_writer_process_func, 'store-writer'),
+            kwargs={
+                'directory': cmdline_args.store,
+                'metadatas': store_writer_metadatas,
+                'source': store_source,
+                'checkpoints': checkpoints,
+                'resume_from': resume_from,
+            }
+        ))
 
     logging.info('+%.2fs :: preparing portfolio simulation data pipeline...', time.time() - time_start)
-    simulated_source, simulated_sink = Pipe(duplex=False)
-    process_wait_list.append(Process(
-        target=simulator_process_func,
+    simulated_source, simulated_sink = pipe()
+    if cmdline_args.coordinator:
+        process_wait_list.append(stage(
+            target=profiling.profiled(distributed.coordinator_process_func, 'coordinator'),
+            kwargs={
+                'address': cmdline_args.coordinator,
+                'authkey': cmdline_args.auth_key.encode('utf-8'),
+                'assets': market_assets,
+                'percentage_step': cmdline_args.precision,
+                'year_selectors': cmdline_args.year_selectors,
+                'asset_gain_per_year': market_yearly_gain,
+                'sink': simulated_sink,
+                'chunk_size': memory_settings['chunk_size'],
+                'reusable_entries': reusable_entries,
+                'constraints': constraints,
+                'coords_tuples': coords_tuples,
+                'hull_layers': cmdline_args.hull,
+                'range_size': cmdline_args.range_size,
+                'worker_timeout': cmdline_args.worker_timeout,
+                'stat_names': cmdline_args.stats,
+                'rebalancing': cmdline_args.rebalancing,
+            }
+        ))
+    else:
+        process_wait_list.append(stage(
+            target=profiling.profiled(simulator_process_func, 'simulator'),
+            kwargs={
+                'assets': market_assets,
+                'percentage_step': cmdline_args.precision,
+                'year_range_selector_funcs': cmdline_args.years,
+                'asset_gain_per_year': market_yearly_gain,
+                'sink': simulated_sink,
+                'chunk_size': memory_settings['chunk_size'],
+                'reusable_entries': reusable_entries,
+                'constraints': constraints,
+                'checkpoint_every': cmdline_args.checkpoint_every if checkpoints else 0,
+                'resume_from': resume_from,
+                'stat_names': cmdline_args.stats,
+                'backend': cmdline_args.backend,
+                'rebalancing': cmdline_args.rebalancing,
+            }
+        ))
+    coodr_pair_pipes = {
+        coord_pair: dict(zip(('source', 'sink'), pipe())) for coord_pair in coords_tuples
+    }
+    process_wait_list.append(stage(
+        target=profiling.profiled(data_filter.queue_multiplexer, 'multiplexer'),
         kwargs={
-            'assets': market_assets,
-            'percentage_step': cmdline_args.precision,
-            'year_range_selector_func': cmdline_args.years,
-            'asset_gain_per_year': market_yearly_gain,
-            'sink': simulated_sink,
-            'chunk_size': cmdline_args.chunk,
+            'source': simulated_source,
+            'sinks': list(pipe['sink'] for pipe in coodr_pair_pipes.values()) + store_sinks,
+            'depth': cmdline_args.fanout_depth,
+            'memory_limit': memory_settings['fanout_memory'],
+            'sink_names': (
+                [plotter_checkpoint_name(coord_pair) for coord_pair in coords_tuples] +
+                [result_store.STORE_CHECKPOINT_NAME] * len(store_sinks)),
         }
     ))
-    coodr_pair_pipes = {
-        coord_pair: dict(zip(('source', 'sink'), Pipe(duplex=False))) for coord_pair in coords_tuples
+    render_pipes = {
+        coord_pair: dict(zip(('source', 'sink'), pipe())) for coord_pair in coords_tuples
     }
-    process_wait_list.append(Process(
-        target=data_filter.queue_multiplexer,
+    process_wait_list.append(stage(
+        target=profiling.profiled(renderer.renderer_process_func, 'renderer'),
         kwargs={
-            'source': simulated_source,
-            'sinks': list(pipe['sink'] for pipe in coodr_pair_pipes.values()),
+            'sources': [render_pipe['source'] for render_pipe in render_pipes.values()],
+            'asset_color_map': config_colors,
+            'output': cmdline_args.output,
+            'workers': cmdline_args.render_workers,
+            'backend': cmdline_args.backend,
         }
     ))
     for coord_pair in coords_tuples:
-        process_wait_list.append(Process(
-            target=plotter_process_func,
+        process_wait_list.append(stage(
+            target=profiling.profiled(plotter_process_func, 'plotter'),
             kwargs={
                 'assets': market_assets,
                 'source': coodr_pair_pipes[coord_pair]['source'],
                 'persistent_portfolios': static_portfolios_simulated,
+                'edge_portfolios': edge_portfolios_simulated,
                 'coord_pair': coord_pair,
                 'hull_layers': cmdline_args.hull,
-                'edge_layers': cmdline_args.edge,
                 'color_map': config_colors,
+                'memory_budget': memory_settings['spill_memory'],
+                'render': cmdline_args.render,
+                'output': cmdline_args.output,
+                'year_selectors': cmdline_args.year_selectors,
+                'checkpoints': checkpoints,
+                'resume_from': resume_from,
+                'stat_names': cmdline_args.stats,
+                'max_memory': memory_settings['plotter_memory'],
+                'hull_collapse_portfolios': memory_settings['hull_collapse_rows'],
+                'hull_points': cmdline_args.hull_points,
+                'hull_lod': cmdline_args.hull_lod,
+                'render_sink': render_pipes[coord_pair]['sink'],
             }
         ))
 
     logging.info('+%.2fs :: data pipeline prepared', time.time() - time_start)
 
-    deque(map(Process.start, process_wait_list), 0)
+    deque(map(methodcaller('start'), process_wait_list), 0)
     logging.info('+%.2fs :: all processes started', time.time() - time_start)
 
-    deque(map(Process.join, process_wait_list), 0)
+    deque(map(methodcaller('join'), process_wait_list), 0)
     logging.info('+%.2fs :: graphs ready', time.time() - time_start)
 
+    if checkpoints is not None and all(stage.exitcode == 0 for stage in process_wait_list):
+        checkpoints.finish()
+
 
 if __name__ == '__main__':
     if sys.version_info <= (3, 12):